@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session, joinedload
 from app.database import get_db
 from app import models
+from app.utils.admin_kpis import admin_kpis
+from app.utils.search_rollups import query_rollups, GRANULARITIES, GROUP_BY_COLUMNS
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime, timedelta
 import uuid  # <-- تم إضافة مكتبة التوليد العشوائي
 
 router = APIRouter()
@@ -33,35 +36,24 @@ def get_admin_stats(db: Session = Depends(get_db)):
     """
     تحليل الأداء المالي الآمن (Crash-Proof):
     يعالج حالات الجداول الفارغة لمنع الأخطاء الحسابية.
+    الأرقام تأتي من نسخة مخزنة (KPI Snapshot) تتجدد كل بضع ثوانٍ أو فور أي تغيير.
     """
-    # 1. العدادات البسيطة
-    total_users = db.query(models.User).count()
-    total_leads = db.query(models.Lead).count()
-    
-    # 2. حساب الإيرادات (استخدام 'or 0' للحماية من القيم الفارغة)
-    total_revenue = db.query(func.sum(models.PaymentRequest.amount))\
-        .filter(models.PaymentRequest.status == "Approved").scalar() or 0
-    
-    # 3. حساب المصروفات (استخدام 'or 0' للحماية)
-    total_expenses = db.query(func.sum(models.Expense.amount)).scalar() or 0
+    kpis, meta = admin_kpis.get(db)
+
+    # 1. العدادات والمجاميع (محمية من القيم الفارغة داخل الخدمة)
+    total_revenue = kpis["total_revenue"]
+    total_expenses = kpis["total_expenses"]
     
-    # 4. صافي الربح (الآن الطرح آمن لأن الطرفين أرقام)
+    # 2. صافي الربح
     net_profit = total_revenue - total_expenses
     
-    # 5. التارجت
+    # 3. التارجت
     target_amount = 5000 
     progress_pct = int((total_revenue / target_amount) * 100) if total_revenue > 0 else 0
 
-    # 6. ذكاء السوق
-    top_keywords = db.query(models.SearchHistory.keyword, func.count(models.SearchHistory.keyword).label('count'))\
-        .group_by(models.SearchHistory.keyword).order_by(func.count(models.SearchHistory.keyword).desc()).limit(5).all()
-    
-    top_locations = db.query(models.SearchHistory.location, func.count(models.SearchHistory.location).label('count'))\
-        .group_by(models.SearchHistory.location).order_by(func.count(models.SearchHistory.location).desc()).limit(5).all()
-    
     return {
-        "total_users": total_users,
-        "total_leads_captured": total_leads,
+        "total_users": kpis["total_users"],
+        "total_leads_captured": kpis["total_leads"],
         "revenue_estimated": total_revenue, # يرسل كرقم خام (Frontend ينسقه)
         "net_profit": net_profit,           # يرسل كرقم خام
         
@@ -70,8 +62,41 @@ def get_admin_stats(db: Session = Depends(get_db)):
 
         "progress_pct": min(100, progress_pct),
         "target_display": f"{target_amount:,} EGP",
-        "top_keywords": [{"name": k.keyword, "count": k.count} for k in top_keywords],
-        "top_locations": [{"name": l.location, "count": l.count} for l in top_locations]
+        "top_keywords": [{"name": name, "count": count} for name, count in kpis["top_keywords"]],
+        "top_locations": [{"name": name, "count": count} for name, count in kpis["top_locations"]],
+
+        # معلومات الأداء (هل الرقم من الكاش؟ وكم استغرق الحساب؟)
+        "kpi_cached": meta["cached"],
+        "kpi_computed_in_ms": meta["computed_in_ms"]
+    }
+
+# --- تحليلات البحث عبر فترة زمنية (من جداول التجميع) ---
+@router.get("/analytics/searches")
+def get_search_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = "day",
+    group_by: str = "keyword",
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """
+    مثال: /admin/analytics/searches?start=2025-01-01&end=2026-01-01&group_by=time
+    group_by: keyword / location / user_id / time
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity يجب أن تكون hour أو day")
+    if group_by not in GROUP_BY_COLUMNS:
+        raise HTTPException(status_code=400, detail="group_by يجب أن تكون keyword أو location أو user_id أو time")
+
+    end = end or datetime.utcnow()
+    start = start or (end - timedelta(days=30))
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "group_by": group_by,
+        "items": query_rollups(db, start, end, granularity, group_by, limit)
     }
 
 # --- إضافة مصروف ---
@@ -81,6 +106,7 @@ def add_expense(data: ExpenseCreate, db: Session = Depends(get_db)):
     new_expense = models.Expense(label=data.label, amount=data.amount)
     db.add(new_expense)
     db.commit()
+    admin_kpis.invalidate()
     return {"status": "success", "message": "Expense Added"}
 
 # --- باقي الدوال الأساسية ---
@@ -97,18 +123,20 @@ def get_user_intelligence(user_id: int, db: Session = Depends(get_db)):
     financials = db.query(models.PaymentRequest).filter(models.PaymentRequest.user_id == user_id).order_by(models.PaymentRequest.created_at.desc()).all()
     return {
         "full_name": user.full_name, "email": user.email, "job_title": getattr(user, 'job_title', '-'), "phone": getattr(user, 'phone', '-'), "company_name": user.company_name, "address": getattr(user, 'address', '-'),
-        "searches": [{"keyword": s.keyword, "location": s.location, "date": s.search_date.strftime("%Y-%m-%d")} for s in searches],
+        "searches": [{"keyword": s.keyword, "location": s.location, "date": s.search_date.strftime("%Y-%m-%d"), "timings": json.loads(s.timings) if s.timings else None} for s in searches],
         "financials": [{"amount": f.amount, "status": f.status, "date": f.created_at.strftime("%Y-%m-%d")} for f in financials]
     }
 
 @router.get("/pending-payments")
 def get_pending_payments(db: Session = Depends(get_db)):
-    payments = db.query(models.PaymentRequest).filter(models.PaymentRequest.status == "Pending").all()
-    result = []
-    for p in payments:
-        user = db.query(models.User).filter(models.User.id == p.user_id).first()
-        result.append({"id": p.id, "user_email": user.email if user else "Unknown", "amount": p.amount, "proof_image": p.proof_image})
-    return result
+    # تحميل صاحب الطلب مع الطلبات في نفس الاستعلام (JOIN) بدلاً من استعلام لكل طلب
+    payments = db.query(models.PaymentRequest)\
+        .options(joinedload(models.PaymentRequest.owner))\
+        .filter(models.PaymentRequest.status == "Pending").all()
+    return [
+        {"id": p.id, "user_email": p.owner.email if p.owner else "Unknown", "amount": p.amount, "proof_image": p.proof_image}
+        for p in payments
+    ]
 
 @router.post("/process-payment")
 def process_payment(data: PaymentAction, db: Session = Depends(get_db)):
@@ -120,6 +148,7 @@ def process_payment(data: PaymentAction, db: Session = Depends(get_db)):
         if user: user.credits += payment.tokens_requested
     elif data.action == "reject": payment.status = "Rejected"
     db.commit()
+    admin_kpis.invalidate()
     return {"status": "success"}
 
 # ---------------------------------------------------------
@@ -13,6 +13,8 @@ router = APIRouter()
 GOOGLE_CLIENT_ID = "625457191585-2g87nj1pq6g7ke79loijr9o1pobdmlu9.apps.googleusercontent.com"
 SECRET_KEY = "your-very-secret-key"
 ALGORITHM = "HS256"
+# حسابات الإدارة (مفصولة بفاصلة)
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "admin@24seven.com").split(",") if e.strip()}
 
 @router.post("/google-login")
 async def google_login(data: schemas.GoogleLogin, db: Session = Depends(database.get_db)):
@@ -60,6 +62,15 @@ def create_access_token(data: dict):
 from fastapi.security import OAuth2PasswordBearer
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/google-login")
 
+def get_user_from_token(token: str, db: Session):
+    """نفس تحقق get_current_user لكن للتوكن القادم في الرابط (EventSource لا يرسل Headers)"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except Exception:
+        return None
+    email = payload.get("sub")
+    return db.query(models.User).filter(models.User.email == email).first() if email else None
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -71,6 +82,9 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except:
         raise HTTPException(status_code=401, detail="Invalid session")
 
+def is_admin(user):
+    return user is not None and (user.email or "").lower() in ADMIN_EMAILS
+
 @router.get("/me")
 def read_users_me(current_user: models.User = Depends(get_current_user)):
     return {
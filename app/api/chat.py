@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import func
+from typing import List, Optional
 from datetime import datetime
+import os
 from app import models, database
-from app.api.auth import get_current_user
+from app.api.auth import get_current_user, get_user_from_token, is_admin
+from app.utils.pubsub import broker, format_sse, sse_response, OVERFLOW
 from pydantic import BaseModel
 
 router = APIRouter()
 
+HEARTBEAT_SECONDS = float(os.environ.get("CHAT_HEARTBEAT_SECONDS", 15))
+ADMIN_TOPIC = "chat:admin"
+
 # --- نماذج البيانات (Pydantic Models) ---
 
 class MessageCreate(BaseModel):
@@ -26,6 +33,75 @@ class MessageResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# --- أدوات البث اللحظي (SSE) ---
+
+def _user_topic(user_id: int):
+    return f"chat:{user_id}"
+
+def _serialize(msg: models.ChatMessage):
+    return {
+        "id": msg.id,
+        "user_id": msg.user_id,
+        "message": msg.message,
+        "sender": msg.sender,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None
+    }
+
+def _publish(msg: models.ChatMessage):
+    """إرسال الرسالة الجديدة لمحادثة العميل ولصندوق الأدمن"""
+    payload = _serialize(msg)
+    broker.publish(_user_topic(msg.user_id), payload)
+    broker.publish(ADMIN_TOPIC, payload)
+
+def _messages_query(db: Session, user_id: Optional[int], since_id: Optional[int]):
+    query = db.query(models.ChatMessage)
+    if user_id is not None:
+        query = query.filter(models.ChatMessage.user_id == user_id)
+    if since_id is not None:
+        # الرسائل الجديدة فقط (Delta) بترتيب الـ id
+        return query.filter(models.ChatMessage.id > since_id).order_by(models.ChatMessage.id.asc())
+    return query.order_by(models.ChatMessage.created_at.asc())
+
+def _resume_from(since_id: Optional[int], last_event_id: Optional[str]):
+    """EventSource يرسل Last-Event-ID تلقائياً عند إعادة الاتصال"""
+    if last_event_id and last_event_id.isdigit():
+        return max(int(last_event_id), since_id or 0)
+    return since_id
+
+def _read_missed(user_id: Optional[int], since_id: Optional[int]):
+    db = database.SessionLocal()
+    try:
+        return [_serialize(m) for m in _messages_query(db, user_id, since_id).all()]
+    finally:
+        db.close()
+
+async def _stream_messages(topic: str, user_id: Optional[int], since_id: Optional[int]):
+    # الاشتراك قبل قراءة الفائت حتى لا تضيع رسالة بينهما
+    sub = broker.subscribe(topic)
+    try:
+        last_id = since_id
+        if since_id is not None:
+            # قراءة قاعدة البيانات خارج الـ Event Loop (لا توقف باقي الطلبات)
+            missed = await run_in_threadpool(_read_missed, user_id, since_id)
+            for payload in missed:
+                last_id = payload["id"]
+                yield format_sse(payload, event="message", event_id=payload["id"])
+
+        yield "retry: 3000\n\n"
+        while True:
+            payload = await sub.get(HEARTBEAT_SECONDS)
+            if payload is None:
+                yield ": ping\n\n"  # يبقي الاتصال مفتوحاً خلف الـ Proxies
+                continue
+            if payload is OVERFLOW:
+                break  # العميل سيعيد الاتصال ويكمل من Last-Event-ID
+            if last_id is not None and payload["id"] <= last_id:
+                continue
+            last_id = payload["id"]
+            yield format_sse(payload, event="message", event_id=payload["id"])
+    finally:
+        sub.close()
+
 # --- نقاط الاتصال (Endpoints) ---
 
 @router.post("/send", response_model=MessageResponse)
@@ -43,56 +119,95 @@ async def send_message(
     db.add(new_msg)
     db.commit()
     db.refresh(new_msg)
+    _publish(new_msg)
     return new_msg
 
 @router.get("/history", response_model=List[MessageResponse])
 async def get_chat_history(
+    since_id: Optional[int] = None,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """يستخدمها العميل لجلب محادثته الخاصة مع الدعم"""
-    messages = db.query(models.ChatMessage).filter(
-        models.ChatMessage.user_id == current_user.id
-    ).order_by(models.ChatMessage.created_at.asc()).all()
-    return messages
+    """يستخدمها العميل لجلب محادثته الخاصة مع الدعم (since_id: الرسائل الأحدث فقط)"""
+    return _messages_query(db, current_user.id, since_id).all()
+
+@router.get("/stream")
+def stream_chat(
+    token: str,
+    since_id: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+    db: Session = Depends(database.get_db)
+):
+    """
+    بث لحظي (SSE) لرسائل محادثة العميل بدلاً من إعادة تحميل /history كل فترة:
+    const es = new EventSource(`/chat/stream?token=${token}&since_id=${lastId}`)
+    (دالة عادية وليست async: قراءة التوكن من قاعدة البيانات تتم في الـ Threadpool وليس على الـ Event Loop)
+    """
+    user = get_user_from_token(token, db)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    user_id = user.id
+    db.close()  # لا نحجز اتصال قاعدة البيانات طوال مدة البث
+    return sse_response(_stream_messages(_user_topic(user_id), user_id, _resume_from(since_id, last_event_id)))
 
 @router.get("/admin/all-chats")
 async def get_admin_chats(db: Session = Depends(database.get_db)):
     """يستخدمها المدير لرؤية قائمة العملاء الذين أرسلوا رسائل في القائمة الجانبية"""
-    # جلب المستخدمين الذين لديهم رسائل فقط
-    users_with_msgs = db.query(models.User).join(models.ChatMessage).distinct().all()
-    
-    result = []
-    for user in users_with_msgs:
-        last_msg = db.query(models.ChatMessage).filter(
-            models.ChatMessage.user_id == user.id
-        ).order_by(models.ChatMessage.created_at.desc()).first()
-        
-        if last_msg:
-            result.append({
-                "user_id": user.id,
-                "user_email": user.email,
-                "last_message": last_msg.message,
-                "timestamp": last_msg.created_at
-            })
-    return result
+    # آخر رسالة لكل مستخدم في استعلام واحد (Window Function) بدلاً من استعلام لكل مستخدم
+    ranked = db.query(
+        models.ChatMessage.user_id,
+        models.ChatMessage.message,
+        models.ChatMessage.created_at,
+        func.row_number().over(
+            partition_by=models.ChatMessage.user_id,
+            order_by=(models.ChatMessage.created_at.desc(), models.ChatMessage.id.desc())
+        ).label("rn")
+    ).subquery()
+
+    rows = db.query(
+        models.User.id, models.User.email, ranked.c.message, ranked.c.created_at
+    ).join(ranked, ranked.c.user_id == models.User.id)\
+     .filter(ranked.c.rn == 1)\
+     .order_by(ranked.c.created_at.desc()).all()
+
+    return [
+        {
+            "user_id": user_id,
+            "user_email": email,
+            "last_message": message,
+            "timestamp": created_at
+        }
+        for user_id, email, message, created_at in rows
+    ]
+
+@router.get("/admin/stream")
+def stream_admin_chats(
+    token: str,
+    since_id: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+    db: Session = Depends(database.get_db)
+):
+    """
+    بث لحظي لكل الرسائل الجديدة (كل العملاء) لتحديث صندوق الأدمن بدون Polling.
+    لحسابات الإدارة فقط: التوكن في الرابط لأن EventSource لا يرسل Headers.
+    """
+    admin = get_user_from_token(token, db)
+    db.close()  # لا نحجز اتصال قاعدة البيانات طوال مدة البث
+    if admin is None:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    if not is_admin(admin):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return sse_response(_stream_messages(ADMIN_TOPIC, None, _resume_from(since_id, last_event_id)))
 
 @router.get("/history-admin/{user_id}", response_model=List[MessageResponse])
-async def get_chat_history_for_admin(user_id: int, db: Session = Depends(database.get_db)):
+async def get_chat_history_for_admin(user_id: int, since_id: Optional[int] = None, db: Session = Depends(database.get_db)):
     """
     ✅ الحل النهائي لخطأ 404: 
     الدالة المسؤولة عن عرض الرسائل في المربع الكبير للمدير عند اختيار عميل معين.
     هذا المسار يضمن استرجاع كافة الرسائل الخاصة بمستخدم محدد لعرضها للإدارة.
     """
-    messages = db.query(models.ChatMessage).filter(
-        models.ChatMessage.user_id == user_id
-    ).order_by(models.ChatMessage.created_at.asc()).all()
-    
-    if not messages:
-        # إذا لم توجد رسائل، نعيد قائمة فارغة بدل الخطأ لضمان استقرار الواجهة
-        return []
-        
-    return messages
+    # إذا لم توجد رسائل، نعيد قائمة فارغة بدل الخطأ لضمان استقرار الواجهة
+    return _messages_query(db, user_id, since_id).all()
 
 @router.post("/admin/reply")
 async def admin_reply(data: AdminReply, db: Session = Depends(database.get_db)):
@@ -104,4 +219,6 @@ async def admin_reply(data: AdminReply, db: Session = Depends(database.get_db)):
     )
     db.add(new_msg)
     db.commit()
+    db.refresh(new_msg)
+    _publish(new_msg)
     return {"status": "success", "message": "Reply sent successfully"}
\ No newline at end of file
@@ -1,103 +1,327 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response
 from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import func
+from app.database import get_db, SessionLocal
 from app import models
 from app.api.auth import SECRET_KEY, ALGORITHM # استيراد مفاتيح التشفير مباشرة
+from app.utils.export_cache import export_cache
+from app.utils.lead_search import apply_lead_filters
 from jose import jwt
-import pandas as pd
-import io # استخدام الذاكرة بدلاً من الملفات المؤقتة
+from openpyxl import Workbook
+import csv
+import io
+import os
 from datetime import datetime
 
+# pyarrow اختياري: مطلوب فقط لصيغ parquet و arrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 router = APIRouter()
 
-@router.get("/download-leads/")
-def download_leads(
-    keyword: str, 
-    location: str, 
-    token: str = Query(None), 
-    db: Session = Depends(get_db)
-):
-    # 1. التحقق من الهوية (Authentication) عبر التوكن الممرر في الرابط
-    user = None
+# --- أعمدة ملف التصدير (الاسم في الملف -> العمود في قاعدة البيانات) ---
+EXPORT_COLUMNS = [
+    ("Company Name", models.Lead.company_name),
+    ("Industry", models.Lead.industry),
+    ("Location", models.Lead.location),
+    ("Verified Email", models.Lead.email),
+    ("Email Status", models.Lead.email_status),
+    ("Phone", models.Lead.phone),
+    ("Decision Maker", models.Lead.decision_maker_name),
+    ("Role", models.Lead.decision_maker_role),
+    ("LinkedIn", models.Lead.linkedin_url),
+    ("Website", models.Lead.website),
+    ("Confidence", models.Lead.confidence_score),
+]
+EXPORT_HEADERS = [name for name, _ in EXPORT_COLUMNS]
+EXPORT_CHUNK_ROWS = 1000          # عدد الصفوف المقروءة من قاعدة البيانات في كل دفعة
+STREAM_CHUNK_BYTES = 64 * 1024
+
+XLSX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MEDIA_TYPE = 'text/csv; charset=utf-8'
+PARQUET_MEDIA_TYPE = 'application/vnd.apache.parquet'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.file'
+MEDIA_TYPES = {
+    "xlsx": XLSX_MEDIA_TYPE,
+    "csv": CSV_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+    "arrow": ARROW_MEDIA_TYPE,
+}
+
+# --- الصيغ العمودية (لفريق البيانات): أعمدة بأنواع حقيقية بدلاً من نصوص ---
+COLUMNAR_CHUNK_ROWS = 50000
+COLUMNAR_COLUMNS = [
+    ("id", models.Lead.id),
+    ("company_name", models.Lead.company_name),
+    ("industry", models.Lead.industry),
+    ("location", models.Lead.location),
+    ("email", models.Lead.email),
+    ("email_status", models.Lead.email_status),
+    ("phone", models.Lead.phone),
+    ("decision_maker_name", models.Lead.decision_maker_name),
+    ("decision_maker_role", models.Lead.decision_maker_role),
+    ("linkedin_url", models.Lead.linkedin_url),
+    ("website", models.Lead.website),
+    ("confidence_score", models.Lead.confidence_score),
+    ("is_contacted", models.Lead.is_contacted),
+    ("created_at", models.Lead.created_at),
+]
+
+
+# --- أدوات مساعدة ---
+def _authenticate(token: str, db: Session):
+    """التحقق من الهوية (Authentication) عبر التوكن الممرر في الرابط"""
     if not token:
         raise HTTPException(status_code=401, detail="التوكن مفقود، يرجى تسجيل الدخول")
-        
+
     try:
         # فك تشفير التوكن والتحقق من صلاحيته
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="توكن غير صالح")
-            
+
         user = db.query(models.User).filter(models.User.email == email).first()
     except Exception as e:
         print(f"❌ Auth Error during export: {e}")
         raise HTTPException(status_code=401, detail="جلسة العمل انتهت أو غير صالحة")
-    
+
     if not user:
         raise HTTPException(status_code=401, detail="المستخدم غير موجود")
+    return user
+
+
+def _leads_query(db: Session, user_id: int, keyword: str, location: str, columns=EXPORT_COLUMNS, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    استعلام الأعمدة المطلوبة فقط (بدون بناء كائنات ORM)،
+    مع القراءة على دفعات (yield_per) حتى تبقى الذاكرة ثابتة مهما كان عدد الصفوف.
+    """
+    query = db.query(*[col for _, col in columns]).filter(models.Lead.user_id == user_id)
+    query = apply_lead_filters(query, db, keyword, location)
+
+    return query.order_by(models.Lead.id.desc()).execution_options(stream_results=True).yield_per(chunk_rows)
+
+
+def _format_row(row):
+    values = list(row)
+    values[-1] = f"{values[-1]}%"  # Confidence
+    return values
+
+
+def _empty_row(keyword, location):
+    return ["لا توجد بيانات متاحة لهذا البحث", f"{keyword} في {location}"]
+
+
+def _iter_rows(db, user_id, keyword, location):
+    """صف واحد في كل مرة (مع رسالة توضيحية إذا لم توجد بيانات)"""
+    has_rows = False
+    for row in _leads_query(db, user_id, keyword, location):
+        has_rows = True
+        yield _format_row(row)
+    if not has_rows:
+        yield _empty_row(keyword, location)
+
+
+def _data_version(db: Session, user_id: int):
+    """نسخة بيانات العميل: تتغير مع أي إضافة أو حذف أو دمج (تدخل في مفتاح الكاش)"""
+    max_id, total, updated = db.query(func.max(models.Lead.id), func.count(models.Lead.id), func.max(models.Lead.updated_at))\
+        .filter(models.Lead.user_id == user_id).one()
+    return (max_id or 0, total or 0, updated.isoformat() if updated else "")
+
+
+def _etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+# --- كتّاب الملفات (صف واحد في كل مرة) ---
+def _iter_csv_chunks(db, user_id, keyword, location):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM حتى يفتح Excel الحروف العربية بشكل صحيح
+    writer.writerow(EXPORT_HEADERS)
+    for values in _iter_rows(db, user_id, keyword, location):
+        writer.writerow(values)
+        if buffer.tell() >= STREAM_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _stream_csv(user_id, keyword, location, cache_key):
+    """
+    CSV حقيقي بالتدفق: أول بايت يصل للعميل فوراً،
+    وفي نفس الوقت تُكتب نسخة في الكاش (تُعتمد فقط إذا اكتمل الإرسال).
+    """
+    db = SessionLocal()  # جلسة خاصة لأن الاستجابة تستمر بعد انتهاء الـ Endpoint
+    temp_path = export_cache.new_temp_path("csv")
+    complete = False
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in _iter_csv_chunks(db, user_id, keyword, location):
+                f.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        db.close()
+        if complete:
+            export_cache.commit(temp_path, cache_key, "csv").close()
+        else:
+            export_cache.discard(temp_path)
+
+
+def _iter_file(f):
+    try:
+        while True:
+            chunk = f.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def _file_response(f, fmt, filename, headers):
+    """
+    إرسال ملف من الكاش عبر ملف مفتوح بالفعل (وليس مساراً):
+    لو حذفه evict أثناء الإرسال يبقى المحتوى متاحاً حتى الإغلاق.
+    """
+    headers = dict(headers)
+    headers['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return StreamingResponse(_iter_file(f), media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+def _write_xlsx(db, user_id, keyword, location, path):
+    """
+    إكسيل بوضع write-only: الصفوف تكتب مباشرة على ملف مؤقت ولا تبقى في الرامات.
+    صيغة xlsx (ملف zip) لا يمكن إرسالها قبل اكتمالها، لذلك نرسل الملف بعد كتابته.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Leads")
+    ws.append(EXPORT_HEADERS)
+    for values in _iter_rows(db, user_id, keyword, location):
+        ws.append(values)
+    wb.save(path)
 
-    # 2. جلب البيانات من قاعدة البيانات بناءً على الفلترة
-    query = db.query(models.Lead).filter(models.Lead.user_id == user.id)
 
-    if keyword and keyword != "All":
-        query = query.filter(models.Lead.industry.ilike(f"%{keyword}%"))
-    
-    if location and location != "All":
-        query = query.filter(models.Lead.location.ilike(f"%{location}%"))
+def _arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("company_name", pa.string()),
+        ("industry", pa.string()),
+        ("location", pa.string()),
+        ("email", pa.string()),
+        ("email_status", pa.string()),
+        ("phone", pa.string()),
+        ("decision_maker_name", pa.string()),
+        ("decision_maker_role", pa.string()),
+        ("linkedin_url", pa.string()),
+        ("website", pa.string()),
+        ("confidence_score", pa.float64()),
+        ("is_contacted", pa.bool_()),
+        ("created_at", pa.timestamp("us")),
+    ])
 
-    leads = query.order_by(models.Lead.id.desc()).all()
 
-    # 3. تجهيز البيانات وتحويلها لتنسيق إكسيل
-    data = []
-    if not leads:
-        data.append({"رسالة": "لا توجد بيانات متاحة لهذا البحث", "البحث": f"{keyword} في {location}"})
+def _to_record_batch(rows, schema):
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[i], type=field.type) for i, field in enumerate(schema)],
+        schema=schema
+    )
+
+
+def _iter_record_batches(db, user_id, keyword, location, schema):
+    """تحويل نتائج الاستعلام إلى RecordBatch كل COLUMNAR_CHUNK_ROWS صف"""
+    chunk = []
+    for row in _leads_query(db, user_id, keyword, location, COLUMNAR_COLUMNS, COLUMNAR_CHUNK_ROWS):
+        chunk.append(row)
+        if len(chunk) >= COLUMNAR_CHUNK_ROWS:
+            yield _to_record_batch(chunk, schema)
+            chunk = []
+    if chunk:
+        yield _to_record_batch(chunk, schema)
+
+
+def _write_columnar(db, user_id, keyword, location, fmt, path):
+    """
+    Parquet / Arrow IPC: الكتابة على دفعات (Row Groups) في ملف مؤقت مضغوط بـ zstd.
+    ملف فارغ (بدون صفوف) يبقى صالحاً ويحمل نفس الـ Schema.
+    """
+    schema = _arrow_schema()
+
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
     else:
-        for lead in leads:
-            data.append({
-                "Company Name": lead.company_name,
-                "Industry": lead.industry,
-                "Location": lead.location,
-                "Verified Email": lead.email,
-                "Email Status": lead.email_status,
-                "Phone": lead.phone,
-                "Decision Maker": lead.decision_maker_name,
-                "Role": lead.decision_maker_role,
-                "LinkedIn": lead.linkedin_url,
-                "Website": lead.website,
-                "Confidence": f"{lead.confidence_score}%"
-            })
-
-    # 4. الإنشاء في الذاكرة (Memory-based Writing) لتجاوز مشكلة مساحة الهارد
+        writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
     try:
-        output = io.BytesIO() # إنشاء وعاء في الرامات
-        df = pd.DataFrame(data)
-        
-        # كتابة ملف الإكسيل داخل الوعاء في الرامات
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Leads')
-        
-        file_content = output.getvalue() # استخراج محتوى الملف كـ Bytes
-        output.close()
-            
-    except Exception as e:
-        print(f"❌ Excel Generation Error: {e}")
-        raise HTTPException(status_code=500, detail="حدث خطأ أثناء إنشاء ملف الإكسيل")
+        for batch in _iter_record_batches(db, user_id, keyword, location, schema):
+            writer.write_batch(batch)
+    finally:
+        writer.close()
 
-    # 5. إعداد وإرسال الملف كاستجابة (Response)
-    safe_filename = f"Leads_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-    
+
+@router.get("/download-leads/")
+def download_leads(
+    request: Request,
+    keyword: str,
+    location: str,
+    token: str = Query(None),
+    fmt: str = Query("xlsx", alias="format"),
+    db: Session = Depends(get_db)
+):
+    # 1. التحقق من الهوية
+    user = _authenticate(token, db)
+
+    fmt = (fmt or "xlsx").lower()
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="صيغة غير مدعومة. الصيغ المتاحة: xlsx, csv, parquet, arrow")
+
+    if fmt in ("parquet", "arrow") and pa is None:
+        raise HTTPException(status_code=501, detail="صيغ parquet و arrow تحتاج تثبيت مكتبة pyarrow على السيرفر")
+
+    # 2. الكاش: نفس الفلتر + نفس البيانات = نفس الملف
+    cache_key = export_cache.make_key(user.id, keyword, location, fmt, _data_version(db, user.id))
+    etag = f'"{cache_key}"'
+    safe_filename = f"Leads_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
     headers = {
-        'Content-Disposition': f'attachment; filename="{safe_filename}"',
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'Cache-Control': 'no-cache, no-store, must-revalidate',
-        'Pragma': 'no-cache',
-        'Expires': '0'
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',  # المتصفح يعيد التحقق كل مرة (If-None-Match)
     }
 
-    return Response(
-        content=file_content, 
-        headers=headers, 
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
\ No newline at end of file
+    if _etag_matches(request, etag):
+        export_cache.count("not_modified")
+        return Response(status_code=304, headers=headers)
+
+    cached = export_cache.get(cache_key, fmt)
+    if cached:
+        return _file_response(cached, fmt, safe_filename, headers)
+
+    # 3. تجهيز الملف بالتدفق (Streaming) بدون تحميل كل البيانات في الذاكرة
+    if fmt == "csv":
+        headers['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
+        return StreamingResponse(_stream_csv(user.id, keyword, location, cache_key), headers=headers, media_type=CSV_MEDIA_TYPE)
+
+    temp_path = export_cache.new_temp_path(fmt)
+    try:
+        if fmt == "xlsx":
+            _write_xlsx(db, user.id, keyword, location, temp_path)
+        else:
+            _write_columnar(db, user.id, keyword, location, fmt, temp_path)
+    except Exception as e:
+        export_cache.discard(temp_path)
+        print(f"❌ {fmt} Generation Error: {e}")
+        raise HTTPException(status_code=500, detail="حدث خطأ أثناء إنشاء الملف")
+
+    return _file_response(export_cache.commit(temp_path, cache_key, fmt), fmt, safe_filename, headers)
@@ -1,19 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Request
 from sqlalchemy.orm import Session
+from sqlalchemy import or_
+from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
+import os
 from app.database import get_db
 from app import models, schemas
-from app.api.auth import get_current_user
+from app.api.auth import get_current_user, get_user_from_token
 from pydantic import BaseModel
-import time
 
 # استدعاء ملفات المحرك الحقيقي
 # تأكد أن هذه الملفات موجودة في مجلد app/engines/
 from app.engines.gmaps_collector import GmapsEngine
-from app.engines.data_enricher import DataEnricher
-from app.engines.verifier_pro import EmailVerifier
+from app.engines.parallel_enricher import ParallelEnricher
+from app.engines.driver_pool import driver_pool
+from app.engines.http_fetcher import http_fetcher
+from app.engines.rate_limiter import rate_limiter
+from app.engines.verifier_pro import mx_cache
+from app.utils.enrichment_cache import enrichment_cache
+from app.utils.dedup import lead_keys
+from app.utils.maps_cache import maps_cache
+from app.utils.lead_writer import LeadWriter
+from app.utils.lead_search import text_filter
+from app.utils.search_rollups import record_search
+from app.utils.job_progress import JobProgress, stream_job_events
+from app.utils.job_checkpoint import JobCheckpoint
+from app.utils.pubsub import sse_response
+from app.utils.metrics import metrics, track_job, in_context, metrics_access_allowed
+from tasks.worker import enqueue_search, enqueue_batch
 
 router = APIRouter()
 
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", 50))
+
 # --- 1. تعريف شكل البيانات المتوقعة (Schema) ---
 # هذا الكلاس هو "المترجم" الذي سيفهم البيانات القادمة من الداشبورد
 class SearchRequest(BaseModel):
@@ -21,46 +40,31 @@ class SearchRequest(BaseModel):
     location: str
     target_limit: int = 5
 
-# --- 2. دالة المحرك الشاملة (تنفذ في الخلفية) ---
-def run_full_scraping_task(keyword: str, location: str, user_id: int, db: Session, limit: int):
-    print(f"🚀 [Task Started] البحث عن: {keyword} في {location} (الحد الأقصى: {limit})")
-    
-    gmaps = GmapsEngine()
-    enricher = DataEnricher()
-    verifier = EmailVerifier()
-    
-    try:
-        # أ) سحب البيانات الأساسية من خرائط جوجل
-        # ملاحظة: تأكد أن الدالة gmaps.scrape تقبل المعاملات وتعمل بوضع Headless على السيرفر
-        raw_results = gmaps.scrape(keyword, location, max_leads=limit)
-        
-        if not raw_results:
-            print(f"⚠️ [Warning] لم يتم العثور على نتائج في خرائط جوجل لـ: {keyword}")
-            return
-
-        print(f"✅ تم العثور على {len(raw_results)} شركة. بدء الإثراء والتحقق...")
-
-        # ب) بدء جلسة البحث العميق (الإثراء)
-        enricher.start_session()
-        
-        leads_saved = 0
-        for item in raw_results:
-            # التحقق من وجود الشركة مسبقاً لتجنب التكرار (اختياري)
-            # existing_lead = db.query(models.Lead).filter(models.Lead.company_name == item['company_name'], models.Lead.user_id == user_id).first()
-            # if existing_lead: continue
-
-            # ج) البحث العميق عن الإيميل وصانع القرار
-            extra_data = enricher.find_emails_and_people(item['company_name'], item['website'])
-            
-            # د) التحقق من صحة الإيميل تقنياً
-            email_status, confidence = verifier.verify(extra_data['email'])
-            
-            # هـ) حفظ البيانات في قاعدة البيانات
-            new_lead = models.Lead(
+# --- 2. دالة المحرك الشاملة (ينفذها العامل tasks/worker.py بجلسة قاعدة بيانات خاصة به) ---
+def _enrich_and_save(db: Session, user_id: int, checkpoint: JobCheckpoint, progress: JobProgress):
+    """
+    الإثراء والتحقق بالتوازي للشركات التي لم تُحفظ بعد في الـ Checkpoint،
+    والحفظ على دفعات مع تسجيل ما تم حفظه في نفس الـ Transaction. تعيد إجمالي المُسلّم.
+    """
+    items = checkpoint.pending_items()
+    total = len(checkpoint.items)
+    if not items:
+        return checkpoint.delivered
+
+    enricher = ParallelEnricher()
+    print(f"✅ تم العثور على {total} شركة ({len(items)} متبقية). بدء الإثراء والتحقق ({enricher.workers} عامل بالتوازي)...")
+
+    on_flush = lambda saved, written: progress.emit("leads_saved", saved=saved, total_saved=checkpoint.delivered)
+    on_saved = lambda tags, saved: checkpoint.mark_saved(db, tags, saved)
+    with LeadWriter(db, on_flush=on_flush, on_saved=on_saved) as writer:
+        for n, (item, extra_data, email_status, confidence) in enumerate(enricher.enrich(items), start=total - len(items) + 1):
+            # إضافة العميل لدفعة الحفظ (INSERT واحد لكل دفعة بدلاً من commit لكل عميل)
+            # منع التكرار يتم داخل LeadWriter بمفاتيح مفهرسة (هاتف / دومين / اسم)
+            writer.add(dict(
                 user_id=user_id,
                 company_name=item['company_name'],
-                industry=keyword,
-                location=item['location'] or location, # استخدام الموقع المدخل كاحتياطي
+                industry=item['industry'],
+                location=item['location'],
                 phone=item['phone'],
                 website=item['website'],
                 email=extra_data['email'],
@@ -69,39 +73,136 @@ def run_full_scraping_task(keyword: str, location: str, user_id: int, db: Sessio
                 decision_maker_name=extra_data['decision_maker_name'],
                 decision_maker_role=extra_data['decision_maker_role'],
                 linkedin_url=extra_data['linkedin_url']
-            )
-            db.add(new_lead)
-            db.commit()
-            leads_saved += 1
-            print(f"💾 [Saved] {item['company_name']} ({email_status})")
-
-        enricher.stop_session()
-        
-        # و) تسجيل العملية في سجل التاريخ
-        history = models.SearchHistory(
-            user_id=user_id,
-            keyword=keyword,
-            location=location,
-            results_count=leads_saved
-        )
-        db.add(history)
-        db.commit()
-        print(f"🏁 [Task Finished] تمت العملية بنجاح. تم حفظ {leads_saved} عميل.")
+            ), tag=item['index'])
+            print(f"✅ [Enriched] {item['company_name']} ({email_status})")
+            progress.emit("lead_enriched", n=n, total=total, company_name=item['company_name'], email_status=email_status)
+    return checkpoint.delivered
+
+
+def run_full_scraping_task(keyword: str, location: str, user_id: int, db: Session, limit: int,
+                           progress: JobProgress = None, checkpoint: JobCheckpoint = None):
+    """
+    تعيد عدد العملاء المحفوظين. في حالة الخطأ القاتل يتم رفع الاستثناء ليعيد العامل المحاولة.
+    progress: لنشر مراحل التقدم للعميل (SSE)، الحدث النهائي يرسله العامل بعد حفظ حالة المهمة.
+    checkpoint: إذا كانت المهمة بدأت من قبل، نكمل من نتائج الخرائط المحفوظة بدلاً من إعادة السحب.
+    """
+    progress = progress or JobProgress()
+    checkpoint = checkpoint or JobCheckpoint()
+    print(f"🚀 [Task Started] البحث عن: {keyword} في {location} (الحد الأقصى: {limit})")
+    progress.emit("started", keyword=keyword, location=location, limit=limit)
+    
+    try:
+        with track_job() as timings:
+            checkpoint.load(db)
+            if checkpoint.items is None:
+                # أ) سحب البيانات الأساسية من خرائط جوجل
+                # ملاحظة: تأكد أن الدالة gmaps.scrape تقبل المعاملات وتعمل بوضع Headless على السيرفر
+                raw_results = GmapsEngine().scrape(keyword, location, max_leads=limit)
+
+                if not raw_results:
+                    print(f"⚠️ [Warning] لم يتم العثور على نتائج في خرائط جوجل لـ: {keyword}")
+                    progress.emit("maps_results", count=0)
+                    return 0
+
+                for item in raw_results:
+                    item['industry'] = keyword
+                    item['location'] = item['location'] or location  # استخدام الموقع المدخل كاحتياطي
+                checkpoint.start(db, raw_results)
+                progress.emit("maps_results", count=len(raw_results))
+            else:
+                print(f"♻️ [Task Resumed] استكمال من نقطة الحفظ: {len(checkpoint.done)}/{len(checkpoint.items)} شركة محفوظة")
+                progress.emit("resumed", saved=len(checkpoint.done), total=len(checkpoint.items))
+
+            # ب) الإثراء والتحقق والحفظ
+            leads_saved = _enrich_and_save(db, user_id, checkpoint, progress)
+
+            # ج) تسجيل العملية في سجل التاريخ (مع التفصيل الزمني لمراحل المهمة)
+            with metrics.span("db_history"):
+                record_search(db, user_id, keyword, location, leads_saved, timings=timings.as_dict())  # + تحديث جداول التحليلات الزمنية
+                db.commit()
+            print(f"🏁 [Task Finished] تمت العملية بنجاح. تم حفظ {leads_saved} عميل.")
+            return leads_saved
 
     except Exception as e:
         print(f"❌ [Critical Error] خطأ في المحرك الرئيسي: {e}")
         db.rollback()
-    finally:
-        try:
-            enricher.stop_session()
-        except:
-            pass
+        raise
+
+
+def _place_keys(item):
+    """
+    نفس مفاتيح منع تكرار العملاء (هاتف E.164 / دومين / اسم@موقع):
+    فروع نفس السلسلة في مواقع مختلفة تبقى شركات مستقلة.
+    """
+    return set(lead_keys(item)) or {("id", id(item))}
+
+
+def run_batch_scraping_task(queries: list, user_id: int, db: Session,
+                            progress: JobProgress = None, checkpoint: JobCheckpoint = None):
+    """
+    بحث مجمع: كل الاستعلامات تُسحب من الخرائط على نفس مسبح المتصفحات بالتوازي،
+    ثم تُزال الشركات المكررة بين الاستعلامات قبل الإثراء (كل شركة تُثرى وتُحسب مرة واحدة).
+    """
+    progress = progress or JobProgress()
+    checkpoint = checkpoint or JobCheckpoint()
+    print(f"🚀 [Batch Started] {len(queries)} استعلام للمستخدم #{user_id}")
+    progress.emit("started", queries=len(queries), limit=sum(q['target_limit'] for q in queries))
+
+    try:
+        with track_job() as timings:
+            checkpoint.load(db)
+            if checkpoint.items is None:
+                # أ) سحب الخرائط لكل الاستعلامات (عدد المتوازي = حجم المسبح)
+                def _scrape(query):
+                    return GmapsEngine().scrape(query['keyword'], query['location'], max_leads=query['target_limit'])
+
+                with ThreadPoolExecutor(max_workers=max(1, min(driver_pool.size, len(queries))), thread_name_prefix="batch-maps") as executor:
+                    scraped = list(executor.map(in_context(_scrape), queries))
+
+                # ب) إزالة التكرار بين الاستعلامات (الشركة تُنسب لأول استعلام ظهرت فيه)
+                unique = []
+                seen = set()
+                per_query = [0] * len(queries)
+                for index, (query, results) in enumerate(zip(queries, scraped)):
+                    for item in results or []:
+                        item['location'] = item.get('location') or query['location']
+                        keys = _place_keys(item)
+                        if keys & seen:
+                            continue
+                        seen |= keys
+                        item['industry'] = query['keyword']
+                        unique.append(item)
+                        per_query[index] += 1
+
+                found = sum(len(r or []) for r in scraped)
+                print(f"🧮 [Batch] {found} نتيجة من الخرائط -> {len(unique)} شركة فريدة")
+                checkpoint.start(db, unique, per_query=per_query)
+                progress.emit("maps_results", count=len(unique), total_found=found)
+            else:
+                print(f"♻️ [Batch Resumed] استكمال من نقطة الحفظ: {len(checkpoint.done)}/{len(checkpoint.items)} شركة محفوظة")
+                progress.emit("resumed", saved=len(checkpoint.done), total=len(checkpoint.items))
+
+            # ج) إثراء وحفظ الشركات الفريدة فقط
+            leads_saved = _enrich_and_save(db, user_id, checkpoint, progress)
+
+            # د) سجل البحث لكل استعلام بعدد الشركات المنسوبة له
+            # (التفصيل الزمني للمهمة المجمعة كاملة يُحفظ مع كل استعلام منها)
+            with metrics.span("db_history"):
+                for query, count in zip(queries, checkpoint.state["per_query"]):
+                    record_search(db, user_id, query['keyword'], query['location'], count, timings=timings.as_dict())
+                db.commit()
+            print(f"🏁 [Batch Finished] تم حفظ {leads_saved} عميل فريد.")
+            return leads_saved
+
+    except Exception as e:
+        print(f"❌ [Critical Error] خطأ في البحث المجمع: {e}")
+        db.rollback()
+        raise
 
 # --- 3. نقطة الاتصال لبدء البحث (Endpoint) ---
 @router.post("/start-search/")
 def start_search(
     request: SearchRequest,  # استقبال البيانات كـ JSON Body
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -109,32 +210,198 @@ def start_search(
     if current_user.credits < request.target_limit:
         raise HTTPException(status_code=400, detail="عذراً، رصيدك الحالي لا يكفي لهذه العملية.")
 
-    # ب) خصم الرصيد فوراً
+    # ب) خصم الرصيد وإضافة المهمة للطابور في نفس العملية (Transaction واحدة)
     current_user.credits -= request.target_limit
+    job = enqueue_search(db, current_user.id, request.keyword, request.location, request.target_limit, commit=False)
     db.commit()
     
-    # ج) إرسال المهمة للخلفية (Background Task)
-    background_tasks.add_task(
-        run_full_scraping_task, 
-        request.keyword, 
-        request.location, 
-        current_user.id, 
-        db, 
-        request.target_limit
-    )
-    
     return {
         "status": "success", 
-        "message": f"تم بدء البحث عن '{request.keyword}'. تم خصم {request.target_limit} نقطة. النتائج ستظهر تلقائياً عند اكتمالها."
+        "job_id": job.id,
+        "message": f"تم بدء البحث عن '{request.keyword}'. تم حجز {request.target_limit} نقطة (يُرد رصيد أي عميل لم يتم تسليمه). النتائج ستظهر تلقائياً عند اكتمالها."
+    }
+
+# --- بحث مجمع: عدة (كلمة × موقع) في مهمة واحدة ---
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest]
+
+@router.post("/batch-search/")
+def start_batch_search(
+    request: BatchSearchRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    الرصيد يُخصم مقدماً بمجموع الحدود، وبعد الانتهاء يُرد الفرق:
+    الدفع النهائي = عدد العملاء الفريدين الذين تم حفظهم فعلاً.
+    """
+    queries = [q for q in request.queries if q.keyword.strip() and q.target_limit > 0]
+    if not queries:
+        raise HTTPException(status_code=400, detail="يجب إرسال استعلام واحد على الأقل")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"الحد الأقصى {MAX_BATCH_QUERIES} استعلام في البحث المجمع")
+
+    total = sum(q.target_limit for q in queries)
+    if current_user.credits < total:
+        raise HTTPException(status_code=400, detail="عذراً، رصيدك الحالي لا يكفي لهذه العملية.")
+
+    current_user.credits -= total
+    job = enqueue_batch(db, current_user.id, [
+        {"keyword": q.keyword.strip(), "location": q.location.strip(), "target_limit": q.target_limit} for q in queries
+    ], commit=False)
+    db.commit()
+
+    return {
+        "status": "success",
+        "job_id": job.id,
+        "queries": len(queries),
+        "message": f"تم بدء {len(queries)} بحث. تم حجز {total} نقطة وسيتم رد الفرق حسب عدد العملاء الفريدين."
+    }
+
+# --- حالة مهمة البحث في الطابور ---
+@router.get("/jobs/{job_id}")
+def get_job_status(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    job = db.query(models.SearchJob).filter(
+        models.SearchJob.id == job_id,
+        models.SearchJob.user_id == current_user.id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="المهمة غير موجودة")
+
+    return {
+        "id": job.id,
+        "keyword": job.keyword,
+        "location": job.location,
+        "target_limit": job.target_limit,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "results_count": job.results_count,
+        "kind": job.kind,
+        "credits_charged": job.credits_charged,
+        "delivered_count": job.delivered_count,
+        "last_error": job.last_error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
     }
 
+# --- بث تقدم المهمة لحظياً (SSE) بدلاً من Polling على my-leads ---
+@router.get("/jobs/{job_id}/events")
+def stream_job_progress(
+    job_id: int,
+    token: str,
+    after_id: int = 0,
+    last_event_id: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    const es = new EventSource(`/search/jobs/${jobId}/events?token=${token}`)
+    es.addEventListener('lead_enriched', e => ...)   // finished / failed = نهاية البث
+    (def عادية: التحقق من الملكية يعمل في الـ Threadpool، والبث نفسه Async)
+    """
+    user = get_user_from_token(token, db)
+    owns_job = user is not None and db.query(models.SearchJob.id).filter(
+        models.SearchJob.id == job_id,
+        models.SearchJob.user_id == user.id
+    ).first() is not None
+    db.close()  # لا نحجز اتصال قاعدة البيانات طوال مدة البث
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    if not owns_job:
+        raise HTTPException(status_code=404, detail="المهمة غير موجودة")
+
+    if last_event_id and last_event_id.isdigit():
+        after_id = max(after_id, int(last_event_id))
+    return sse_response(stream_job_events(job_id, after_id))
+
 # --- 4. جلب النتائج (للعرض في الجدول) ---
+# الأعمدة المسموح بطلبها عبر ?fields= (الافتراضي: كلها)
+LEAD_FIELDS = {column.name: column for column in models.Lead.__table__.columns}
+NO_PHONE_VALUES = ("", "غير متوفر")
+
+
+def my_leads_query(db: Session, user_id: int, names: list, after_id: Optional[int] = None, limit: int = 100,
+                   email_status: Optional[str] = None, has_phone: Optional[bool] = None, industry: Optional[str] = None):
+    """استعلام صفحة my-leads (يستخدمه الـ Endpoint وفحص خطط التنفيذ scripts/check_query_plans)"""
+    query = db.query(*[LEAD_FIELDS[n] for n in names]).filter(models.Lead.user_id == user_id)
+
+    if after_id is not None:
+        query = query.filter(models.Lead.id < after_id)
+    if email_status:
+        query = query.filter(models.Lead.email_status == email_status)
+    if has_phone is True:
+        query = query.filter(models.Lead.phone.isnot(None), models.Lead.phone.notin_(NO_PHONE_VALUES))
+    elif has_phone is False:
+        query = query.filter(or_(models.Lead.phone.is_(None), models.Lead.phone.in_(NO_PHONE_VALUES)))
+    if industry:
+        query = query.filter(text_filter(db, "industry_norm", industry))
+
+    # صف إضافي لمعرفة هل توجد صفحة تالية
+    return query.order_by(models.Lead.id.desc()).limit(limit + 1)
+
 @router.get("/my-leads/")
-def get_my_leads(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    leads = db.query(models.Lead).filter(models.Lead.user_id == current_user.id).order_by(models.Lead.id.desc()).limit(100).all()
-    return {"data": leads}
+def get_my_leads(
+    after_id: Optional[int] = Query(None, description="آخر id ظهر في الصفحة السابقة (Keyset Pagination)"),
+    limit: int = Query(100, ge=1, le=500),
+    fields: Optional[str] = Query(None, description="أعمدة مفصولة بفاصلة مثل: company_name,phone,email"),
+    email_status: Optional[str] = None,
+    has_phone: Optional[bool] = None,
+    industry: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    صفحات بنظام Keyset (id < after_id) بدلاً من OFFSET: تكلفة كل صفحة ثابتة مهما كان عمقها.
+    القراءة تتم كأعمدة فقط (بدون بناء كائنات ORM).
+    """
+    # أ) الأعمدة المطلوبة (id دائماً موجود لأنه مؤشر الصفحة التالية)
+    if fields:
+        names = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [n for n in names if n not in LEAD_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"أعمدة غير معروفة: {', '.join(unknown)}")
+        names = ["id"] + [n for n in names if n != "id"]
+    else:
+        names = list(LEAD_FIELDS)
+
+    # ب) الفلاتر على السيرفر + صف إضافي لمعرفة هل توجد صفحة تالية
+    rows = my_leads_query(db, current_user.id, names, after_id, limit, email_status, has_phone, industry).all()
+    has_more = len(rows) > limit
+    data = [dict(row._mapping) for row in rows[:limit]]
+
+    return {
+        "data": data,
+        "has_more": has_more,
+        "next_after_id": data[-1]["id"] if has_more else None
+    }
 
 # --- 5. جلب سجل البحث (للقائمة الجانبية) ---
 @router.get("/history")
 def get_history(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.SearchHistory).filter(models.SearchHistory.user_id == current_user.id).order_by(models.SearchHistory.id.desc()).all()
\ No newline at end of file
+    return db.query(models.SearchHistory).filter(models.SearchHistory.user_id == current_user.id).order_by(models.SearchHistory.id.desc()).all()
+
+# --- 6. مراقبة المحركات (مسبح المتصفحات ومسار HTTP السريع) ---
+def engine_stats(process: str = "web"):
+    """
+    إحصائيات المحركات في العملية الحالية. السحب يحدث في العامل المنفصل، لذلك يعرضها على
+    منفذ القياسات الخاص به (WORKER_METRICS_PORT/engine-stats)، وهنا أرقام عملية الويب فقط.
+    """
+    return {
+        "process": process,
+        "driver_pool": driver_pool.stats(),
+        "http_fetcher": http_fetcher.stats(),
+        "mx_cache": mx_cache.stats(),
+        "enrichment_cache": enrichment_cache.stats(),
+        "maps_cache": maps_cache.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "stages": metrics.stats()
+    }
+
+@router.get("/engine-stats", include_in_schema=False)
+def get_engine_stats(request: Request):
+    # داخلي فقط مثل /metrics: rate_limits تكشف المواقع التي يتم سحبها لكل العملاء
+    if not metrics_access_allowed(request.client.host if request.client else None,
+                                  request.headers.get("authorization"), request.headers.get("x-forwarded-for")):
+        raise HTTPException(status_code=403, detail="Internal only")
+    return engine_stats()
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from app.database import get_db
 from app import models
 # ✅ إضافة هامة: استدعاء دالة معرفة المستخدم الحالي
 from app.api.auth import get_current_user 
+from app.utils.lead_search import industry_stats_query
+from app.utils.lead_stats import refresh_user_stats
 
 router = APIRouter()
 
@@ -14,10 +16,7 @@ def get_ai_suggestions(query: str, db: Session = Depends(get_db)):
     نظام RAG مصغر: يقترح بناءً على البيانات المخزنة والتحليل الذكي
     """
     # 1. البحث في الصناعات المخزنة لدينا (Historical Data)
-    stats = db.query(models.Lead.industry, func.count(models.Lead.id))\
-        .filter(models.Lead.industry.ilike(f"%{query}%"))\
-        .group_by(models.Lead.industry)\
-        .all()
+    stats = industry_stats_query(db, query).all()
     
     suggestions = []
     
@@ -54,25 +53,28 @@ def get_ai_suggestions(query: str, db: Session = Depends(get_db)):
 def get_user_stats(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     """
     جلب إحصائيات حقيقية بناءً على داتا العميل المسجل دخول حالياً
+    (من جدول العدادات المجمعة: قراءة صف واحد بدلاً من تحميل كل العملاء)
     """
-    # 1. جلب كل الـ Leads الخاصة بهذا العميل فقط
-    my_leads = db.query(models.Lead).filter(models.Lead.user_id == current_user.id).all()
-    total = len(my_leads)
-    
+    stats = db.get(models.UserLeadStats, current_user.id)
+    if stats is None:
+        # أول مرة لهذا العميل: حساب كامل مرة واحدة ثم التحديث التراكمي بعد ذلك
+        stats = refresh_user_stats(db, current_user.id)
+        try:
+            db.commit()
+        except IntegrityError:
+            # العامل أنشأ الصف في نفس اللحظة
+            db.rollback()
+            stats = db.get(models.UserLeadStats, current_user.id)
+
+    total = stats.total or 0
     if total == 0:
         return {"total": 0, "emails_pct": 0, "phones_pct": 0, "decision_pct": 0}
 
-    # 2. حساب الأرقام الحقيقية
-    valid_emails = sum(1 for lead in my_leads if lead.email_status == "Valid")
-    # البحث عن الأرقام التي تبدأ بـ 01 (موبايل مصري) كدليل على جودة الداتا للواتساب
-    mobile_phones = sum(1 for lead in my_leads if "01" in str(lead.phone)) 
-    decision_makers = sum(1 for lead in my_leads if lead.decision_maker_name)
-
     return {
         "total": total,
-        "emails_pct": int((valid_emails / total) * 100),
-        "phones_pct": int((mobile_phones / total) * 100),
-        "decision_pct": int((decision_makers / total) * 100)
+        "emails_pct": int((stats.valid_emails / total) * 100),
+        "phones_pct": int((stats.mobile_phones / total) * 100),
+        "decision_pct": int((stats.decision_makers / total) * 100)
     }
 
 # ✅ الدالة الجديدة: نظام الاقتراحات الذكي (Apollo Style)
@@ -1,67 +1,67 @@
-import time
 import re
-import os
-from selenium import webdriver
+from urllib.parse import urljoin
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from app.engines.driver_pool import driver_pool, DriverPoolTimeout
+from app.engines.http_fetcher import http_fetcher, looks_js_rendered
+from app.engines.rate_limiter import rate_limiter, looks_blocked, RateLimitTimeout
+from app.utils.metrics import metrics
+
+EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+CONTACT_LINK_RE = re.compile(r'<a\s[^>]*href=["\']([^"\'#]+)["\'][^>]*>(.*?)</a>', re.S | re.I)
+BAD_EXT = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.css', '.js', '.webp', '.mp4')
+PRIORITY = ['info', 'contact', 'sales', 'hello', 'admin', 'support']
 
 class DataEnricher:
-    def __init__(self):
+    def __init__(self, pool=None):
+        self.pool = pool or driver_pool
         self.driver = None
-
-    def _setup_driver(self):
-        """
-        إعدادات المتصفح المتوافقة مع Render (نفس إعدادات الخرائط الناجحة)
-        """
-        chrome_options = Options()
-        chrome_options.add_argument("--headless=new") 
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument("--disable-notifications")
-        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
-        
-        # User-Agent قوي للتمويه
-        chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36")
-
-        # مسارات Render
-        chrome_bin = os.environ.get("CHROME_BIN")
-        if chrome_bin:
-            chrome_options.binary_location = chrome_bin
-        
-        driver_path = os.environ.get("CHROMEDRIVER_PATH")
-        
-        try:
-            service = None
-            if driver_path and os.path.exists(driver_path):
-                 service = Service(executable_path=driver_path)
-            else:
-                 service = Service()
-
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            return driver
-
-        except Exception as e:
-            print(f"❌ Enricher Driver Error: {e}")
-            raise e
+        self._blocked = False  # صفحة حظر / كابتشا أثناء إثراء الشركة الحالية
+        self._search_failed = False  # بحث Bing فشل (خطأ / مهلة) وليس "بدون نتائج"
 
     def start_session(self):
+        # استعارة متصفح دافئ من المسبح المشترك بدلاً من تشغيل متصفح جديد
         if not self.driver:
-            self.driver = self._setup_driver()
+            self.driver = self.pool.acquire()
 
     def stop_session(self):
         if self.driver:
-            try:
-                self.driver.quit()
-            except:
-                pass
+            self.pool.release(self.driver)
             self.driver = None
 
+    def _open(self, url):
+        """فتح صفحة بحصة الموقع المشتركة، وإبلاغ المحدد بالنتيجة (نجاح / كابتشا / خطأ)"""
+        try:
+            rate_limiter.acquire(url)
+        except RateLimitTimeout as e:
+            print(f"🚦 {e}")
+            self._blocked = True
+            return False
+        try:
+            self.driver.get(url)
+        except Exception:
+            rate_limiter.error(url)
+            raise
+        finally:
+            self.pool.mark_page(self.driver)
+        if looks_blocked(self.driver.current_url, self.driver.title):
+            rate_limiter.throttled(url)
+            self._blocked = True
+            return False
+        rate_limiter.success(url)
+        return True
+
+    def _wait_ready(self, timeout=5):
+        """انتظار اكتمال تحميل الصفحة بدلاً من sleep ثابت"""
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                lambda d: d.execute_script("return document.readyState") == "complete"
+            )
+        except Exception:
+            pass
+
     def _search_bing_selenium(self, company_name):
         """
         Flow 2: البحث باستخدام Bing عبر Selenium (الأكثر استقراراً على السيرفر)
@@ -70,7 +70,9 @@ class DataEnricher:
         try:
             # استخدام Bing بدلاً من Google لتجنب الكابتشا
             query = f"{company_name} Egypt official website facebook"
-            self.driver.get("https://www.bing.com")
+            if not self._open("https://www.bing.com"):
+                print("🚦 Bing طلب كابتشا، تخطي البحث لهذه الشركة")
+                return None
             
             # انتظار صندوق البحث
             wait = WebDriverWait(self.driver, 10)
@@ -79,7 +81,14 @@ class DataEnricher:
             search_box.send_keys(query)
             search_box.send_keys(Keys.RETURN)
             
-            time.sleep(2) # انتظار تحميل النتائج
+            # انتظار ظهور النتائج فعلياً بدلاً من وقت ثابت
+            try:
+                wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "li.b_algo h2 a")))
+            except Exception:
+                if looks_blocked(self.driver.current_url, self.driver.title):
+                    rate_limiter.throttled("https://www.bing.com")
+                    self._blocked = True
+                    return None
 
             # Bing Results Selector (li.b_algo h2 a)
             results = self.driver.find_elements(By.CSS_SELECTOR, "li.b_algo h2 a")
@@ -92,13 +101,98 @@ class DataEnricher:
                     return url
                     
         except Exception as e:
+            # خطأ مؤقت وليس "لا يوجد موقع": لا يُخزن في الكاش المشترك
             print(f"⚠️ Bing Search Error: {e}")
+            self._search_failed = True
             
         return None
 
+    # --- أدوات استخراج الإيميل (مشتركة بين مسار HTTP ومسار المتصفح) ---
+    def _extract_email(self, html):
+        emails = EMAIL_RE.findall(html or "")
+        valid_emails = list(set([e for e in emails if not e.lower().endswith(BAD_EXT)]))
+        if not valid_emails:
+            return None
+
+        for p in PRIORITY:
+            for e in valid_emails:
+                if p in e:
+                    return e
+        return valid_emails[0]
+
+    def _contact_url_from_html(self, html, base_url):
+        for href, text in CONTACT_LINK_RE.findall(html or ""):
+            if "contact" in href.lower() or "contact" in text.lower() or "اتصل" in text:
+                c_url = urljoin(base_url, href)
+                if c_url.startswith("http") and c_url.rstrip("/") != base_url.rstrip("/"):
+                    return c_url
+        return None
+
+    def _scan_via_http(self, target_website):
+        """
+        المسار السريع: جلب الصفحة عبر HTTP بدون متصفح.
+        يعيد (email, needs_browser)
+        """
+        html, final_url = http_fetcher.fetch(target_website)
+        if looks_js_rendered(html):
+            return None, True
+
+        email = self._extract_email(html)
+        if email:
+            return email, False
+
+        # صفحة Contact Us عبر HTTP أيضاً
+        c_url = self._contact_url_from_html(html, final_url)
+        if c_url:
+            c_html, _ = http_fetcher.fetch(c_url)
+            email = self._extract_email(c_html)
+            if email:
+                print(f"✅ Email Found in Contact Page (HTTP): {email}")
+                return email, False
+
+        # موقع ثابت بدون إيميل: لا داعي لفتح متصفح
+        return None, False
+
+    def _scan_via_browser(self, target_website):
+        """المسار البطيء: تحميل الصفحة بالمتصفح (للمواقع المبنية بالجافاسكريبت)"""
+        self.start_session()
+        self.driver.set_page_load_timeout(25)
+
+        try:
+            if not self._open(target_website):
+                return None  # صفحة حظر / كابتشا: لا فائدة من البحث فيها
+            self._wait_ready()
+        except:
+            print(f"⚠️ Timeout accessing {target_website}")
+            pass
+
+        email = self._extract_email(self.driver.page_source)
+        if email:
+            return email
+
+        # محاولة صفحة Contact Us
+        try:
+            xpath = "//a[contains(@href, 'contact') or contains(@href, 'Contact') or contains(text(), 'Contact') or contains(text(), 'اتصل')]"
+            contact_links = self.driver.find_elements(By.XPATH, xpath)
+
+            if contact_links:
+                c_url = contact_links[0].get_attribute("href")
+                if c_url and c_url != self.driver.current_url:
+                    if not self._open(c_url):
+                        return None
+                    self._wait_ready()
+                    email = self._extract_email(self.driver.page_source)
+                    if email:
+                        print(f"✅ Email Found in Contact Page: {email}")
+                        return email
+        except: pass
+
+        return None
+
     def find_emails_and_people(self, company_name, website):
         """
         المحرك الذكي: يطبق الـ 3 Flows لاستخراج الداتا
+        يعيد (data, outcome): outcome = email / no_email / no_website / blocked / error
         """
         data = {
             "email": "غير متوفر",
@@ -107,76 +201,57 @@ class DataEnricher:
             "linkedin_url": ""
         }
 
-        try:
-            if not self.driver:
-                self.start_session()
+        self._blocked = False
+        self._search_failed = False
+        with metrics.span("enrich") as enrich_span:
+            try:
+                # ---------------------------------------------------------
+                # Flow 1 & 2: التحقق من الرابط أو البحث عنه
+                # ---------------------------------------------------------
+                target_website = website
 
-            # ---------------------------------------------------------
-            # Flow 1 & 2: التحقق من الرابط أو البحث عنه
-            # ---------------------------------------------------------
-            target_website = website
+                # إذا لم يوجد موقع، نستخدم Flow 2 (بحث Bing)
+                if not target_website or "غير" in target_website or "google" in target_website:
+                    with metrics.span("bing_search") as span:
+                        self.start_session()
+                        target_website = self._search_bing_selenium(company_name)
+                        span.outcome = "found" if target_website else ("error" if self._search_failed else "not_found")
 
-            # إذا لم يوجد موقع، نستخدم Flow 2 (بحث Bing)
-            if not target_website or "غير" in target_website or "google" in target_website:
-                target_website = self._search_bing_selenium(company_name)
-            
-            if not target_website:
-                print(f"❌ Flow 2 Failed: No website found for {company_name}")
-                return data 
-
-            # ---------------------------------------------------------
-            # Flow 3: زيارة الموقع واستخراج البيانات
-            # ---------------------------------------------------------
-            print(f"🕵️ Deep Scan: Visiting {target_website}")
-            self.driver.set_page_load_timeout(25)
-            
-            try:
-                self.driver.get(target_website)
-                time.sleep(3)
-            except:
-                print(f"⚠️ Timeout accessing {target_website}")
-                pass
+                if not target_website:
+                    print(f"❌ Flow 2 Failed: No website found for {company_name}")
+                    if self._blocked:
+                        enrich_span.outcome = "blocked"
+                    else:
+                        enrich_span.outcome = "error" if self._search_failed else "no_website"
+                    return data, enrich_span.outcome
 
-            page_source = self.driver.page_source
-            
-            # استخراج الإيميلات
-            emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', page_source)
-            bad_ext = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.css', '.js', '.webp', '.mp4')
-            valid_emails = list(set([e for e in emails if not e.lower().endswith(bad_ext)]))
-
-            if valid_emails:
-                priority = ['info', 'contact', 'sales', 'hello', 'admin', 'support']
-                preferred = None
-                for p in priority:
-                    for e in valid_emails:
-                        if p in e:
-                            preferred = e
-                            break
-                    if preferred: break
-                
-                data['email'] = preferred if preferred else valid_emails[0]
-                print(f"✅ Email Found: {data['email']}")
-
-            # محاولة صفحة Contact Us
-            if data['email'] == "غير متوفر":
-                try:
-                    xpath = "//a[contains(@href, 'contact') or contains(@href, 'Contact') or contains(text(), 'Contact') or contains(text(), 'اتصل')]"
-                    contact_links = self.driver.find_elements(By.XPATH, xpath)
-                    
-                    if contact_links:
-                        c_url = contact_links[0].get_attribute("href")
-                        if c_url and c_url != self.driver.current_url:
-                            self.driver.get(c_url)
-                            time.sleep(2)
-                            src = self.driver.page_source
-                            new_emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', src)
-                            valid_new = [e for e in new_emails if not e.lower().endswith(bad_ext)]
-                            if valid_new:
-                                data['email'] = valid_new[0]
-                                print(f"✅ Email Found in Contact Page: {valid_new[0]}")
-                except: pass
+                # ---------------------------------------------------------
+                # Flow 3: زيارة الموقع واستخراج البيانات (HTTP أولاً ثم المتصفح عند الحاجة)
+                # ---------------------------------------------------------
+                print(f"🕵️ Deep Scan: Visiting {target_website}")
+                with metrics.span("site_http") as span:
+                    email, needs_browser = self._scan_via_http(target_website)
+                    span.outcome = "js_rendered" if needs_browser else ("email" if email else "no_email")
 
-        except Exception as e:
-            print(f"⚠️ Enrichment Error for {company_name}: {e}")
-        
-        return data
\ No newline at end of file
+                if needs_browser:
+                    http_fetcher.count("selenium_fallbacks")
+                    with metrics.span("site_browser") as span:
+                        email = self._scan_via_browser(target_website)
+                        span.outcome = "email" if email else "no_email"
+                else:
+                    http_fetcher.count("http_resolved")
+
+                if email:
+                    data['email'] = email
+                    print(f"✅ Email Found: {data['email']}")
+                enrich_span.outcome = "email" if email else ("blocked" if self._blocked else "no_email")
+
+            except DriverPoolTimeout:
+                # المسبح مشغول: ليست نتيجة "بدون إيميل"، المهمة تعيد المحاولة لاحقاً
+                enrich_span.outcome = "pool_timeout"
+                raise
+            except Exception as e:
+                print(f"⚠️ Enrichment Error for {company_name}: {e}")
+                enrich_span.outcome = "error"
+
+        return data, enrich_span.outcome
@@ -0,0 +1,261 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from app.utils.metrics import metrics
+
+# --- إعدادات المسبح (قابلة للتغيير من متغيرات البيئة) ---
+POOL_SIZE = int(os.environ.get("DRIVER_POOL_SIZE", 3))              # أقصى عدد متصفحات مفتوحة في نفس الوقت
+MAX_PAGES_PER_DRIVER = int(os.environ.get("DRIVER_MAX_PAGES", 200))  # إعادة تدوير المتصفح بعد عدد صفحات معين
+CHECKOUT_TIMEOUT = float(os.environ.get("DRIVER_CHECKOUT_TIMEOUT", 300))
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+
+def build_chrome_driver():
+    """
+    تشغيل متصفح كروم Headless بإعدادات Render (مشتركة بين الخرائط والإثراء)
+    """
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument("--disable-notifications")
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+
+    # مسارات Render
+    chrome_bin = os.environ.get("CHROME_BIN")
+    if chrome_bin:
+        chrome_options.binary_location = chrome_bin
+
+    driver_path = os.environ.get("CHROMEDRIVER_PATH")
+
+    try:
+        if driver_path and os.path.exists(driver_path):
+            service = Service(executable_path=driver_path)
+        else:
+            service = Service()
+        return webdriver.Chrome(service=service, options=chrome_options)
+    except Exception as e:
+        print(f"❌ خطأ قاتل في تشغيل المتصفح: {e}")
+        raise e
+
+
+class DriverPoolTimeout(Exception):
+    pass
+
+
+class _PooledDriver:
+    """غلاف بسيط يحفظ عمر المتصفح وعدد الصفحات التي فتحها"""
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.time()
+
+
+class DriverPool:
+    """
+    مسبح متصفحات دافئ (Warm Pool):
+    - عدد محدود من المتصفحات (لا نتجاوز الرام المتاحة مهما زاد عدد عمليات البحث)
+    - فحص صحة المتصفح قبل تسليمه
+    - إعادة تدوير المتصفح بعد N صفحة أو عند الانهيار
+    """
+    def __init__(self, size=POOL_SIZE, max_pages=MAX_PAGES_PER_DRIVER, factory=build_chrome_driver):
+        self.size = size
+        self.max_pages = max_pages
+        self._factory = factory
+        self._idle = []
+        self._by_driver = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            "created": 0,
+            "recycled": 0,
+            "discarded_unhealthy": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "timeouts": 0,
+        }
+
+    # --- أدوات داخلية ---
+    def _in_use(self):
+        return len(self._by_driver) - len(self._idle)
+
+    def _is_healthy(self, pooled):
+        try:
+            pooled.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _forget(self, pooled):
+        """إزالة المتصفح من المسبح (تحت القفل)، والإغلاق نفسه يتم خارج القفل بـ _quit"""
+        self._by_driver.pop(id(pooled.driver), None)
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    # --- الاستلام والتسليم ---
+    # أي استدعاء للمتصفح نفسه (فحص الصحة / مسح الكوكيز / quit) يتم خارج القفل:
+    # متصفح معلق واحد لا يوقف استلام وتسليم باقي المتصفحات
+    def acquire(self, timeout=CHECKOUT_TIMEOUT):
+        started = time.time()
+        waited = False
+        while True:
+            pooled = placeholder = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Driver pool is closed")
+
+                    # 1. متصفح جاهز في المسبح (يبقى محجوزاً لنا أثناء فحصه)
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+
+                    # 2. يوجد مكان لمتصفح جديد
+                    if len(self._by_driver) < self.size:
+                        # نحجز المكان قبل التشغيل البطيء خارج القفل
+                        placeholder = object()
+                        self._by_driver[id(placeholder)] = placeholder
+                        break
+
+                    # 3. المسبح ممتلئ: ننتظر حتى يرجع أحدهم متصفحاً
+                    remaining = timeout - (time.time() - started)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise DriverPoolTimeout(f"No browser available after {timeout}s")
+                    if not waited:
+                        self._stats["waits"] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+
+            if pooled is not None:
+                if self._is_healthy(pooled):
+                    with self._cond:
+                        self._stats["checkouts"] += 1
+                        if waited:
+                            self._stats["wait_seconds_total"] += time.time() - started
+                    return pooled.driver
+                with self._cond:
+                    self._stats["discarded_unhealthy"] += 1
+                    self._forget(pooled)
+                    self._cond.notify()
+                self._quit(pooled.driver)
+                continue
+            break
+
+        try:
+            # تشغيل Chrome البارد (أبطأ مرحلة عند امتلاء المسبح بمتصفحات جديدة)
+            with metrics.span("browser_start"):
+                driver = self._factory()
+        except Exception:
+            with self._cond:
+                self._by_driver.pop(id(placeholder), None)
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._by_driver.pop(id(placeholder), None)
+            self._by_driver[id(driver)] = _PooledDriver(driver)
+            self._stats["created"] += 1
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["wait_seconds_total"] += time.time() - started
+        return driver
+
+    def release(self, driver, broken=False):
+        discard = False
+        with self._cond:
+            pooled = self._by_driver.get(id(driver))
+            if pooled is not None:
+                discard = broken or self._closed or pooled.pages >= self.max_pages
+                if discard:
+                    if broken:
+                        self._stats["discarded_unhealthy"] += 1
+                    elif not self._closed:
+                        self._stats["recycled"] += 1
+                    self._forget(pooled)
+                    self._cond.notify()
+
+        if pooled is None or discard:
+            # متصفح غير تابع للمسبح، أو خرج منه
+            self._quit(driver)
+            return
+
+        try:
+            # تنظيف الحالة قبل إعادة الاستخدام (كوكيز العميل السابق)
+            driver.delete_all_cookies()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            keep = healthy and not self._closed
+            if keep:
+                self._idle.append(pooled)
+            else:
+                if not healthy:
+                    self._stats["discarded_unhealthy"] += 1
+                self._forget(pooled)
+            self._cond.notify()
+        if not keep:
+            self._quit(driver)
+
+    def mark_page(self, driver):
+        """يتم استدعاؤها مع كل تحميل صفحة لحساب موعد إعادة التدوير"""
+        pooled = self._by_driver.get(id(driver))
+        if pooled is not None:
+            pooled.pages += 1
+
+    @contextmanager
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        driver = self.acquire(timeout)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            pooled = self._by_driver.get(id(driver))
+            broken = pooled is None or not self._is_healthy(pooled)
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    # --- المراقبة والإغلاق ---
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data.update({
+                "size": self.size,
+                "max_pages_per_driver": self.max_pages,
+                "open": len(self._by_driver),
+                "idle": len(self._idle),
+                "in_use": self._in_use(),
+            })
+        data["wait_seconds_total"] = round(data["wait_seconds_total"], 3)
+        return data
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            for pooled in idle:
+                self._forget(pooled)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._quit(pooled.driver)
+
+
+# المسبح المشترك على مستوى العملية (Process-wide)
+driver_pool = DriverPool()
@@ -1,109 +1,244 @@
-import time
-import re
 import os
-import platform
-from selenium import webdriver
+import re
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from app.engines.driver_pool import driver_pool
+from app.engines.rate_limiter import rate_limiter, looks_blocked, RateLimitTimeout
+from app.utils.maps_cache import maps_cache
+from app.utils.metrics import metrics
+
+PHONE_RE = re.compile(r'(?:\+20|0)(?:1[0125]|2)\d{8}')
+NOT_AVAILABLE = "غير متوفر"
+
+# --- إعدادات السحب ---
+MAPS_MAX_SCROLLS = int(os.environ.get("MAPS_MAX_SCROLLS", 30))
+MAPS_SCROLL_WAIT = float(os.environ.get("MAPS_SCROLL_WAIT", 4))    # أقصى انتظار لظهور نتائج جديدة بعد كل سكرول
+MAPS_STALL_ROUNDS = int(os.environ.get("MAPS_STALL_ROUNDS", 2))    # سكرولات متتالية بدون جديد = نهاية القائمة
+# فتح لوحة التفاصيل: missing = فقط للأماكن الناقصة من بطاقة القائمة / always / never
+MAPS_DETAIL_MODE = os.environ.get("MAPS_DETAIL_MODE", "missing")
+
+# عدد الأماكن المختلفة المحملة في القائمة + هل ظهرت رسالة نهاية القائمة
+COUNT_PLACES_JS = """
+const feed = document.querySelector("div[role='feed']");
+if (!feed) return [0, false];
+const hrefs = new Set([...feed.querySelectorAll("a[href*='/maps/place/']")].map(a => a.href.split('?')[0]));
+const end = !!feed.querySelector("span.HlvSq") || /reached the end|وصلت إلى نهاية/i.test(feed.lastElementChild ? feed.lastElementChild.innerText : "");
+return [hrefs.size, end];
+"""
+
+# قراءة كل البطاقات في تمريرة واحدة على الـ DOM
+PARSE_FEED_JS = """
+const feed = document.querySelector("div[role='feed']");
+if (!feed) return [];
+const seen = new Set();
+const places = [];
+for (const a of feed.querySelectorAll("a[href*='/maps/place/']")) {
+    const href = a.href.split('?')[0];
+    if (seen.has(href)) continue;
+    seen.add(href);
+    const card = a.closest("div[role='article']") || a.parentElement;
+    const site = card ? [...card.querySelectorAll("a[href^='http']")].find(x => !x.href.includes('google.')) : null;
+    const lines = card ? card.innerText.split('\\n').map(s => s.trim()).filter(Boolean) : [];
+    places.push({name: a.getAttribute('aria-label') || lines[0] || '', href: a.href, website: site ? site.href : '', lines: lines});
+}
+return places;
+"""
+
+# لوحة تفاصيل المكان المفتوح حالياً
+PARSE_DETAIL_JS = """
+const q = s => document.querySelector(s);
+const phone = q("button[data-item-id^='phone:tel:']");
+const site = q("a[data-item-id='authority']");
+const address = q("button[data-item-id='address']");
+const title = q("h1");
+return {
+    name: title ? title.innerText.trim() : '',
+    phone: phone ? phone.getAttribute('data-item-id').replace('phone:tel:', '') : '',
+    website: site ? site.href : '',
+    address: address ? (address.getAttribute('aria-label') || address.innerText).replace(/^[^:]*:\\s*/, '').trim() : ''
+};
+"""
+
+
+class MapsBlocked(Exception):
+    pass
+
+
+def _phones_from_text(text):
+    # نفس نمط الأرقام المصرية السابق لكن على نص البطاقة فقط بدلاً من الصفحة كاملة
+    numbers = PHONE_RE.findall((text or "").replace(" ", "").replace("-", ""))
+    return list(dict.fromkeys(numbers))
+
+
+def _address_from_lines(lines, name):
+    # سطر العنوان في البطاقة غالباً بالشكل: "التصنيف · العنوان"
+    for line in lines[1:]:
+        if "·" in line and not PHONE_RE.search(line.replace(" ", "")):
+            parts = [p.strip() for p in line.split("·") if p.strip()]
+            if len(parts) > 1 and parts[-1] != name:
+                return parts[-1]
+    return ""
+
 
 class GmapsEngine:
-    def __init__(self):
-        self.driver = self._setup_driver()
-
-    def _setup_driver(self):
-        chrome_options = Options()
-        
-        # --- إعدادات السيرفر (Headless) ---
-        chrome_options.add_argument("--headless=new")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument("--disable-notifications")
-        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
-
-        # --- تحديد المسارات يدوياً (الحل الجذري) ---
-        # 1. مسار المتصفح
-        chrome_bin = os.environ.get("CHROME_BIN")
-        if chrome_bin:
-            print(f"🖥️ Render Environment: Using Chrome at {chrome_bin}")
-            chrome_options.binary_location = chrome_bin
-        
-        # 2. مسار الدرايفر (يتم تحديده بناءً على وجود المتغير)
-        driver_path = os.environ.get("CHROMEDRIVER_PATH")
-        
+    def __init__(self, pool=None, cache=None, detail_mode=MAPS_DETAIL_MODE):
+        # المتصفح يتم استعارته من المسبح المشترك وقت البحث فقط (لا تشغيل بارد لكل عملية)
+        self.pool = pool or driver_pool
+        self.cache = cache or maps_cache
+        self.detail_mode = detail_mode
+        self.driver = None
+        self._live = False  # هل آخر scrape شغّل المتصفح فعلاً (أم جاء من الكاش)
+
+    def scrape(self, keyword: str, location: str, max_leads: int = 10):
+        """نتائج نفس البحث الحديثة تأتي من الكاش، والمتصفح يعمل فقط عند عدم وجودها"""
+        with metrics.span("maps_query") as span:
+            self._live = False
+            results = self.cache.get_or_scrape(keyword, location, max_leads, self._scrape_live)
+            span.outcome = ("live" if self._live else "cached") if results else "empty"
+        metrics.inc("maps_places_total", len(results or []))
+        return results
+
+    # --- 1. سكرول تكيفي: يتوقف عند تحميل max_leads مكان أو نهاية القائمة ---
+    def _load_places(self, max_leads):
+        count, end = self.driver.execute_script(COUNT_PLACES_JS)
+        stalled = 0
+        for _ in range(MAPS_MAX_SCROLLS):
+            if count >= max_leads or end or stalled >= MAPS_STALL_ROUNDS:
+                break
+            self.driver.execute_script(
+                "const f = document.querySelector(\"div[role='feed']\"); if (f) f.scrollTop = f.scrollHeight;"
+            )
+            previous = count
+            try:
+                # انتظار ظهور نتائج جديدة فعلياً بدلاً من sleep ثابت
+                WebDriverWait(self.driver, MAPS_SCROLL_WAIT, poll_frequency=0.25).until(
+                    lambda d: (lambda c: c[0] > previous or c[1])(d.execute_script(COUNT_PLACES_JS))
+                )
+            except Exception:
+                pass
+            count, end = self.driver.execute_script(COUNT_PLACES_JS)
+            stalled = stalled + 1 if count <= previous else 0
+        return count
+
+    # --- 2. لوحة التفاصيل (رقم / موقع / عنوان) بانتظار صريح لظهورها ---
+    def _open(self, url):
+        """فتح صفحة من الخرائط بحصة google.com المشتركة بين كل العمال"""
+        try:
+            rate_limiter.acquire(url)
+        except RateLimitTimeout as e:
+            raise MapsBlocked(str(e))
         try:
-            service = None
-            if driver_path and os.path.exists(driver_path):
-                 print(f"🔌 Using Custom ChromeDriver at: {driver_path}")
-                 service = Service(executable_path=driver_path)
-            else:
-                 print("⚠️ Driver path not found in env, trying default Service()...")
-                 # محاولة التشغيل الافتراضي (للوكال هوست)
-                 service = Service()
-
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            return driver
+            self.driver.get(url)
+        except Exception:
+            rate_limiter.error(url)
+            raise
+        finally:
+            self.pool.mark_page(self.driver)
+        if looks_blocked(self.driver.current_url, self.driver.title):
+            rate_limiter.throttled(url)
+            raise MapsBlocked(f"Google طلب كابتشا: {self.driver.current_url}")
+        rate_limiter.success(url)
 
+    def _read_detail(self, place):
+        try:
+            self._open(place["href"])
+            WebDriverWait(self.driver, 8).until(
+                lambda d: d.execute_script("const h = document.querySelector('h1'); return h && h.innerText.trim().length > 0;")
+            )
+            try:
+                # الأزرار تظهر بعد العنوان بلحظات
+                WebDriverWait(self.driver, 2).until(EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, "button[data-item-id^='phone:tel:'], a[data-item-id='authority'], button[data-item-id='address']")
+                ))
+            except Exception:
+                pass
+            return self.driver.execute_script(PARSE_DETAIL_JS)
+        except MapsBlocked:
+            raise
         except Exception as e:
-            print(f"❌ خطأ قاتل في تشغيل المتصفح: {e}")
-            raise e
+            print(f"⚠️ [Gmaps] تعذر فتح تفاصيل {place.get('name')}: {e}")
+            return {}
 
-    def scrape(self, keyword: str, location: str, max_leads: int = 10):
+    def _needs_detail(self, record):
+        if self.detail_mode == "always":
+            return True
+        if self.detail_mode == "never":
+            return False
+        return record["phone"] == NOT_AVAILABLE or record["website"] == NOT_AVAILABLE
+
+    def _scrape_live(self, keyword: str, location: str, max_leads: int = 10):
+        """يعيد (results, complete): complete=False عند الحظر / الخطأ في منتصف السحب (نتائج جزئية)"""
         results = []
+        complete = False
+        self._live = True
+        with metrics.span("browser_checkout"):
+            self.driver = self.pool.acquire()
         try:
             query = f"{keyword} in {location}"
             print(f"🚀 [Gmaps] Searching: {query}")
-            
-            self.driver.get(f"https://www.google.com/maps/search/{query}")
-            
-            wait = WebDriverWait(self.driver, 20)
-            try:
-                wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div[role='feed']")))
-            except:
+
+            with metrics.span("maps_open") as span:
+                self._open(f"https://www.google.com/maps/search/{query}")
+                try:
+                    WebDriverWait(self.driver, 20).until(EC.presence_of_element_located((By.CSS_SELECTOR, "div[role='feed']")))
+                except Exception:
+                    span.outcome = "no_feed"
+            if span.outcome == "no_feed":
                 print("⚠️ واجهة النتائج لم تظهر بوضوح.")
+                return results, complete
 
-            # --- سكرول بسيط ---
-            scrollable_div = self.driver.find_element(By.CSS_SELECTOR, "div[role='feed']")
-            for _ in range(3): # عدد مرات سكرول محدود للتجربة
-                self.driver.execute_script('arguments[0].scrollTop = arguments[0].scrollHeight', scrollable_div)
-                time.sleep(2)
+            with metrics.span("maps_scroll"):
+                loaded = self._load_places(max_leads)
+                places = self.driver.execute_script(PARSE_FEED_JS)[:max_leads]
+            print(f"🔍 Found {loaded} leads (using {len(places)}).")
 
-            company_links = self.driver.find_elements(By.CSS_SELECTOR, "a[href*='/maps/place/']")
-            print(f"🔍 Found {len(company_links)} leads.")
+            records = []
+            for place in places:
+                phones = _phones_from_text(" ".join(place.get("lines") or []))
+                records.append((place, {
+                    "company_name": place.get("name") or "Unknown",
+                    "industry": keyword,
+                    "location": location,
+                    "address": _address_from_lines(place.get("lines") or [], place.get("name")),
+                    "phone": " | ".join(phones) if phones else NOT_AVAILABLE,
+                    "website": place.get("website") or NOT_AVAILABLE
+                }))
 
-            for link in company_links[:max_leads]:
-                try:
-                    self.driver.execute_script("arguments[0].click();", link)
-                    time.sleep(1.5)
-                    
-                    name = link.get_attribute("aria-label") or "Unknown"
-                    page_html = self.driver.page_source
-                    
-                    # استخراج الأرقام
-                    all_numbers = re.findall(r'(?:\+20|0)(?:1[0125]|2)\d{8}', page_html)
-                    unique_numbers = list(set(all_numbers))
-                    phone = " | ".join(unique_numbers) if unique_numbers else "غير متوفر"
-
-                    results.append({
-                        "company_name": name,
-                        "industry": keyword,
-                        "location": location,
-                        "phone": phone,
-                        "website": "غير متوفر"
-                    })
-                    print(f"✅ Saved: {name} | {phone}")
-
-                except: continue
-        
+            # التفاصيل بعد الانتهاء من القائمة (فتحها يغير الصفحة)
+            blocked = False
+            for place, record in records:
+                if self._needs_detail(record) and not blocked:
+                    with metrics.span("maps_detail") as span:
+                        try:
+                            detail = self._read_detail(place)
+                            span.outcome = "ok" if detail else "failed"
+                        except MapsBlocked as e:
+                            # نكمل ببيانات القائمة فقط بدلاً من ضرب جوجل أثناء الحظر
+                            print(f"🚦 [Gmaps] {e}")
+                            blocked, detail = True, {}
+                            span.outcome = "blocked"
+                    phones = _phones_from_text(detail.get("phone")) or ([detail["phone"]] if detail.get("phone") else [])
+                    if phones and record["phone"] == NOT_AVAILABLE:
+                        record["phone"] = " | ".join(phones)
+                    if detail.get("website") and record["website"] == NOT_AVAILABLE:
+                        record["website"] = detail["website"]
+                    if detail.get("address"):
+                        record["address"] = detail["address"]
+                results.append(record)
+                print(f"✅ Saved: {record['company_name']} | {record['phone']}")
+
+            complete = not blocked
+
+        except MapsBlocked as e:
+            print(f"🚦 [Gmaps] {e}")
+            metrics.inc("maps_blocked_total")
         except Exception as e:
             print(f"❌ Scraping Error: {e}")
+            metrics.inc("maps_errors_total")
         finally:
-            try: self.driver.quit()
-            except: pass
-            
-        return results
\ No newline at end of file
+            # إرجاع المتصفح للمسبح بدلاً من إغلاقه (ويتم استبداله تلقائياً إذا انهار)
+            self.pool.release(self.driver)
+            self.driver = None
+
+        return results, complete
@@ -0,0 +1,113 @@
+import os
+import re
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from app.engines.driver_pool import USER_AGENT
+from app.engines.rate_limiter import rate_limiter, looks_blocked, RateLimitTimeout
+
+# --- إعدادات الجلب السريع ---
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_FETCH_CONNECT_TIMEOUT", 3))
+READ_TIMEOUT = float(os.environ.get("HTTP_FETCH_READ_TIMEOUT", 6))
+MAX_BYTES = int(os.environ.get("HTTP_FETCH_MAX_BYTES", 1_500_000))  # حد أقصى لحجم الصفحة
+MIN_VISIBLE_TEXT = 200  # أقل من هذا = الصفحة غالباً تُبنى بالجافاسكريبت
+
+_SCRIPT_RE = re.compile(r'<(script|style|noscript)[^>]*>.*?</\1>', re.S | re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.S | re.I)
+_SPA_MARKERS = ('id="root"></div>', 'id="app"></div>', 'id="__next"></div>', 'enable javascript')
+
+
+class HttpFetcher:
+    """
+    جلب صفحات HTML عبر HTTP مباشرة (بدون متصفح):
+    اتصالات مُعاد استخدامها (Connection Pool)، ضغط gzip، مهلة قصيرة، وحد أقصى للحجم.
+    """
+    def __init__(self, pool_size=50, limiter=None):
+        self.limiter = limiter or rate_limiter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.5",
+            "Accept-Encoding": "gzip, deflate",
+            "Accept-Language": "en,ar;q=0.8",
+        })
+        self._lock = threading.Lock()
+        self._stats = {
+            "http_pages": 0,          # صفحات تم جلبها بنجاح عبر HTTP
+            "http_failures": 0,       # أخطاء شبكة / صفحات غير HTML
+            "http_resolved": 0,       # شركات انتهت بالكامل عبر HTTP
+            "selenium_fallbacks": 0,  # شركات احتاجت متصفح
+            "bytes_downloaded": 0,
+        }
+
+    def count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def fetch(self, url):
+        """يعيد (html, final_url) أو (None, None) عند الفشل"""
+        if not url.startswith(("http://", "https://")):
+            url = "http://" + url
+        try:
+            # حصة الموقع المشتركة بين كل العمال (بدلاً من ضرب نفس الموقع بالتوازي)
+            self.limiter.acquire(url)
+        except RateLimitTimeout:
+            self.count("http_failures")
+            return None, None
+        try:
+            with self.session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True, allow_redirects=True) as r:
+                content_type = r.headers.get("Content-Type", "")
+                if r.status_code in (429, 503):
+                    self.limiter.throttled(url, r.headers.get("Retry-After") if (r.headers.get("Retry-After") or "").isdigit() else None)
+                    self.count("http_failures")
+                    return None, None
+                if r.status_code >= 400 or ("html" not in content_type and "xml" not in content_type):
+                    self.limiter.success(url)  # الموقع يرد بشكل طبيعي
+                    self.count("http_failures")
+                    return None, None
+
+                chunks, size = [], 0
+                for chunk in r.iter_content(chunk_size=65536):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= MAX_BYTES:
+                        break
+                body = b"".join(chunks)[:MAX_BYTES]
+                html = body.decode(r.encoding or "utf-8", errors="replace")
+                title = _TITLE_RE.search(html)
+                if looks_blocked(r.url, title.group(1) if title else ""):
+                    self.limiter.throttled(url)
+                    self.count("http_failures")
+                    return None, None
+                self.limiter.success(url)
+                self.count("http_pages")
+                self.count("bytes_downloaded", len(body))
+                return html, r.url
+        except Exception:
+            self.limiter.error(url)
+            self.count("http_failures")
+            return None, None
+
+
+def looks_js_rendered(html):
+    """هل الصفحة فارغة أو مبنية بالجافاسكريبت (تحتاج متصفح حقيقي)؟"""
+    if not html:
+        return True
+    visible = _TAG_RE.sub(" ", _SCRIPT_RE.sub(" ", html))
+    visible = " ".join(visible.split())
+    if len(visible) < MIN_VISIBLE_TEXT:
+        return True
+    lower = html.lower()
+    return len(visible) < 1000 and any(m in lower for m in _SPA_MARKERS)
+
+
+# نسخة مشتركة على مستوى العملية (تستفيد من إعادة استخدام الاتصالات)
+http_fetcher = HttpFetcher()
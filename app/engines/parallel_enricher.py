@@ -0,0 +1,97 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.engines.data_enricher import DataEnricher
+from app.engines.verifier_pro import EmailVerifier
+from app.engines.driver_pool import driver_pool, DriverPoolTimeout
+from app.utils.enrichment_cache import enrichment_cache, UNCACHEABLE_OUTCOMES
+from app.utils.metrics import metrics, in_context
+
+# عدد العمال المتوازيين (افتراضياً = حجم مسبح المتصفحات)
+ENRICH_WORKERS = int(os.environ.get("ENRICH_WORKERS", driver_pool.size))
+
+EMPTY_RESULT = {
+    "email": "غير متوفر",
+    "decision_maker_name": "",
+    "decision_maker_role": "",
+    "linkedin_url": ""
+}
+
+
+class ParallelEnricher:
+    """
+    مرحلة الإثراء المتوازية:
+    توزع الشركات على N عامل (لكل عامل متصفحه الخاص من المسبح)،
+    وتعيد النتائج أولاً بأول بمجرد اكتمال كل شركة (بدون انتظار الباقي).
+    """
+    def __init__(self, workers=ENRICH_WORKERS, pool=None, cache=None):
+        self.workers = max(1, workers)
+        self.pool = pool or driver_pool
+        self.cache = cache or enrichment_cache
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _worker_enricher(self):
+        # كل Thread يحتفظ بنفس الـ DataEnricher، لكن المتصفح يُستعار لكل شركة فقط (انظر _process)
+        enricher = getattr(self._local, "enricher", None)
+        if enricher is None:
+            enricher = DataEnricher(pool=self.pool)
+            self._local.enricher = enricher
+            self._local.verifier = EmailVerifier()
+            with self._lock:
+                self._sessions.append(enricher)
+        return enricher, self._local.verifier
+
+    def _process(self, item):
+        # الكاش المشترك أولاً: لا متصفح ولا HTTP لشركة تم إثراؤها حديثاً لأي عميل
+        cached = self.cache.get(item['company_name'], item['website'], item.get('location'))
+        metrics.inc("enrichment_cache_total", outcome="hit" if cached else "miss")
+        if cached:
+            return cached
+
+        enricher, verifier = self._worker_enricher()
+        try:
+            extra_data, outcome = enricher.find_emails_and_people(item['company_name'], item['website'])
+        finally:
+            # إرجاع المتصفح للمسبح بعد كل شركة: مهمة واحدة لا تحجز المسبح كله طوال مدتها
+            enricher.stop_session()
+        email_status, confidence = verifier.verify(extra_data['email'])
+        if outcome not in UNCACHEABLE_OUTCOMES:
+            self.cache.put(item['company_name'], item['website'], extra_data, email_status, confidence, item.get('location'))
+        return extra_data, email_status, confidence
+
+    def enrich(self, items):
+        """
+        Generator: يعيد (item, extra_data, email_status, confidence) لكل شركة بترتيب الانتهاء.
+        خطأ في شركة واحدة لا يوقف باقي الشركات، إلا انتهاء مهلة انتظار متصفح من المسبح:
+        يُرفع للمهمة لتعيد المحاولة (وتكمل من الـ Checkpoint) بدلاً من حفظ الشركة بدون إيميل.
+        """
+        if not items:
+            return
+        workers = min(self.workers, len(items))
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich") as executor:
+                # in_context: قياسات العمال تُحسب ضمن تفصيل المهمة الحالية
+                process = in_context(self._process)
+                futures = {executor.submit(process, item): item for item in items}
+                for future in as_completed(futures):
+                    item = futures[future]
+                    try:
+                        extra_data, email_status, confidence = future.result()
+                    except DriverPoolTimeout:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+                    except Exception as e:
+                        print(f"⚠️ Enrichment Worker Error for {item.get('company_name')}: {e}")
+                        extra_data, email_status, confidence = dict(EMPTY_RESULT), "Missing", 0.0
+                    yield item, extra_data, email_status, confidence
+        finally:
+            # إرجاع كل المتصفحات للمسبح
+            for enricher in self._sessions:
+                try:
+                    enricher.stop_session()
+                except Exception:
+                    pass
+            self._sessions = []
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+from app.utils.dedup import registrable_domain
+
+# --- إعدادات الاحترام (Politeness) لكل موقع ---
+DEFAULT_RATE = float(os.environ.get("HOST_RATE_DEFAULT", 2))       # طلب/ثانية للمواقع العادية
+MIN_RATE = float(os.environ.get("HOST_RATE_MIN", 0.05))
+MAX_RATE = float(os.environ.get("HOST_RATE_MAX", 8))
+RATE_STEP = float(os.environ.get("HOST_RATE_STEP", 0.05))           # زيادة بعد كل نجاح (Additive Increase)
+BLOCK_BACKOFF = float(os.environ.get("HOST_BLOCK_BACKOFF", 30))     # أول إيقاف بعد كابتشا / 429 (يتضاعف)
+MAX_BACKOFF = float(os.environ.get("HOST_MAX_BACKOFF", 900))
+ACQUIRE_TIMEOUT = float(os.environ.get("HOST_ACQUIRE_TIMEOUT", 120))
+
+# مواقع حساسة تبدأ ببطء أكثر (تحظر بسرعة تحت التوازي)
+HOST_PROFILES = {
+    "google.com": {"rate": 0.5, "max_rate": 1.5},
+    "bing.com": {"rate": 0.5, "max_rate": 2},
+}
+
+BLOCK_MARKERS = (
+    "/sorry/", "unusual traffic", "captcha", "verify you are a human",
+    "are you a robot", "access denied", "too many requests",
+)
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def host_key(url):
+    """الموقع كله يشترك في نفس الحصة (maps.google.com و www.google.com = google.com)"""
+    domain = registrable_domain(url)
+    if domain:
+        return domain
+    try:
+        host = urlsplit(url if "://" in url else "http://" + url).hostname or ""
+    except ValueError:
+        host = ""
+    host = host.lower()
+    for known in HOST_PROFILES:
+        if host == known or host.endswith("." + known):
+            return known
+    return host or "unknown"
+
+
+def looks_blocked(*texts):
+    """صفحة كابتشا / حظر مؤقت؟ (يكفي تمرير الرابط والعنوان أو جزء من الصفحة)"""
+    joined = " ".join(t for t in texts if t).lower()
+    return any(marker in joined for marker in BLOCK_MARKERS)
+
+
+class _HostBucket:
+    def __init__(self, rate, max_rate):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.consecutive_blocks = 0
+        self.stats = {"requests": 0, "blocks": 0, "errors": 0, "waited_seconds": 0.0}
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class HostRateLimiter:
+    """
+    Token Bucket لكل موقع مشترك بين كل العمال المتوازيين في العملية،
+    بسرعة تتكيف (AIMD): تزيد تدريجياً مع النجاح، وتنخفض للنصف مع إيقاف مؤقت عند الحظر.
+    """
+    def __init__(self, default_rate=DEFAULT_RATE, profiles=None):
+        self.default_rate = default_rate
+        self.profiles = HOST_PROFILES if profiles is None else profiles
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            profile = self.profiles.get(key, {})
+            bucket = _HostBucket(profile.get("rate", self.default_rate), profile.get("max_rate", MAX_RATE))
+            self._buckets[key] = bucket
+        return bucket
+
+    def acquire(self, url, timeout=ACQUIRE_TIMEOUT):
+        """ينتظر حتى يسمح الموقع بطلب جديد. يعيد مدة الانتظار"""
+        key = host_key(url)
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                bucket = self._bucket(key)
+                now = time.monotonic()
+                bucket.refill(now)
+                if now >= bucket.blocked_until and bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    waited = now - started
+                    bucket.stats["requests"] += 1
+                    bucket.stats["waited_seconds"] += waited
+                    return waited
+                if now < bucket.blocked_until:
+                    wait = bucket.blocked_until - now
+                else:
+                    wait = (1 - bucket.tokens) / bucket.rate
+
+            if now - started + wait > timeout:
+                raise RateLimitTimeout(f"{key}: الموقع محظور / مزدحم لأكثر من {timeout} ثانية")
+            time.sleep(min(wait, 1.0))
+
+    def success(self, url):
+        with self._lock:
+            bucket = self._bucket(host_key(url))
+            bucket.consecutive_blocks = 0
+            bucket.rate = min(bucket.max_rate, bucket.rate + RATE_STEP)
+            bucket.capacity = max(1.0, bucket.rate)
+
+    def error(self, url):
+        """خطأ شبكة / مهلة: تخفيف بسيط للسرعة"""
+        with self._lock:
+            bucket = self._bucket(host_key(url))
+            bucket.stats["errors"] += 1
+            bucket.rate = max(MIN_RATE, bucket.rate * 0.8)
+
+    def throttled(self, url, retry_after=None):
+        """كابتشا / 429 / 503: نصف السرعة + إيقاف مؤقت يتضاعف مع تكرار الحظر"""
+        key = host_key(url)
+        with self._lock:
+            bucket = self._bucket(key)
+            bucket.stats["blocks"] += 1
+            bucket.consecutive_blocks += 1
+            bucket.rate = max(MIN_RATE, bucket.rate / 2)
+            bucket.capacity = max(1.0, bucket.rate)
+            bucket.tokens = 0
+            backoff = min(MAX_BACKOFF, BLOCK_BACKOFF * (2 ** (bucket.consecutive_blocks - 1)))
+            if retry_after:
+                backoff = max(backoff, min(MAX_BACKOFF, float(retry_after)))
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + backoff)
+        print(f"🚦 [RateLimit] {key} طلب التهدئة. إيقاف {backoff:.0f} ثانية (السرعة الآن {bucket.rate:.2f}/ث)")
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                key: {
+                    **b.stats,
+                    "waited_seconds": round(b.stats["waited_seconds"], 2),
+                    "rate": round(b.rate, 3),
+                    "blocked_for": round(max(0.0, b.blocked_until - now), 1),
+                }
+                for key, b in self._buckets.items()
+            }
+
+
+rate_limiter = HostRateLimiter()
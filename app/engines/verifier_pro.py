@@ -1,45 +1,166 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 import dns.resolver
+import dns.rdatatype
+import dns.exception
 from email_validator import validate_email
-import pandas as pd
+from app.utils.metrics import metrics
+
+# --- إعدادات كاش الـ MX (بالثواني) ---
+MX_CACHE_MAX_DOMAINS = int(os.environ.get("MX_CACHE_MAX_DOMAINS", 50000))
+MX_MIN_TTL = 60
+MX_MAX_TTL = 86400
+MX_NEGATIVE_TTL = int(os.environ.get("MX_NEGATIVE_TTL", 900))   # دومين بدون MX
+MX_TRANSIENT_TTL = 30                                           # مهلة / خطأ شبكة (لا نثق فيه طويلاً)
+
+
+def _clamp_ttl(ttl):
+    return max(MX_MIN_TTL, min(ttl, MX_MAX_TTL))
+
+
+def _negative_ttl(exc):
+    """
+    TTL الكاش السلبي من سجل SOA إن وجد (RFC 2308)، وإلا القيمة الافتراضية.
+    بنفس حدود الكاش الإيجابي: SOA بـ TTL صفر لا يلغي الكاش السلبي للدومين.
+    """
+    try:
+        kwargs = getattr(exc, "kwargs", {}) or {}
+        responses = [kwargs["response"]] if kwargs.get("response") else list((kwargs.get("responses") or {}).values())
+        for response in responses:
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    return _clamp_ttl(min(rrset.ttl, rrset[0].minimum))
+    except Exception:
+        pass
+    return _clamp_ttl(MX_NEGATIVE_TTL)
+
+
+class MxCache:
+    """
+    كاش نتائج MX لكل دومين (مشترك بين كل نسخ EmailVerifier):
+    - كاش إيجابي وسلبي يحترم الـ TTL الخاص بالسجلات
+    - دمج الطلبات المتزامنة (طلب واحد للـ DNS مهما تكرر نفس الدومين في نفس اللحظة)
+    """
+    def __init__(self, max_domains=MX_CACHE_MAX_DOMAINS):
+        self.max_domains = max_domains
+        self._entries = OrderedDict()   # domain -> (has_mx, expires_at)
+        self._inflight = {}             # domain -> Future
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "lookups": 0}
+
+    def _lookup(self, resolver, domain):
+        """يعيد (has_mx, ttl)"""
+        with self._lock:
+            self._stats["lookups"] += 1
+        with metrics.span("dns_mx") as span:
+            try:
+                answer = resolver.resolve(domain, 'MX')
+                ttl = answer.rrset.ttl if answer.rrset is not None else MX_MIN_TTL
+                span.outcome = "mx" if answer else "no_mx"
+                return bool(answer), _clamp_ttl(ttl)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+                span.outcome = "no_mx"
+                return False, _negative_ttl(e)
+            except Exception:
+                span.outcome = "transient"
+                return False, MX_TRANSIENT_TTL
+
+    def has_mx(self, resolver, domain):
+        domain = domain.strip().lower().rstrip(".")
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(domain)
+                self._stats["hits"] += 1
+                return entry[0]
+
+            future = self._inflight.get(domain)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[domain] = future
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not owner:
+            return future.result()
+
+        has_mx, ttl = False, MX_TRANSIENT_TTL
+        try:
+            has_mx, ttl = self._lookup(resolver, domain)
+        finally:
+            with self._lock:
+                self._entries[domain] = (has_mx, time.time() + ttl)
+                self._entries.move_to_end(domain)
+                while len(self._entries) > self.max_domains:
+                    self._entries.popitem(last=False)
+                self._inflight.pop(domain, None)
+            future.set_result(has_mx)
+        return has_mx
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["domains_cached"] = len(self._entries)
+        return data
+
+
+# الكاش المشترك على مستوى العملية
+mx_cache = MxCache()
+
 
 class EmailVerifier:
-    def __init__(self):
+    def __init__(self, cache=None):
         # إعدادات الـ DNS الدوارة (Rotating DNS) لمنع الحجب
         self.resolver = dns.resolver.Resolver()
         self.resolver.nameservers = ['1.1.1.1', '8.8.8.8', '9.9.9.9'] # Cloudflare, Google, Quad9
         self.resolver.timeout = 5
         self.resolver.lifetime = 5
+        self.cache = cache or mx_cache
 
     def check_mx_record(self, email):
-        """فحص وجود سيرفر إيميل حقيقي"""
+        """فحص وجود سيرفر إيميل حقيقي (من الكاش إن أمكن)"""
         try:
             domain = str(email).split('@')[1]
-            records = self.resolver.resolve(domain, 'MX')
-            return True if records else False
+            return self.cache.has_mx(self.resolver, domain)
         except:
             return False
 
-    def verify(self, email):
-        """
-        الدالة الرئيسية: تعيد (الحالة، نسبة الثقة)
-        """
+    def _clean(self, email):
+        """التنظيف والتحقق الهيكلي: يعيد (clean_email, None) أو (None, نتيجة نهائية)"""
         # 1. تنظيف أولي
         email_str = str(email).strip().lower()
         if not email or "غير متوفر" in email_str or "@" not in email_str:
-            return "Missing", 0.0
+            return None, ("Missing", 0.0)
 
         try:
             # 2. التحقق الهيكلي (Syntax)
             valid = validate_email(email_str, check_deliverability=False)
-            clean_email = valid.email
-            
+            return valid.email, None
+        except Exception:
+            return None, ("Invalid", 0.0)
+
+    def verify(self, email):
+        """
+        الدالة الرئيسية: تعيد (الحالة، نسبة الثقة)
+        """
+        with metrics.span("verify") as span:
+            clean_email, result = self._clean(email)
+            if result:
+                span.outcome = result[0].lower()
+                return result
+
             # 3. التحقق التقني (DNS MX)
             has_mx = self.check_mx_record(clean_email)
-            
+
             if has_mx:
+                span.outcome = "valid"
                 return "Valid", 100.0
             else:
+                span.outcome = "no_mx"
                 return "Risky (No MX)", 30.0
-                
-        except Exception:
-            return "Invalid", 0.0
\ No newline at end of file
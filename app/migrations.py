@@ -0,0 +1,200 @@
+"""
+ترحيلات قاعدة البيانات (Migrations) الخفيفة:
+create_all ينشئ الجداول الجديدة فقط، ولا يضيف أعمدة أو فهارس لجداول موجودة بالفعل على السيرفر.
+هنا كل ترحيل يُنفذ مرة واحدة ويُسجل في جدول schema_migrations.
+
+    python -m app.migrations
+"""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+
+# --- أدوات مساعدة ---
+def _has_column(conn, table, column):
+    return column in [c["name"] for c in inspect(conn).get_columns(table)]
+
+
+def _add_column(conn, table, column, ddl_type):
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _create_index(conn, name, table, columns):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+# --- الترحيلات (بالترتيب) ---
+def m001_lead_search_indexes(conn):
+    """
+    فهارس فلاتر جدول العملاء:
+    - (user_id, id) لجدول الداشبورد المرتب بـ id desc
+    - أعمدة industry_norm / location_norm (lowercase) بدلاً من ilike على النص الأصلي
+    - Postgres: فهارس trigram (pg_trgm) تدعم LIKE '%كلمة%'
+    - SQLite: جدول ظل FTS5 (trigram) متزامن عبر Triggers
+    """
+    _add_column(conn, "leads", "industry_norm", "VARCHAR")
+    _add_column(conn, "leads", "location_norm", "VARCHAR")
+    conn.execute(text(
+        "UPDATE leads SET industry_norm = lower(trim(industry)), location_norm = lower(trim(location)) "
+        "WHERE industry_norm IS NULL AND location_norm IS NULL"
+    ))
+
+    _create_index(conn, "ix_leads_user_id_id", "leads", "user_id, id")
+    _create_index(conn, "ix_leads_user_industry_norm", "leads", "user_id, industry_norm")
+    _create_index(conn, "ix_leads_user_location_norm", "leads", "user_id, location_norm")
+
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_leads_industry_norm_trgm ON leads USING gin (industry_norm gin_trgm_ops)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_leads_location_norm_trgm ON leads USING gin (location_norm gin_trgm_ops)"))
+        except Exception as e:
+            print(f"⚠️ [Migrations] تعذر إنشاء فهارس pg_trgm (صلاحيات؟): {e}")
+
+    elif dialect == "sqlite":
+        try:
+            with conn.begin_nested():
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5("
+                    "industry_norm, location_norm, content='leads', content_rowid='id', tokenize='trigram')"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER IF NOT EXISTS leads_fts_ai AFTER INSERT ON leads BEGIN "
+                    "INSERT INTO leads_fts(rowid, industry_norm, location_norm) VALUES (new.id, new.industry_norm, new.location_norm); END"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER IF NOT EXISTS leads_fts_ad AFTER DELETE ON leads BEGIN "
+                    "INSERT INTO leads_fts(leads_fts, rowid, industry_norm, location_norm) VALUES ('delete', old.id, old.industry_norm, old.location_norm); END"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER IF NOT EXISTS leads_fts_au AFTER UPDATE ON leads BEGIN "
+                    "INSERT INTO leads_fts(leads_fts, rowid, industry_norm, location_norm) VALUES ('delete', old.id, old.industry_norm, old.location_norm); "
+                    "INSERT INTO leads_fts(rowid, industry_norm, location_norm) VALUES (new.id, new.industry_norm, new.location_norm); END"
+                ))
+                conn.execute(text("INSERT INTO leads_fts(leads_fts) VALUES ('rebuild')"))
+        except Exception as e:
+            # SQLite أقدم من 3.34 لا يدعم tokenizer الـ trigram
+            print(f"⚠️ [Migrations] تعذر إنشاء جدول FTS5: {e}")
+
+
+def m002_backfill_user_lead_stats(conn):
+    """حساب جدول user_lead_stats من الصفر للعملاء الموجودين قبل العدادات التراكمية"""
+    conn.execute(text("DELETE FROM user_lead_stats"))
+    conn.execute(text(
+        "INSERT INTO user_lead_stats (user_id, total, valid_emails, mobile_phones, decision_makers, updated_at) "
+        "SELECT user_id, count(id), "
+        "sum(CASE WHEN email_status = 'Valid' THEN 1 ELSE 0 END), "
+        "sum(CASE WHEN phone LIKE '%01%' THEN 1 ELSE 0 END), "
+        "sum(CASE WHEN decision_maker_name IS NOT NULL AND decision_maker_name <> '' THEN 1 ELSE 0 END), "
+        "CURRENT_TIMESTAMP "
+        "FROM leads WHERE user_id IS NOT NULL GROUP BY user_id"
+    ))
+
+
+def m003_backfill_search_rollups(conn):
+    """بناء جداول التجميع الزمني من سجل البحث الموجود"""
+    from app.utils.search_rollups import backfill
+    backfill(conn)
+
+
+def m004_chat_and_payment_indexes(conn):
+    """فهارس قائمة محادثات الأدمن (آخر رسالة لكل مستخدم) وقائمة طلبات الدفع المعلقة"""
+    _create_index(conn, "ix_chat_messages_user_created", "chat_messages", "user_id, created_at")
+    _create_index(conn, "ix_payment_requests_status", "payment_requests", "status")
+
+
+def m005_search_job_batches(conn):
+    """أعمدة البحث المجمع (Batch) في طابور المهام"""
+    _add_column(conn, "search_jobs", "kind", "VARCHAR DEFAULT 'single'")
+    _add_column(conn, "search_jobs", "payload", "TEXT")
+    _add_column(conn, "search_jobs", "credits_charged", "INTEGER DEFAULT 0")
+
+
+def m006_lead_dedup_keys(conn):
+    """عمود updated_at + بناء مفاتيح منع التكرار للعملاء الموجودين (الدمج نفسه أمر منفصل)"""
+    _add_column(conn, "leads", "updated_at", "TIMESTAMP")
+    conn.execute(text("UPDATE leads SET updated_at = created_at WHERE updated_at IS NULL"))
+    from app.utils.dedup import build_keys
+    build_keys(conn)
+
+
+def m007_search_job_checkpoints(conn):
+    """نقاط حفظ المهام لاستكمالها بعد إعادة تشغيل العامل"""
+    _add_column(conn, "search_jobs", "checkpoint", "TEXT")
+    _add_column(conn, "search_jobs", "delivered_count", "INTEGER DEFAULT 0")
+
+
+def m008_search_history_timings(conn):
+    """تفصيل زمني لكل بحث (مدة كل مرحلة من مراحل السحب)"""
+    _add_column(conn, "search_history", "timings", "TEXT")
+
+
+def m009_repair_lead_norm_columns(conn):
+    """عملاء اكتسبوا industry / location بالدمج بدون تحديث أعمدة البحث المفهرسة"""
+    conn.execute(text(
+        "UPDATE leads SET industry_norm = lower(trim(industry)) WHERE industry_norm IS NULL AND industry IS NOT NULL AND industry != ''"
+    ))
+    conn.execute(text(
+        "UPDATE leads SET location_norm = lower(trim(location)) WHERE location_norm IS NULL AND location IS NOT NULL AND location != ''"
+    ))
+
+
+def m010_resync_lead_norm_columns(conn):
+    """
+    عملاء دُمجت فيهم industry / location (LeadWriter أو dedup collapse) وبقيت أعمدة البحث بالقيمة القديمة
+    (مثل "غير متوفر")، وليس NULL فقط كما في 009
+    """
+    for column in ("industry", "location"):
+        conn.execute(text(
+            f"UPDATE leads SET {column}_norm = lower(trim({column})) "
+            f"WHERE {column} IS NOT NULL AND {column} != '' "
+            f"AND ({column}_norm IS NULL OR {column}_norm != lower(trim({column})))"
+        ))
+
+
+MIGRATIONS = [
+    ("001_lead_search_indexes", m001_lead_search_indexes),
+    ("002_backfill_user_lead_stats", m002_backfill_user_lead_stats),
+    ("003_backfill_search_rollups", m003_backfill_search_rollups),
+    ("004_chat_and_payment_indexes", m004_chat_and_payment_indexes),
+    ("005_search_job_batches", m005_search_job_batches),
+    ("006_lead_dedup_keys", m006_lead_dedup_keys),
+    ("007_search_job_checkpoints", m007_search_job_checkpoints),
+    ("008_search_history_timings", m008_search_history_timings),
+    ("009_repair_lead_norm_columns", m009_repair_lead_norm_columns),
+    ("010_resync_lead_norm_columns", m010_resync_lead_norm_columns),
+]
+
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (version VARCHAR PRIMARY KEY, applied_at TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as conn:
+                migration(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, applied_at) VALUES (:v, :t)"),
+                    {"v": version, "t": datetime.utcnow()}
+                )
+        except IntegrityError:
+            # عملية أخرى (السيرفر أو العامل) طبقت نفس الترحيل في نفس اللحظة
+            continue
+        print(f"🧱 [Migrations] تم تطبيق {version}")
+
+
+if __name__ == "__main__":
+    from app import models
+    from app.database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
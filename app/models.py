@@ -1,8 +1,15 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
 
+def _lowered(column_name):
+    """قيمة افتراضية = نسخة lowercase من عمود آخر (لأعمدة البحث المفهرسة)"""
+    def default(context):
+        value = context.get_current_parameters().get(column_name)
+        return value.strip().lower() if value else None
+    return default
+
 # --- جدول المستخدمين (العملاء) ---
 class User(Base):
     __tablename__ = "users"
@@ -25,6 +32,7 @@ class User(Base):
     
     # ✅ (1) هنا سمينا العلاقة "messages"
     messages = relationship("ChatMessage", back_populates="user")
+    search_jobs = relationship("SearchJob", back_populates="user")
 
 # --- جدول البيانات المستخرجة (Leads) ---
 class Lead(Base):
@@ -36,6 +44,9 @@ class Lead(Base):
     company_name = Column(String, index=True)
     industry = Column(String, nullable=True)
     location = Column(String)
+    # نسخ lowercase مفهرسة للبحث (يتم ملؤها تلقائياً عند الإضافة)
+    industry_norm = Column(String, nullable=True, default=_lowered("industry"))
+    location_norm = Column(String, nullable=True, default=_lowered("location"))
     phone = Column(String)
     website = Column(String)
     
@@ -50,9 +61,59 @@ class Lead(Base):
     is_contacted = Column(Boolean, default=False) 
     last_contact_date = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # آخر دمج لبيانات جديدة
     
     owner = relationship("User", back_populates="leads")
 
+    __table_args__ = (
+        Index("ix_leads_user_id_id", "user_id", "id"),
+        Index("ix_leads_user_industry_norm", "user_id", "industry_norm"),
+        Index("ix_leads_user_location_norm", "user_id", "location_norm"),
+    )
+
+# --- مفاتيح منع التكرار (هاتف E.164 / دومين / اسم موحد) لكل مستخدم ---
+class LeadKey(Base):
+    __tablename__ = "lead_keys"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    key_hash = Column(String(40))
+    kind = Column(String)  # phone / domain / name
+    lead_id = Column(Integer, ForeignKey("leads.id"), index=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key_hash", name="uq_lead_keys_user_hash"),
+    )
+
+# --- كاش الإثراء المشترك بين كل العملاء (شركة / دومين -> نتيجة الإثراء والتحقق) ---
+class EnrichmentCacheEntry(Base):
+    __tablename__ = "enrichment_cache"
+
+    cache_key = Column(String, primary_key=True)  # domain:example.com أو name:اسم الشركة بعد التوحيد
+    company_name = Column(String)
+    website = Column(String, nullable=True)
+    email = Column(String, nullable=True)
+    email_status = Column(String, nullable=True)
+    confidence_score = Column(Float, default=0.0)
+    decision_maker_name = Column(String, nullable=True)
+    decision_maker_role = Column(String, nullable=True)
+    linkedin_url = Column(String, nullable=True)
+
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, index=True)  # للحذف الأقدم استخداماً (LRU)
+    hits = Column(Integer, default=0)
+
+# --- جدول إحصائيات العميل المجمعة (تحدث مع كل إضافة بدلاً من حسابها في كل مرة) ---
+class UserLeadStats(Base):
+    __tablename__ = "user_lead_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total = Column(Integer, default=0)
+    valid_emails = Column(Integer, default=0)
+    mobile_phones = Column(Integer, default=0)
+    decision_makers = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # --- جدول سجل البحث ---
 class SearchHistory(Base):
     __tablename__ = "search_history"
@@ -63,9 +124,78 @@ class SearchHistory(Base):
     location = Column(String)
     results_count = Column(Integer)
     search_date = Column(DateTime, default=datetime.utcnow)
+    timings = Column(Text, nullable=True)  # JSON: تفصيل زمني لمراحل المهمة (خرائط / إثراء / DNS / DB)
 
     user = relationship("User", back_populates="searches")
 
+# --- جدول التجميع الزمني لسجل البحث (Rollups: ساعة / يوم) ---
+class SearchRollup(Base):
+    __tablename__ = "search_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String)        # hour / day
+    bucket_start = Column(DateTime)     # بداية الساعة أو اليوم (UTC)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    keyword = Column(String, default="")
+    location = Column(String, default="")
+    searches = Column(Integer, default=0)
+    results_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "user_id", "keyword", "location", name="uq_search_rollups_bucket"),
+        Index("ix_search_rollups_range", "granularity", "bucket_start"),
+    )
+
+# --- جدول طابور مهام البحث (Job Queue) ---
+# الحالات: queued -> running -> done / failed (مع إعادة المحاولة تلقائياً)
+class SearchJob(Base):
+    __tablename__ = "search_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    keyword = Column(String)
+    location = Column(String)
+    target_limit = Column(Integer)
+    kind = Column(String, default="single")     # single / batch
+    payload = Column(Text, nullable=True)        # JSON: قائمة الاستعلامات في البحث المجمع
+    credits_charged = Column(Integer, default=0)
+    checkpoint = Column(Text, nullable=True)     # JSON: نتائج الخرائط + ما تم حفظه (للاستكمال بعد إعادة التشغيل)
+    delivered_count = Column(Integer, default=0) # عملاء تم تسليمهم فعلاً (أساس رد الرصيد)
+
+    status = Column(String, default="queued", index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.utcnow, index=True)  # موعد المحاولة القادمة (Backoff)
+    locked_by = Column(String, nullable=True)    # اسم العامل الذي يشغل المهمة
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    results_count = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    user = relationship("User", back_populates="search_jobs")
+    events = relationship("SearchJobEvent", back_populates="job")
+
+
+# --- أحداث تقدم مهمة البحث (تُبث للعميل عبر SSE) ---
+# الأنواع: started, maps_results, lead_enriched, leads_saved, retrying, finished, failed
+class SearchJobEvent(Base):
+    __tablename__ = "search_job_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("search_jobs.id"))
+    kind = Column(String)
+    data = Column(Text)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    job = relationship("SearchJob", back_populates="events")
+
+    __table_args__ = (
+        Index("ix_search_job_events_job_id_id", "job_id", "id"),
+    )
+
 # --- جدول طلبات الدفع والصور ---
 class PaymentRequest(Base):
     __tablename__ = "payment_requests"
@@ -80,6 +210,10 @@ class PaymentRequest(Base):
 
     owner = relationship("User", back_populates="payments")
 
+    __table_args__ = (
+        Index("ix_payment_requests_status", "status"),
+    )
+
 # --- جدول نظام الدعم الفني (Chat) ---
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -96,6 +230,10 @@ class ChatMessage(Base):
     # ✅ (2) تم التصحيح: يجب أن يشير back_populates إلى "messages" الموجودة في User
     user = relationship("User", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_chat_messages_user_created", "user_id", "created_at"),
+    )
+
 # --- جدول المصروفات التشغيلية ---
 class Expense(Base):
     __tablename__ = "expenses"
@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+from sqlalchemy import select, func, literal, union_all
+from app import models
+
+ADMIN_STATS_TTL = float(os.environ.get("ADMIN_STATS_TTL", 30))  # ثواني
+TOP_N = 5
+
+
+def compute_admin_kpis(db):
+    """
+    حساب مؤشرات لوحة الأدمن في استعلامين فقط بدلاً من ستة:
+    1) كل العدادات والمجاميع كـ Scalar Subqueries في SELECT واحد
+    2) أعلى الكلمات والمواقع في UNION ALL واحد (من جدول search_rollups)
+    """
+    totals = db.execute(select(
+        select(func.count(models.User.id)).scalar_subquery().label("total_users"),
+        select(func.count(models.Lead.id)).scalar_subquery().label("total_leads"),
+        select(func.coalesce(func.sum(models.PaymentRequest.amount), 0))
+            .where(models.PaymentRequest.status == "Approved").scalar_subquery().label("total_revenue"),
+        select(func.coalesce(func.sum(models.Expense.amount), 0)).scalar_subquery().label("total_expenses"),
+    )).one()
+
+    # من جداول التجميع اليومية بدلاً من GROUP BY على كامل search_history
+    rollup = models.SearchRollup
+    total = func.sum(rollup.searches)
+    top_keywords = select(literal("keyword").label("kind"), rollup.keyword.label("name"), total.label("count"))\
+        .where(rollup.granularity == "day", rollup.keyword != "")\
+        .group_by(rollup.keyword).order_by(total.desc()).limit(TOP_N).subquery()
+    top_locations = select(literal("location").label("kind"), rollup.location.label("name"), total.label("count"))\
+        .where(rollup.granularity == "day", rollup.location != "")\
+        .group_by(rollup.location).order_by(total.desc()).limit(TOP_N).subquery()
+    ranked = db.execute(union_all(select(top_keywords), select(top_locations))).all()
+
+    return {
+        "total_users": totals.total_users or 0,
+        "total_leads": totals.total_leads or 0,
+        "total_revenue": totals.total_revenue or 0,
+        "total_expenses": totals.total_expenses or 0,
+        "top_keywords": sorted([(r.name, r.count) for r in ranked if r.kind == "keyword"], key=lambda x: -x[1]),
+        "top_locations": sorted([(r.name, r.count) for r in ranked if r.kind == "location"], key=lambda x: -x[1]),
+    }
+
+
+def data_version(db):
+    """
+    بصمة رخيصة للبيانات التي تتغير خارج عملية السيرفر (عامل المهام يضيف عملاء وسجل بحث):
+    أعلى id في كل جدول (قراءة من فهرس المفتاح الأساسي فقط).
+    """
+    return tuple(db.execute(select(
+        select(func.max(models.SearchHistory.id)).scalar_subquery(),
+        select(func.max(models.Lead.id)).scalar_subquery(),
+        select(func.max(models.User.id)).scalar_subquery(),
+    )).one())
+
+
+class KpiSnapshot:
+    """
+    نسخة مخزنة من مؤشرات الأدمن لمدة قصيرة (TTL)،
+    مع مسح فوري (invalidate) عند أي دفع / مصروف داخل السيرفر،
+    ومقارنة بصمة البيانات (data_version) لما يضيفه عامل المهام من عملية أخرى.
+    """
+    def __init__(self, ttl=ADMIN_STATS_TTL, compute=compute_admin_kpis, version=data_version):
+        self.ttl = ttl
+        self._compute = compute
+        self._version = version
+        self._lock = threading.Lock()
+        self._value = None
+        self._value_version = None
+        self._expires_at = 0.0
+        self._computed_at = None
+        self._generation = 0
+        self._stats = {"hits": 0, "computations": 0, "invalidations": 0, "stale_versions": 0, "last_compute_ms": 0.0}
+
+    def get(self, db):
+        """يعيد (data, meta)"""
+        version = self._version(db)
+        with self._lock:
+            if self._value is not None and time.time() < self._expires_at:
+                if version == self._value_version:
+                    self._stats["hits"] += 1
+                    return self._value, self._meta(cached=True)
+                self._stats["stale_versions"] += 1
+            generation = self._generation
+
+        started = time.perf_counter()
+        value = self._compute(db)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        with self._lock:
+            self._stats["computations"] += 1
+            self._stats["last_compute_ms"] = elapsed_ms
+            # لا نخزن نتيجة حُسبت قبل invalidate حدث أثناء الحساب
+            if generation == self._generation:
+                self._value = value
+                self._value_version = version
+                self._computed_at = time.time()
+                self._expires_at = self._computed_at + self.ttl
+            return value, self._meta(cached=False, compute_ms=elapsed_ms)
+
+    def _meta(self, cached, compute_ms=None):
+        return {
+            "cached": cached,
+            "computed_in_ms": compute_ms if compute_ms is not None else self._stats["last_compute_ms"],
+            "computed_at": self._computed_at,
+        }
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
+            self._generation += 1
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+admin_kpis = KpiSnapshot()
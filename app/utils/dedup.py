@@ -0,0 +1,258 @@
+"""
+منع تكرار العملاء لكل مستخدم بمفاتيح موحدة بدلاً من البحث بـ company_name لكل عميل:
+- الهاتف بصيغة E.164 (+20...)
+- الدومين القابل للتسجيل (example.com.eg) ماعدا المنصات المشتركة (facebook.com ...)
+- اسم الشركة الموحد + الموقع الموحد
+
+كل مفتاح يُخزن كـ Hash في lead_keys بقيد فريد (user_id, key_hash)،
+فالتحقق من دفعة كاملة = استعلام واحد على فهرس.
+
+    python -m app.utils.dedup index              # بناء المفاتيح للعملاء القدامى
+    python -m app.utils.dedup collapse [--dry-run]  # دمج العملاء المكررين الموجودين بالفعل
+"""
+import re
+import sys
+import hashlib
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlsplit
+from sqlalchemy import select, insert, delete
+from app import models
+
+# نفس نمط الأرقام المصرية في GmapsEngine
+PHONE_RE = re.compile(r'(?:\+20|0)(?:1[0125]|2)\d{8}')
+NO_WEBSITE_MARKERS = ("غير", "google")
+NOT_AVAILABLE = "غير متوفر"
+
+# لاحقات من مستويين (الدومين القابل للتسجيل = جزء قبلها)
+MULTI_LEVEL_SUFFIXES = {
+    "com.eg", "org.eg", "net.eg", "gov.eg", "edu.eg", "sci.eg", "eun.eg",
+    "com.sa", "net.sa", "org.sa", "co.ae", "net.ae", "org.ae",
+    "co.uk", "org.uk", "com.au", "co.in", "com.tr",
+}
+# منصات يستخدمها آلاف الشركات كموقع: الدومين هنا لا يميز الشركة
+SHARED_HOSTS = {
+    "facebook.com", "fb.com", "instagram.com", "linkedin.com", "twitter.com", "x.com",
+    "tiktok.com", "youtube.com", "wa.me", "whatsapp.com", "linktr.ee", "business.site",
+    "google.com", "goo.gl", "blogspot.com", "wordpress.com", "wixsite.com", "t.me",
+}
+
+
+# --- 1. التوحيد ---
+def fold_name(name):
+    """توحيد اسم الشركة: حروف صغيرة، بدون تشكيل أو رموز، ومسافات موحدة"""
+    if not name:
+        return None
+    text = unicodedata.normalize("NFKD", name).casefold()
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[\W_]+", " ", text).strip()
+    return text or None
+
+
+def normalize_domain(url):
+    """https://www.Example.com/ar/contact -> example.com"""
+    if not url or any(marker in url for marker in NO_WEBSITE_MARKERS):
+        return None
+    if "://" not in url:
+        url = "http://" + url
+    try:
+        host = (urlsplit(url.strip()).hostname or "").lower().rstrip(".")
+    except ValueError:
+        return None
+    if host.startswith("www."):
+        host = host[4:]
+    return host or None
+
+
+def registrable_domain(url):
+    """shop.example.com.eg -> example.com.eg (None للمنصات المشتركة)"""
+    host = normalize_domain(url)
+    if not host or "." not in host:
+        return None
+    labels = host.split(".")
+    size = 3 if ".".join(labels[-2:]) in MULTI_LEVEL_SUFFIXES else 2
+    domain = ".".join(labels[-size:])
+    return None if domain in SHARED_HOSTS else domain
+
+
+def normalize_phones(phone):
+    """'010 1234 5678 | 0223456789' -> ['+201012345678', '+20223456789']"""
+    compact = re.sub(r"[\s\-()]", "", phone or "")
+    phones = []
+    for number in PHONE_RE.findall(compact):
+        e164 = "+20" + (number[3:] if number.startswith("+20") else number[1:])
+        if e164 not in phones:
+            phones.append(e164)
+    return phones
+
+
+def lead_keys(row: dict):
+    """[(kind, value)] لكل مفاتيح العميل"""
+    keys = [("phone", p) for p in normalize_phones(row.get("phone"))]
+    domain = registrable_domain(row.get("website"))
+    if domain:
+        keys.append(("domain", domain))
+    name = fold_name(row.get("company_name"))
+    if name:
+        # نفس الاسم في مدينة أخرى غالباً فرع مختلف
+        keys.append(("name", f"{name}@{fold_name(row.get('location')) or ''}"))
+    return keys
+
+
+def key_hash(kind, value):
+    return hashlib.sha1(f"{kind}:{value}".encode("utf-8")).hexdigest()
+
+
+def row_hashes(row: dict):
+    """[(kind, key_hash)]"""
+    return [(kind, key_hash(kind, value)) for kind, value in lead_keys(row)]
+
+
+# --- 2. دمج عميلين (الجديد يكمل الناقص فقط) ---
+MERGE_FIELDS = ("phone", "website", "email", "email_status", "confidence_score",
+                "decision_maker_name", "decision_maker_role", "linkedin_url", "industry", "location")
+# أعمدة البحث المفهرسة: القيمة الافتراضية تعمل عند INSERT فقط، لذلك نحدثها يدوياً عند الدمج
+NORM_COLUMNS = {"industry": "industry_norm", "location": "location_norm"}
+
+
+def _is_empty(value):
+    return value is None or value == "" or value == NOT_AVAILABLE
+
+
+def merge_values(existing: dict, incoming: dict):
+    """القيم التي يجب تحديثها في العميل الموجود"""
+    changes = {}
+    for field in MERGE_FIELDS:
+        new, old = incoming.get(field), existing.get(field)
+        if _is_empty(new):
+            continue
+        if _is_empty(old):
+            changes[field] = new
+    # إيميل مؤكد يتفوق على إيميل غير مؤكد
+    if incoming.get("email_status") == "Valid" and existing.get("email_status") != "Valid" and not _is_empty(incoming.get("email")):
+        changes.update(email=incoming["email"], email_status="Valid", confidence_score=incoming.get("confidence_score"))
+    return changes
+
+
+def apply_merge(lead, changes: dict):
+    """تطبيق نتيجة merge_values على كائن العميل مع أعمدة البحث الموحدة (industry_norm / location_norm)"""
+    for field, value in changes.items():
+        setattr(lead, field, value)
+        if field in NORM_COLUMNS:
+            setattr(lead, NORM_COLUMNS[field], value.strip().lower() if value else None)
+
+
+def lead_as_dict(lead):
+    return {c.name: getattr(lead, c.name) for c in models.Lead.__table__.columns}
+
+
+# --- 3. بناء المفاتيح للعملاء الموجودين (أول عميل يحجز المفتاح) ---
+def build_keys(conn, chunk_rows: int = 5000):
+    lead = models.Lead
+    taken = {(user_id, h) for user_id, h in conn.execute(select(models.LeadKey.user_id, models.LeadKey.key_hash))}
+    batch = []
+    count = 0
+    rows = conn.execute(select(lead.id, lead.user_id, lead.company_name, lead.location, lead.phone, lead.website)
+                        .order_by(lead.id.asc()).execution_options(yield_per=chunk_rows))
+    for lead_id, user_id, company_name, location, phone, website in rows:
+        row = dict(company_name=company_name, location=location, phone=phone, website=website)
+        for kind, value in lead_keys(row):
+            h = key_hash(kind, value)
+            if (user_id, h) in taken:
+                continue
+            taken.add((user_id, h))
+            batch.append(dict(user_id=user_id, key_hash=h, kind=kind, lead_id=lead_id))
+        if len(batch) >= chunk_rows:
+            conn.execute(insert(models.LeadKey), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.execute(insert(models.LeadKey), batch)
+        count += len(batch)
+    return count
+
+
+# --- 4. دمج المكرر الموجود بالفعل في جدول leads ---
+def collapse_duplicates(db, dry_run: bool = False):
+    """
+    لكل مستخدم: العملاء الذين يشتركون في أي مفتاح = مجموعة واحدة (Union-Find)،
+    يبقى الأقدم ويكمل بياناته من الباقي، ثم يُحذف الباقي وتُعاد الإحصائيات والمفاتيح.
+    """
+    from app.utils.lead_stats import refresh_user_stats
+
+    removed_total = 0
+    user_ids = [uid for (uid,) in db.query(models.Lead.user_id).distinct().all() if uid is not None]
+    for user_id in user_ids:
+        leads = db.query(models.Lead).filter(models.Lead.user_id == user_id).order_by(models.Lead.id.asc()).all()
+        parent = {lead.id: lead.id for lead in leads}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        owner_of_key = {}
+        for lead in leads:
+            for _, h in row_hashes(lead_as_dict(lead)):
+                if h in owner_of_key:
+                    a, b = find(owner_of_key[h]), find(lead.id)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)  # الأقدم (id أصغر) هو الأصل
+                else:
+                    owner_of_key[h] = lead.id
+
+        groups = defaultdict(list)
+        for lead in leads:
+            groups[find(lead.id)].append(lead)
+
+        duplicates = []
+        for root, members in groups.items():
+            if len(members) < 2:
+                continue
+            survivor = members[0]
+            for dup in members[1:]:
+                apply_merge(survivor, merge_values(lead_as_dict(survivor), lead_as_dict(dup)))
+                duplicates.append(dup.id)
+            survivor.updated_at = datetime.utcnow()
+
+        if not duplicates:
+            continue
+        removed_total += len(duplicates)
+        print(f"🧹 user {user_id}: {len(duplicates)} عميل مكرر")
+        if dry_run:
+            db.rollback()
+            continue
+
+        db.execute(delete(models.LeadKey).where(models.LeadKey.user_id == user_id))
+        db.query(models.Lead).filter(models.Lead.id.in_(duplicates)).delete(synchronize_session=False)
+        db.flush()
+        refresh_user_stats(db, user_id)
+        db.commit()
+
+    if not dry_run and removed_total:
+        # إعادة بناء المفاتيح بعد الدمج (المفاتيح المحذوفة أعلاه + أي مفتاح ناقص)
+        build_keys(db)
+        db.commit()
+    return removed_total
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal, engine
+    from app.migrations import run_migrations
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    command = sys.argv[1] if len(sys.argv) > 1 else "collapse"
+    db = SessionLocal()
+    try:
+        if command == "index":
+            print(f"✅ تم إنشاء {build_keys(db)} مفتاح")
+            db.commit()
+        else:
+            dry_run = "--dry-run" in sys.argv
+            removed = collapse_duplicates(db, dry_run=dry_run)
+            print(f"{'🔍 (تجربة فقط)' if dry_run else '✅'} {removed} عميل مكرر")
+    finally:
+        db.close()
@@ -0,0 +1,165 @@
+"""
+كاش الإثراء المشترك (Global): نفس الشركة يبحث عنها عملاء كثيرون ("real estate in Cairo")،
+فبدلاً من إعادة فتح موقعها والبحث في Bing لكل عميل نعيد آخر نتيجة ما دامت حديثة.
+
+المفتاح: الدومين القابل للتسجيل إن وُجد، وإلا اسم الشركة + الموقع بعد التوحيد
+(فروع / شركات بنفس الاسم في مدن مختلفة لا تتشارك نتيجة واحدة).
+نتائج الأخطاء والحظر (كابتشا) لا تُخزن أصلاً: انظر UNCACHEABLE_OUTCOMES.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app import models
+from app.database import SessionLocal
+from app.utils.dedup import fold_name, registrable_domain
+
+ENRICH_CACHE_TTL = int(os.environ.get("ENRICH_CACHE_TTL", 14 * 86400))          # نتيجة فيها إيميل
+ENRICH_CACHE_MISS_TTL = int(os.environ.get("ENRICH_CACHE_MISS_TTL", 2 * 86400))  # نتيجة بدون إيميل (قد يُضاف لاحقاً)
+ENRICH_CACHE_MAX_ROWS = int(os.environ.get("ENRICH_CACHE_MAX_ROWS", 100000))
+EVICT_EVERY = 200  # فحص الحجم كل N كتابة
+
+NO_EMAIL = "غير متوفر"
+# نتائج مؤقتة (خطأ / حظر) لا تعني "لا يوجد إيميل": لا نخزنها حتى لا تُعاد لكل العملاء
+UNCACHEABLE_OUTCOMES = ("error", "blocked")
+
+
+def cache_key(company_name, website, location=None):
+    # صفحات facebook.com وأمثالها لا تميز الشركة: نرجع للاسم + الموقع
+    domain = registrable_domain(website)
+    if domain:
+        return f"domain:{domain}"
+    name = fold_name(company_name)
+    if not name:
+        return None
+    return f"name:{name}@{fold_name(location)}"
+
+
+class EnrichmentCache:
+    def __init__(self, ttl=ENRICH_CACHE_TTL, miss_ttl=ENRICH_CACHE_MISS_TTL, max_rows=ENRICH_CACHE_MAX_ROWS):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "writes": 0, "evicted": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _is_fresh(self, entry, now):
+        ttl = self.ttl if entry.email and entry.email != NO_EMAIL else self.miss_ttl
+        return entry.fetched_at and entry.fetched_at >= now - timedelta(seconds=ttl)
+
+    def get(self, company_name, website, location=None):
+        """يعيد (extra_data, email_status, confidence) أو None"""
+        key = cache_key(company_name, website, location)
+        if key is None:
+            return None
+
+        db = SessionLocal()
+        try:
+            entry = db.get(models.EnrichmentCacheEntry, key)
+            now = datetime.utcnow()
+            if entry is None:
+                self._count("misses")
+                return None
+            if not self._is_fresh(entry, now):
+                self._count("stale")
+                return None
+
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_hit_at = now
+            result = (
+                {
+                    "email": entry.email or NO_EMAIL,
+                    "decision_maker_name": entry.decision_maker_name or "",
+                    "decision_maker_role": entry.decision_maker_role or "",
+                    "linkedin_url": entry.linkedin_url or ""
+                },
+                entry.email_status,
+                entry.confidence_score or 0.0
+            )
+            db.commit()
+            self._count("hits")
+            return result
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ [EnrichCache] تعذر القراءة: {e}")
+            return None
+        finally:
+            db.close()
+
+    def put(self, company_name, website, extra_data, email_status, confidence, location=None):
+        key = cache_key(company_name, website, location)
+        if key is None:
+            return
+
+        now = datetime.utcnow()
+        values = dict(
+            company_name=company_name,
+            website=website,
+            email=extra_data.get("email"),
+            email_status=email_status,
+            confidence_score=confidence,
+            decision_maker_name=extra_data.get("decision_maker_name"),
+            decision_maker_role=extra_data.get("decision_maker_role"),
+            linkedin_url=extra_data.get("linkedin_url"),
+            fetched_at=now,
+            last_hit_at=now
+        )
+        db = SessionLocal()
+        try:
+            entry = db.get(models.EnrichmentCacheEntry, key)
+            if entry is None:
+                db.add(models.EnrichmentCacheEntry(cache_key=key, hits=0, **values))
+            else:
+                for k, v in values.items():
+                    setattr(entry, k, v)
+            db.commit()
+            self._count("writes")
+        except IntegrityError:
+            # عامل آخر حفظ نفس الشركة في نفس اللحظة
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ [EnrichCache] تعذر الحفظ: {e}")
+        finally:
+            db.close()
+
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """حذف الأقدم استخداماً عند تجاوز الحد الأقصى للصفوف"""
+        db = SessionLocal()
+        try:
+            table = models.EnrichmentCacheEntry
+            total = db.query(func.count(table.cache_key)).scalar() or 0
+            excess = total - self.max_rows
+            if excess <= 0:
+                return 0
+            oldest = db.query(table.cache_key).order_by(table.last_hit_at.asc()).limit(excess).subquery()
+            removed = db.query(table).filter(table.cache_key.in_(db.query(oldest.c.cache_key))).delete(synchronize_session=False)
+            db.commit()
+            self._count("evicted", removed)
+            return removed
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ [EnrichCache] تعذر الحذف: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"] + self._stats["stale"]
+            return {**self._stats, "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0}
+
+
+enrichment_cache = EnrichmentCache()
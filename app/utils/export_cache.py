@@ -0,0 +1,116 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+# --- إعدادات كاش ملفات التصدير ---
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR", str(BASE_DIR / ".export_cache"))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+class ExportCache:
+    """
+    كاش ملفات التصدير الجاهزة على الهارد:
+    المفتاح = (المستخدم، الكلمة، الموقع، الصيغة، نسخة البيانات) ← أي عميل جديد يغير المفتاح تلقائياً.
+    الحذف بسياسة LRU عند تجاوز الحجم الأقصى (آخر استخدام = mtime).
+    get / commit يعيدان ملفاً مفتوحاً (وليس مساراً): الحذف أثناء الإرسال لا يقطع التحميل.
+    """
+    def __init__(self, directory=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0, "evicted": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(user_id, keyword, location, fmt, version):
+        raw = "|".join(str(part) for part in (user_id, keyword, location, fmt, *version))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:40]
+
+    def _path(self, key, fmt):
+        return self.directory / f"{key}.{fmt}"
+
+    def count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def get(self, key, fmt):
+        """يعيد ملفاً مفتوحاً (rb) أو None - المتصل مسؤول عن إغلاقه"""
+        path = self._path(key, fmt)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.count("misses")
+            return None
+        try:
+            os.utime(path, None)  # تحديث وقت الاستخدام (LRU)
+        except OSError:
+            pass
+        self.count("hits")
+        return f
+
+    def new_temp_path(self, fmt):
+        """ملف مؤقت داخل نفس المجلد (حتى يكون النقل النهائي os.replace ذرياً)"""
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}.part", dir=self.directory)
+        os.close(fd)
+        return path
+
+    def commit(self, temp_path, key, fmt):
+        """اعتماد الملف المؤقت وإعادته مفتوحاً (rb) - المتصل مسؤول عن إغلاقه"""
+        final_path = self._path(key, fmt)
+        with self._lock:
+            # النقل والفتح معاً تحت القفل: لا يستطيع evict آخر حذفه قبل فتحه
+            os.replace(temp_path, final_path)
+            f = open(final_path, "rb")
+        self.evict(keep=(str(final_path),))
+        return f
+
+    def discard(self, temp_path):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    def evict(self, keep=()):
+        """حذف الأقدم استخداماً حتى يعود الحجم تحت الحد الأقصى (عدا keep: الملف المعتمد للتو)"""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.endswith(".part"):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path in keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    self._stats["evicted"] += 1
+                except OSError:
+                    pass
+
+            # ملفات مؤقتة يتيمة (عملية توقفت أثناء الكتابة) أقدم من ساعة
+            cutoff = time.time() - 3600
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+export_cache = ExportCache()
@@ -0,0 +1,62 @@
+"""
+نقاط حفظ مهام البحث (Checkpoints): نتائج الخرائط + أرقام الشركات التي تم حفظها،
+تُكتب في search_jobs.checkpoint داخل نفس Transaction حفظ العملاء،
+فالعامل الذي يعيد تشغيل المهمة (بعد Crash / Deploy) يكمل من حيث توقف بدلاً من إعادة السحب.
+"""
+import json
+from datetime import datetime
+from app import models
+
+
+class JobCheckpoint:
+    """job_id=None = بدون حفظ (تشغيل مباشر خارج الطابور)"""
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.state = {}
+
+    def load(self, db):
+        if self.job_id is not None:
+            raw = db.query(models.SearchJob.checkpoint).filter(models.SearchJob.id == self.job_id).scalar()
+            self.state = json.loads(raw) if raw else {}
+        return self.state
+
+    @property
+    def items(self):
+        return self.state.get("items")
+
+    @property
+    def done(self):
+        return set(self.state.get("done", []))
+
+    @property
+    def delivered(self):
+        return self.state.get("delivered", 0)
+
+    def pending_items(self):
+        """الشركات التي لم تُحفظ بعد (كل شركة تحمل رقمها في الـ Checkpoint)"""
+        done = self.done
+        return [dict(item, index=i) for i, item in enumerate(self.items or []) if i not in done]
+
+    def start(self, db, items, **extra):
+        """حفظ نتائج الخرائط فور انتهائها (commit)"""
+        self.state = {"items": items, "done": [], "delivered": 0, **extra}
+        self._write(db)
+        db.commit()
+
+    def mark_saved(self, db, indices, saved):
+        """بدون commit: يُستدعى من LeadWriter داخل Transaction العملاء"""
+        # نبدأ من آخر حالة محفوظة فعلياً (لو فشل commit دفعة سابقة وأعاد LeadWriter الحفظ صفاً صفاً)
+        self.load(db)
+        self.state["done"] = sorted(self.done | {i for i in indices if i is not None})
+        self.state["delivered"] = self.delivered + saved
+        self._write(db)
+
+    def _write(self, db):
+        if self.job_id is None:
+            return
+        # locked_at = نبض (Heartbeat) حتى لا تُعتبر المهمة الطويلة عالقة
+        db.query(models.SearchJob).filter(models.SearchJob.id == self.job_id).update({
+            models.SearchJob.checkpoint: json.dumps(self.state, ensure_ascii=False),
+            models.SearchJob.delivered_count: self.delivered,
+            models.SearchJob.locked_at: datetime.utcnow()
+        }, synchronize_session=False)
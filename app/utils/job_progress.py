@@ -0,0 +1,146 @@
+"""
+تقدم مهام البحث: العامل يسجل الأحداث في search_job_events، والعميل يشترك مرة واحدة عبر SSE
+بدلاً من إعادة طلب /search/my-leads كل بضع ثواني.
+
+العامل قد يكون عملية منفصلة عن السيرفر، لذلك قاعدة البيانات هي المصدر،
+والـ Broker مجرد إيقاظ فوري للمشتركين في نفس العملية (وإلا يتم الفحص كل PROGRESS_POLL_SECONDS).
+"""
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+from app import models
+from app.database import SessionLocal
+from app.utils.pubsub import broker, format_sse
+
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", 1))  # ثواني بين كل حفظ للأحداث
+PROGRESS_POLL_SECONDS = float(os.environ.get("PROGRESS_POLL_SECONDS", 5))
+JOB_EVENTS_RETENTION = int(os.environ.get("JOB_EVENTS_RETENTION", 86400))  # ثواني بعد انتهاء المهمة
+TERMINAL_EVENTS = ("finished", "failed")
+# أحداث تُحفظ فوراً بدون انتظار الدفعة
+URGENT_EVENTS = ("started", "maps_results", "retrying") + TERMINAL_EVENTS
+
+
+def job_topic(job_id: int):
+    return f"job:{job_id}"
+
+
+def _event_row(job_id: int, kind: str, data: dict):
+    return models.SearchJobEvent(job_id=job_id, kind=kind, data=json.dumps(data, ensure_ascii=False, default=str))
+
+
+def add_event(db, job_id: int, kind: str, **data):
+    """
+    حدث داخل Transaction الجلسة نفسها (بدون commit): لحالة المهمة النهائية وحدثها معاً،
+    فلا يرى البث مهمة منتهية بدون حدثها الأخير. بعد الـ commit: notify(job_id)
+    """
+    db.add(_event_row(job_id, kind, data))
+
+
+def notify(job_id: int):
+    broker.publish(job_topic(job_id), {"wakeup": True})
+
+
+class JobProgress:
+    """
+    يجمع أحداث مهمة واحدة ويحفظها على دفعات بجلسة قاعدة بيانات مستقلة
+    (حتى لا يتداخل مع Transaction حفظ العملاء). job_id=None = بدون تسجيل.
+    """
+    def __init__(self, job_id=None, flush_interval=PROGRESS_FLUSH_INTERVAL):
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def emit(self, kind: str, **data):
+        if self.job_id is None:
+            return
+        self._pending.append(_event_row(self.job_id, kind, data))
+        if kind in URGENT_EVENTS or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        events, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if not events:
+            return
+        db = SessionLocal()
+        try:
+            db.add_all(events)
+            db.commit()
+        except Exception as e:
+            # التقدم معلومة إضافية: فشل تسجيله لا يوقف المهمة
+            db.rollback()
+            print(f"⚠️ [Progress] تعذر حفظ أحداث Job #{self.job_id}: {e}")
+            return
+        finally:
+            db.close()
+        notify(self.job_id)
+
+
+def events_since(db, job_id: int, after_id: int = 0):
+    return db.query(models.SearchJobEvent).filter(
+        models.SearchJobEvent.job_id == job_id,
+        models.SearchJobEvent.id > (after_id or 0)
+    ).order_by(models.SearchJobEvent.id.asc()).all()
+
+
+def _read_new(job_id, after_id):
+    db = SessionLocal()
+    try:
+        # الحالة قبل الأحداث: العامل يحفظ الحالة النهائية وحدثها معاً، فإن رأينا done / failed
+        # فحدثها الأخير موجود بالفعل في القراءة التالية
+        status = db.query(models.SearchJob.status, models.SearchJob.results_count, models.SearchJob.last_error)\
+            .filter(models.SearchJob.id == job_id).first()
+        events = [(e.id, e.kind, json.loads(e.data or "{}"), e.created_at) for e in events_since(db, job_id, after_id)]
+        return events, status
+    finally:
+        db.close()
+
+
+async def stream_job_events(job_id: int, after_id: int = 0):
+    """Generator لـ SSE: يرسل الأحداث الجديدة فقط وينتهي عند finished / failed"""
+    sub = broker.subscribe(job_topic(job_id))
+    try:
+        last_id = after_id or 0
+        yield "retry: 3000\n\n"
+        while True:
+            # قراءة قاعدة البيانات خارج الـ Event Loop: كل بث مفتوح لا يوقف باقي الطلبات
+            events, status = await run_in_threadpool(_read_new, job_id, last_id)
+            for event_id, kind, data, created_at in events:
+                last_id = event_id
+                yield format_sse({"kind": kind, "created_at": created_at, **data}, event=kind, event_id=event_id)
+                if kind in TERMINAL_EVENTS:
+                    return
+
+            # مهمة انتهت قبل وجود جدول الأحداث (أو حُذفت أحداثها بعد JOB_EVENTS_RETENTION)
+            if status is None or status.status in ("done", "failed"):
+                kind = "finished" if status and status.status == "done" else "failed"
+                yield format_sse({"kind": kind, "results_count": status.results_count if status else 0,
+                                  "error": status.last_error if status else "المهمة غير موجودة"}, event=kind)
+                return
+
+            if await sub.get(PROGRESS_POLL_SECONDS) is None:
+                yield ": ping\n\n"
+    finally:
+        sub.close()
+
+
+def prune_job_events(db, retention: int = JOB_EVENTS_RETENTION):
+    """
+    حذف أحداث المهام المنتهية منذ أكثر من retention ثانية (يستدعيها العامل دورياً).
+    البث المتأخر لمهمة منتهية يعتمد على حالة search_jobs وليس على الأحداث.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    finished = db.query(models.SearchJob.id).filter(
+        models.SearchJob.status.in_(("done", "failed")),
+        models.SearchJob.finished_at < cutoff
+    )
+    count = db.query(models.SearchJobEvent).filter(
+        models.SearchJobEvent.job_id.in_(finished.scalar_subquery())
+    ).delete(synchronize_session=False)
+    db.commit()
+    if count:
+        print(f"🧹 [Progress] تم حذف {count} حدث لمهام منتهية")
+    return count
@@ -0,0 +1,58 @@
+from sqlalchemy import text, func, Integer
+from app import models
+
+# هل جدول FTS5 موجود؟ (يتم فحصه مرة واحدة لكل قاعدة بيانات)
+_fts_available = {}
+
+
+def _has_fts(db):
+    bind = db.get_bind()
+    if bind.dialect.name != "sqlite":
+        return False
+    key = str(bind.url)
+    if key not in _fts_available:
+        found = db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'leads_fts'")).first()
+        _fts_available[key] = bool(found)
+    return _fts_available[key]
+
+
+def text_filter(db, column_name: str, term: str):
+    """
+    شرط "يحتوي على" (بديل ilike '%term%') يستفيد من الفهارس:
+    - SQLite: جدول FTS5 بـ tokenizer trigram (الكلمة 3 حروف أو أكثر)
+    - Postgres: فهرس pg_trgm على العمود المطبع (lowercase)
+    """
+    pattern = f"%{term.strip().lower()}%"
+    column = getattr(models.Lead, column_name)
+
+    if len(term.strip()) >= 3 and _has_fts(db):
+        return models.Lead.id.in_(_fts_rowids(column_name, pattern))
+    return column.like(pattern)
+
+
+def _fts_rowids(column_name: str, pattern: str):
+    return text(f"SELECT rowid FROM leads_fts WHERE leads_fts.{column_name} LIKE :pattern").bindparams(pattern=pattern)
+
+
+def apply_lead_filters(query, db, keyword: str = None, location: str = None):
+    """فلاتر الكلمة والموقع المستخدمة في التصدير (All = بدون فلتر)"""
+    if keyword and keyword != "All":
+        query = query.filter(text_filter(db, "industry_norm", keyword))
+
+    if location and location != "All":
+        query = query.filter(text_filter(db, "location_norm", location))
+
+    return query
+
+
+def industry_stats_query(db, term: str):
+    """عدد الشركات لكل مجال يحتوي على الكلمة (نظام الاقتراحات)"""
+    query = db.query(models.Lead.industry, func.count(models.Lead.id))
+    if len(term.strip()) >= 3 and _has_fts(db):
+        # نبدأ من نتائج FTS ثم نجلب كل صف بالـ id: مع GROUP BY قد يختار SQLite مسح leads كاملاً
+        # لو استخدمنا id IN (...)، والـ LEFT JOIN يمنعه من قلب ترتيب الـ Join
+        matches = _fts_rowids("industry_norm", f"%{term.strip().lower()}%").columns(rowid=Integer).subquery("matches")
+        query = query.select_from(matches).outerjoin(models.Lead, models.Lead.id == matches.c.rowid)
+    else:
+        query = query.filter(text_filter(db, "industry_norm", term))
+    return query.group_by(models.Lead.industry)
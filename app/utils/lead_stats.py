@@ -0,0 +1,128 @@
+"""
+إحصائيات العملاء المجمعة لكل مستخدم (user_lead_stats):
+تتحدث تلقائياً مع كل دفعة عملاء جديدة، فيصبح /ai/dashboard-stats قراءة صف واحد فقط.
+
+    python -m app.utils.lead_stats backfill      # حساب كل المستخدمين من الصفر
+    python -m app.utils.lead_stats check [--fix] # مقارنة المخزن بالحساب الكامل
+"""
+import sys
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import func, case, and_
+from sqlalchemy.exc import IntegrityError
+from app import models
+
+COUNTERS = ("total", "valid_emails", "mobile_phones", "decision_makers")
+
+
+# --- 1. نفس قواعد الداشبورد، لصف واحد ---
+def classify(row: dict):
+    return {
+        "total": 1,
+        "valid_emails": 1 if row.get("email_status") == "Valid" else 0,
+        # الأرقام التي تحتوي على 01 (موبايل مصري) كدليل على جودة الداتا للواتساب
+        "mobile_phones": 1 if "01" in str(row.get("phone")) else 0,
+        "decision_makers": 1 if row.get("decision_maker_name") else 0,
+    }
+
+
+def _upsert_deltas(db, user_id, deltas):
+    table = models.UserLeadStats
+    values = {getattr(table, k): getattr(table, k) + v for k, v in deltas.items()}
+    values[table.updated_at] = datetime.utcnow()
+
+    updated = db.query(table).filter(table.user_id == user_id).update(values, synchronize_session=False)
+    if updated:
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(models.UserLeadStats(user_id=user_id, **deltas))
+    except IntegrityError:
+        # عامل آخر أنشأ الصف في نفس اللحظة
+        db.query(table).filter(table.user_id == user_id).update(values, synchronize_session=False)
+
+
+def apply_lead_rows(db, rows, sign: int = 1):
+    """
+    تحديث العدادات لمجموعة صفوف (sign=-1 عند الحذف).
+    لا يعمل commit: يتم الحفظ مع نفس Transaction الخاصة بإضافة العملاء.
+    """
+    per_user = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for row in rows:
+        counters = per_user[row["user_id"]]
+        for k, v in classify(row).items():
+            counters[k] += v * sign
+
+    for user_id, deltas in per_user.items():
+        _upsert_deltas(db, user_id, deltas)
+
+
+# --- 2. الحساب الكامل من الصفر (للـ Backfill والتحقق) ---
+def compute_from_leads(db, user_id):
+    lead = models.Lead
+    total, valid, mobile, dm = db.query(
+        func.count(lead.id),
+        func.sum(case((lead.email_status == "Valid", 1), else_=0)),
+        func.sum(case((lead.phone.like("%01%"), 1), else_=0)),
+        func.sum(case((and_(lead.decision_maker_name.isnot(None), lead.decision_maker_name != ""), 1), else_=0)),
+    ).filter(lead.user_id == user_id).one()
+    return {"total": total or 0, "valid_emails": valid or 0, "mobile_phones": mobile or 0, "decision_makers": dm or 0}
+
+
+def refresh_user_stats(db, user_id):
+    """إعادة حساب صف مستخدم واحد وحفظه (بدون commit)"""
+    values = compute_from_leads(db, user_id)
+    stats = db.get(models.UserLeadStats, user_id)
+    if stats is None:
+        stats = models.UserLeadStats(user_id=user_id)
+        db.add(stats)
+    for k, v in values.items():
+        setattr(stats, k, v)
+    stats.updated_at = datetime.utcnow()
+    return stats
+
+
+def backfill_all(db):
+    user_ids = [uid for (uid,) in db.query(models.User.id).all()]
+    for user_id in user_ids:
+        refresh_user_stats(db, user_id)
+        db.commit()
+    return len(user_ids)
+
+
+def check_consistency(db, fix: bool = False):
+    """يعيد قائمة المستخدمين الذين لا تتطابق عداداتهم مع الحساب الكامل"""
+    mismatches = []
+    for (user_id,) in db.query(models.User.id).all():
+        expected = compute_from_leads(db, user_id)
+        stats = db.get(models.UserLeadStats, user_id)
+        stored = {k: getattr(stats, k) for k in COUNTERS} if stats else dict.fromkeys(COUNTERS, 0)
+        if stored != expected:
+            mismatches.append({"user_id": user_id, "stored": stored, "expected": expected})
+            if fix:
+                refresh_user_stats(db, user_id)
+    if fix:
+        db.commit()
+    return mismatches
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal, engine
+    from app.migrations import run_migrations
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    db = SessionLocal()
+    try:
+        if command == "backfill":
+            print(f"✅ تم حساب إحصائيات {backfill_all(db)} مستخدم")
+        else:
+            mismatches = check_consistency(db, fix="--fix" in sys.argv)
+            for m in mismatches:
+                print(f"❌ user {m['user_id']}: stored={m['stored']} expected={m['expected']}")
+            print("✅ كل الإحصائيات متطابقة" if not mismatches else f"⚠️ {len(mismatches)} مستخدم غير متطابق")
+            sys.exit(1 if mismatches and "--fix" not in sys.argv else 0)
+    finally:
+        db.close()
@@ -0,0 +1,172 @@
+import os
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from app import models
+from app.utils.lead_stats import apply_lead_rows
+from app.utils.dedup import row_hashes, merge_values, apply_merge, lead_as_dict
+from app.utils.metrics import metrics
+
+# --- إعدادات الكتابة المجمعة ---
+LEAD_BATCH_SIZE = int(os.environ.get("LEAD_BATCH_SIZE", 25))           # حفظ كل N عميل مرة واحدة
+LEAD_FLUSH_INTERVAL = float(os.environ.get("LEAD_FLUSH_INTERVAL", 2))  # أو كل N ثانية (ليظهر التقدم في الداشبورد)
+
+
+class LeadWriter:
+    """
+    كاتب العملاء المجمع (Buffered Writer):
+    بدلاً من commit لكل عميل، يتم تجميع الصفوف وحفظها بـ INSERT واحد متعدد القيم.
+    العميل المكرر (نفس الهاتف / الدومين / الاسم) يُدمج في الموجود بدلاً من صف جديد.
+    الحفظ يتم عند امتلاء الدفعة أو مرور وقت محدد، وعند الإغلاق.
+    """
+    def __init__(self, db, batch_size=LEAD_BATCH_SIZE, flush_interval=LEAD_FLUSH_INTERVAL, on_flush=None, on_saved=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush  # callback(saved, written) بعد كل دفعة محفوظة
+        self.on_saved = on_saved  # callback(tags, saved) داخل نفس الـ Transaction قبل الـ commit (Checkpoint)
+        self.written = 0
+        self.merged = 0   # صفوف مكررة تم دمجها في عميل موجود بدلاً من إضافتها
+        self._rows = []
+        self._tags = []
+        self._last_flush = time.monotonic()
+
+    def add(self, row: dict, tag=None):
+        self._rows.append(row)
+        self._tags.append(tag)
+        if len(self._rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        يعيد عدد العملاء الجدد الذين تم حفظهم (وهو ما يُحسب على رصيد المستخدم).
+        الصفوف المدمجة في عملاء يملكهم المستخدم بالفعل لا تُحسب (تظهر في self.merged).
+        """
+        rows, self._rows = self._rows, []
+        tags, self._tags = self._tags, []
+        self._last_flush = time.monotonic()
+        if not rows:
+            return 0
+
+        merged_before = self.merged
+        with metrics.span("db_write") as span:
+            try:
+                saved = self._save(rows)
+                if self.on_saved:
+                    self.on_saved(tags, saved)
+                self.db.commit()
+            except Exception as e:
+                # الدفعة فشلت: نحفظ صفاً صفاً حتى لا يضيع الباقي بسبب عميل واحد
+                print(f"⚠️ [LeadWriter] فشل الحفظ المجمع ({e}). إعادة المحاولة صفاً صفاً...")
+                span.outcome = "per_row"
+                self.db.rollback()
+                self.merged = merged_before  # الدمج الذي تم في الدفعة الفاشلة أُلغي مع الـ rollback
+                saved = 0
+                for row, tag in zip(rows, tags):
+                    try:
+                        row_saved = self._save([row])
+                        if self.on_saved:
+                            self.on_saved([tag], row_saved)
+                        self.db.commit()
+                        saved += row_saved
+                    except Exception as row_error:
+                        self.db.rollback()
+                        print(f"⚠️ [DB] فشل حفظ {row.get('company_name')}: {row_error}")
+
+        metrics.inc("leads_saved_total", saved)
+        metrics.inc("leads_merged_total", self.merged - merged_before)
+        self.written += saved
+        if self.on_flush:
+            self.on_flush(saved, self.written)
+        return saved
+
+    def _save(self, rows):
+        """
+        Upsert بمفاتيح منع التكرار (بدون commit):
+        استعلام واحد على lead_keys للدفعة كلها، العميل الموجود يُكمل بياناته، والجديد يُضاف بـ INSERT واحد.
+        """
+        hashes = [row_hashes(row) for row in rows]
+        known = {}
+        wanted = {h for row_keys in hashes for _, h in row_keys}
+        if wanted:
+            user_ids = {row["user_id"] for row in rows}
+            for user_id, h, lead_id in self.db.query(models.LeadKey.user_id, models.LeadKey.key_hash, models.LeadKey.lead_id)\
+                    .filter(models.LeadKey.user_id.in_(user_ids), models.LeadKey.key_hash.in_(wanted)):
+                known[(user_id, h)] = lead_id
+
+        new_rows = []        # [(row, keys)]
+        pending = {}         # مفتاح -> index في new_rows (تكرار داخل نفس الدفعة)
+        updates = {}         # lead_id -> [(row, keys)]
+        for row, row_keys in zip(rows, hashes):
+            user_id = row["user_id"]
+            lead_id = next((known[(user_id, h)] for _, h in row_keys if (user_id, h) in known), None)
+            if lead_id is not None:
+                updates.setdefault(lead_id, []).append((row, row_keys))
+                continue
+
+            index = next((pending[(user_id, h)] for _, h in row_keys if (user_id, h) in pending), None)
+            if index is None:
+                new_rows.append((dict(row), []))
+                index = len(new_rows) - 1
+            else:
+                target = new_rows[index][0]
+                target.update(merge_values(target, row))
+                self.merged += 1
+            for kind, h in row_keys:
+                if (user_id, h) not in pending:
+                    pending[(user_id, h)] = index
+                    new_rows[index][1].append((kind, h))
+
+        key_rows = []
+
+        # أ) دمج البيانات الجديدة في العملاء الموجودين
+        if updates:
+            for lead in self.db.query(models.Lead).filter(models.Lead.id.in_(list(updates))).all():
+                before = lead_as_dict(lead)
+                for row, row_keys in updates[lead.id]:
+                    apply_merge(lead, merge_values(lead_as_dict(lead), row))
+                    for kind, h in row_keys:
+                        if (lead.user_id, h) not in known:
+                            known[(lead.user_id, h)] = lead.id
+                            key_rows.append(dict(user_id=lead.user_id, key_hash=h, kind=kind, lead_id=lead.id))
+                after = lead_as_dict(lead)
+                if after != before:
+                    lead.updated_at = datetime.utcnow()
+                    # تصحيح إحصائيات الداشبورد بفرق الدمج
+                    apply_lead_rows(self.db, [before], sign=-1)
+                    apply_lead_rows(self.db, [after])
+            self.merged += sum(len(v) for v in updates.values())
+
+        # ب) العملاء الجدد
+        if new_rows:
+            values = [row for row, _ in new_rows]
+            if len(values) == 1:
+                lead_ids = [self.db.execute(insert(models.Lead).values(**values[0])).inserted_primary_key[0]]
+            else:
+                lead_ids = self.db.execute(
+                    insert(models.Lead).returning(models.Lead.id, sort_by_parameter_order=True), values
+                ).scalars().all()
+            apply_lead_rows(self.db, values)  # تحديث إحصائيات الداشبورد في نفس الـ Transaction
+            for (row, row_keys), lead_id in zip(new_rows, lead_ids):
+                key_rows.extend(dict(user_id=row["user_id"], key_hash=h, kind=kind, lead_id=lead_id) for kind, h in row_keys)
+
+        if key_rows:
+            self.db.execute(insert(models.LeadKey), key_rows)
+        # المستخدم يملك العملاء المدمجين بالفعل: لا يُحسبون كعملاء مُسلّمين (ولا يُخصم رصيدهم مرة أخرى)
+        return len(new_rows)
+
+    def close(self):
+        return self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # حتى عند حدوث خطأ نحاول حفظ ما تم إثراؤه بالفعل
+        try:
+            self.close()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            print(f"⚠️ [LeadWriter] تعذر حفظ الدفعة الأخيرة: {e}")
+        return False
@@ -0,0 +1,174 @@
+"""
+كاش نتائج بحث خرائط جوجل على الهارد (مشترك بين العمليات والعمال):
+نفس البحث (بعد توحيد الكلمة والموقع) خلال MAPS_CACHE_TTL لا يفتح متصفحاً من جديد،
+وبحثان متطابقان في نفس اللحظة يشتركان في عملية سحب واحدة (Coalescing).
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+from app.utils.dedup import fold_name
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+MAPS_CACHE_DIR = os.environ.get("MAPS_CACHE_DIR", str(BASE_DIR / ".maps_cache"))
+MAPS_CACHE_TTL = int(os.environ.get("MAPS_CACHE_TTL", 6 * 3600))
+MAPS_CACHE_MAX_BYTES = int(os.environ.get("MAPS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+class MapsQueryCache:
+    def __init__(self, directory=MAPS_CACHE_DIR, ttl=MAPS_CACHE_TTL, max_bytes=MAPS_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "writes": 0, "evicted": 0, "partial": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(keyword, location):
+        raw = f"{fold_name(keyword) or ''}|{fold_name(location) or ''}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:40]
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _read(self, key, max_leads):
+        """
+        النتيجة صالحة إذا كانت حديثة، وتغطي العدد المطلوب
+        (أو أن السحب السابق استنفد كل نتائج الخريطة أصلاً).
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("fetched_at", 0) > self.ttl:
+            return None
+        results = entry.get("results", [])
+        exhausted = len(results) < entry.get("max_leads", 0)
+        if len(results) < max_leads and not exhausted:
+            return None
+        try:
+            os.utime(path, None)  # LRU
+        except OSError:
+            pass
+        return results[:max_leads]
+
+    def _write(self, key, keyword, location, max_leads, results):
+        entry = {"keyword": keyword, "location": location, "max_leads": max_leads,
+                 "fetched_at": time.time(), "results": results}
+        fd, temp_path = tempfile.mkstemp(suffix=".json.part", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, self._path(key))
+            self._count("writes")
+        except OSError as e:
+            print(f"⚠️ [MapsCache] تعذر الحفظ: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        self.evict()
+
+    def get_or_scrape(self, keyword, location, max_leads, scrape):
+        """
+        scrape(keyword, location, max_leads) -> (results, complete) يُستدعى فقط عند عدم وجود نتيجة صالحة.
+        complete=False (كابتشا / خطأ في منتصف السحب): النتائج الجزئية تُعاد للطالب لكن لا تُخزن،
+        حتى لا تُعتبر قائمة مقطوعة "كل نتائج الخريطة" لباقي العملاء طوال الـ TTL.
+        """
+        key = self.make_key(keyword, location)
+        while True:
+            cached = self._read(key, max_leads)
+            if cached is not None:
+                self._count("hits")
+                return [dict(item) for item in cached]
+
+            with self._lock:
+                inflight = self._inflight.get(key)
+                leader = inflight is None
+                if leader:
+                    future = Future()
+                    self._inflight[key] = (future, max_leads)
+                else:
+                    future, inflight_max = inflight
+
+            if leader:
+                break
+            # نفس البحث يعمل الآن: ننتظره بدلاً من فتح متصفح ثاني
+            self._count("coalesced")
+            try:
+                results, complete = future.result()
+            except Exception:
+                results, complete = None, False
+            if results is not None and (not complete or inflight_max >= max_leads or len(results) < inflight_max):
+                # سحب غير مكتمل (حظر): نأخذ نفس النتيجة الجزئية بدلاً من ضرب جوجل مرة أخرى الآن
+                return [dict(item) for item in results[:max_leads]]
+            # السحب الجاري أصغر من المطلوب أو فشل: نعيد المحاولة (قد نصبح نحن المنفذ)
+
+        self._count("misses")
+        try:
+            results, complete = scrape(keyword, location, max_leads)
+            if results and complete:
+                # نتيجة فارغة أو جزئية غالباً خطأ / كابتشا: لا تُحفظ
+                self._write(key, keyword, location, max_leads, results)
+            else:
+                self._count("partial")
+            future.set_result((results, complete))
+            return results
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def evict(self):
+        """حذف الأقدم استخداماً حتى يعود الحجم تحت الحد الأقصى"""
+        with self._lock:
+            entries = []
+            total = 0
+            orphan_cutoff = time.time() - 3600
+            for entry in os.scandir(self.directory):
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                if entry.name.endswith(".part"):
+                    # ملف مؤقت يتيم (عملية توقفت أثناء الكتابة)
+                    if st.st_mtime < orphan_cutoff:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self._stats["evicted"] += 1
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "inflight": len(self._inflight)}
+
+
+maps_cache = MapsQueryCache()
@@ -0,0 +1,241 @@
+"""
+قياسات خط السحب (Pipeline Metrics): مدة كل مرحلة (متصفح / خرائط / Bing / الموقع / DNS / قاعدة البيانات)
+مع نتيجتها، مجمعة في Histograms وعدادات، وتُعرض بصيغة Prometheus على /metrics.
+
+    with metrics.span("maps_scroll") as span:
+        ...
+        span.outcome = "blocked"     # الافتراضي ok، والاستثناء = error
+
+داخل مهمة بحث (track_job) تُجمع نفس المراحل في تفصيل زمني للمهمة يُحفظ مع سجل البحث.
+القياسات لكل عملية (Process): مراحل السحب تحدث في العامل المنفصل، لذلك يعرضها على منفذه الخاص
+(WORKER_METRICS_PORT، افتراضياً 9102، ومعه /engine-stats)، و/metrics في السيرفر يعرض مراحل عملية الويب فقط.
+الوصول داخلي فقط: METRICS_TOKEN (Bearer) إن وُجد، وإلا طلبات مباشرة من شبكة خاصة / localhost.
+"""
+import os
+import hmac
+import json
+import time
+import threading
+import ipaddress
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# حدود الـ Histogram بالثواني (من استعلام DB سريع حتى سحب خرائط كامل)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS_PREFIX = os.environ.get("METRICS_PREFIX", "leadgen")
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+_current_job = contextvars.ContextVar("job_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class Span:
+    def __init__(self, stage):
+        self.stage = stage
+        self.outcome = "ok"
+        self.seconds = 0.0
+
+
+class JobTimings:
+    """تفصيل زمني لمهمة واحدة: لكل مرحلة عدد المرات، المجموع، الأطول، والأخطاء"""
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, stage, seconds, outcome):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "outcomes": {}})
+            ms = seconds * 1000
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["outcomes"][outcome] = entry["outcomes"].get(outcome, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            stages = {
+                stage: dict(entry, total_ms=round(entry["total_ms"], 1), max_ms=round(entry["max_ms"], 1), outcomes=dict(entry["outcomes"]))
+                for stage, entry in self._stages.items()
+            }
+        return {"wall_ms": round((time.perf_counter() - self._started) * 1000, 1), "stages": stages}
+
+
+class Metrics:
+    """
+    سجل قياسات بسيط وآمن بين الـ Threads (بدون مكتبة خارجية):
+    counters: (name, labels) -> قيمة
+    histograms: (name, labels) -> [عدد كل bucket..., المجموع، العدد]
+    """
+    def __init__(self, prefix=METRICS_PREFIX, buckets=STAGE_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """قياس مرحلة: المدة + النتيجة (outcome)، وتسجيلها في تفصيل المهمة الحالية إن وجدت"""
+        span = Span(stage)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            if span.outcome == "ok":
+                span.outcome = "error"
+            raise
+        finally:
+            span.seconds = time.perf_counter() - started
+            self.observe("stage_duration_seconds", span.seconds, stage=stage, outcome=span.outcome, **labels)
+            self.inc("stage_total", stage=stage, outcome=span.outcome, **labels)
+            timings = _current_job.get()
+            if timings is not None:
+                timings.add(stage, span.seconds, span.outcome)
+
+    def render(self):
+        """النص بصيغة Prometheus (exposition format 0.0.4)"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(hist)) for key, hist in self._histograms.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                typed.add(full)
+                lines.append(f"# TYPE {full} counter")
+            lines.append(f"{full}{_labels(labels)} {value}")
+
+        for (name, labels), hist in histograms:
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                typed.add(full)
+                lines.append(f"# TYPE {full} histogram")
+            for bound, count in zip(self.buckets, hist):
+                lines.append(f"{full}_bucket{_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{full}_bucket{_labels(labels, [('le', '+Inf')])} {hist[-1]}")
+            lines.append(f"{full}_sum{_labels(labels)} {round(hist[-2], 6)}")
+            lines.append(f"{full}_count{_labels(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def stats(self):
+        """ملخص مختصر لكل مرحلة (لـ engine-stats)"""
+        summary = {}
+        with self._lock:
+            for (name, labels), hist in self._histograms.items():
+                if name != "stage_duration_seconds":
+                    continue
+                stage = dict(labels)["stage"]
+                entry = summary.setdefault(stage, {"count": 0, "total_seconds": 0.0})
+                entry["count"] += hist[-1]
+                entry["total_seconds"] += hist[-2]
+        for entry in summary.values():
+            entry["avg_ms"] = round(entry["total_seconds"] * 1000 / entry["count"], 1) if entry["count"] else 0.0
+            entry["total_seconds"] = round(entry["total_seconds"], 3)
+        return summary
+
+
+@contextmanager
+def track_job():
+    """تجميع كل المراحل التي تحدث داخل هذه الكتلة (وداخل الـ Threads المنسوخ لها الـ Context) لمهمة واحدة"""
+    timings = JobTimings()
+    token = _current_job.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_job.reset(token)
+
+
+def in_context(fn):
+    """لتمرير تفصيل المهمة لعمال ThreadPoolExecutor: executor.map(in_context(fn), ...)"""
+    context = contextvars.copy_context()
+    # نسخة لكل استدعاء: نفس الـ Context لا يمكن دخوله من أكثر من Thread في نفس الوقت
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def metrics_access_allowed(client_host, authorization=None, forwarded_for=None):
+    """
+    /metrics داخلي فقط:
+    - METRICS_TOKEN موجود: يجب إرسال Authorization: Bearer <token>
+    - وإلا: الطلب المباشر (بدون X-Forwarded-For من Proxy عام) من localhost أو شبكة خاصة
+    """
+    if METRICS_TOKEN:
+        return hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}")
+    if forwarded_for:
+        return False
+    try:
+        address = ipaddress.ip_address(client_host or "")
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+def start_metrics_server(port, host="0.0.0.0", registry=None, json_routes=None):
+    """
+    سيرفر /metrics صغير للعمليات التي لا تشغل FastAPI (عامل المهام).
+    json_routes: مسارات إضافية بنفس شروط الوصول، مثل {"/engine-stats": engine_stats}
+    """
+    registry = registry or metrics
+    json_routes = json_routes or {}
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path != "/metrics" and path not in json_routes:
+                self.send_error(404)
+                return
+            if not metrics_access_allowed(self.client_address[0], self.headers.get("Authorization"),
+                                          self.headers.get("X-Forwarded-For")):
+                self.send_error(403)
+                return
+            if path == "/metrics":
+                body, content_type = registry.render().encode(), PROMETHEUS_CONTENT_TYPE
+            else:
+                body, content_type = json.dumps(json_routes[path](), ensure_ascii=False, default=str).encode(), "application/json"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 [Metrics] {', '.join(['/metrics', *json_routes])} على {host}:{port}")
+    return server
+
+
+metrics = Metrics()
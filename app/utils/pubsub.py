@@ -0,0 +1,112 @@
+"""
+توزيع الأحداث داخل نفس العملية (Pub/Sub) للمشتركين المتصلين عبر SSE:
+كل مشترك له Queue خاصة على الـ Event Loop الخاص به، والنشر آمن من أي Thread
+(Endpoints متزامنة / عامل المهام).
+
+المشترك البطيء لا يوقف الباقين: عند امتلاء الـ Queue يتم فصله ليعيد الاتصال ويكمل بـ since_id.
+"""
+import os
+import json
+import asyncio
+import threading
+from fastapi.responses import StreamingResponse
+
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("PUBSUB_QUEUE_SIZE", 200))
+
+# حدث خاص يعني "تم فصلك، أعد الاتصال"
+OVERFLOW = object()
+
+
+class Subscription:
+    def __init__(self, broker, topic, loop):
+        self.broker = broker
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def _deliver(self, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.closed = True
+            self.broker._count("dropped_subscribers")
+            # نفرغ مكان واحد لإيصال إشارة الفصل
+            self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    async def get(self, timeout: float):
+        """ينتظر الحدث التالي، أو يعيد None عند انتهاء المهلة (لإرسال Heartbeat)"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.closed = True
+        self.broker._unsubscribe(self)
+
+
+class PubSub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._stats = {"published": 0, "delivered": 0, "dropped_subscribers": 0}
+
+    def subscribe(self, topic: str):
+        """يُستدعى من داخل async endpoint"""
+        sub = Subscription(self, topic, asyncio.get_running_loop())
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subs = self._topics.get(sub.topic)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._topics[sub.topic]
+
+    def publish(self, topic: str, event: dict):
+        with self._lock:
+            subs = list(self._topics.get(topic, ()))
+            self._stats["published"] += 1
+            self._stats["delivered"] += len(subs)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, event)
+            except RuntimeError:
+                # الـ Event Loop الخاص بالمشترك أُغلق
+                self._unsubscribe(sub)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "topics": len(self._topics), "subscribers": sum(len(s) for s in self._topics.values())}
+
+
+broker = PubSub()
+
+
+def format_sse(data: dict, event: str = None, event_id=None):
+    """تحويل حدث لصيغة Server-Sent Events"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(generator):
+    return StreamingResponse(generator, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # منع Nginx من تجميع الأحداث
+    })
@@ -0,0 +1,35 @@
+"""
+عداد استعلامات SQL لفحص مشاكل N+1:
+
+    with count_queries(engine) as counter:
+        ...
+    print(counter.count, counter.statements)
+"""
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """يعد الاستعلامات المنفذة على Engine معين من نفس الـ Thread فقط"""
+    def __init__(self):
+        self.statements = []
+        self._thread_id = threading.get_ident()
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread_id:
+            self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter._on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._on_execute)
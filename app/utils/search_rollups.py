@@ -0,0 +1,139 @@
+"""
+تجميع سجل البحث في جداول زمنية (ساعة / يوم) يتم تحديثها مع كل بحث جديد،
+حتى تعمل تحليلات الأدمن على آلاف الصفوف بدلاً من ملايين صفوف search_history.
+
+    python -m app.utils.search_rollups backfill
+"""
+import json
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import select, func, insert, delete
+from sqlalchemy.exc import IntegrityError
+from app import models
+
+GRANULARITIES = ("hour", "day")
+GROUP_BY_COLUMNS = {
+    "keyword": models.SearchRollup.keyword,
+    "location": models.SearchRollup.location,
+    "user_id": models.SearchRollup.user_id,
+    "time": models.SearchRollup.bucket_start,
+}
+
+
+def bucket_start(when: datetime, granularity: str):
+    if granularity == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bump(db, granularity, start, user_id, keyword, location, results_count):
+    rollup = models.SearchRollup
+    filters = (
+        rollup.granularity == granularity,
+        rollup.bucket_start == start,
+        rollup.user_id == user_id,
+        rollup.keyword == keyword,
+        rollup.location == location,
+    )
+    values = {
+        rollup.searches: rollup.searches + 1,
+        rollup.results_count: rollup.results_count + results_count,
+    }
+    if db.query(rollup).filter(*filters).update(values, synchronize_session=False):
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(models.SearchRollup(
+                granularity=granularity, bucket_start=start, user_id=user_id,
+                keyword=keyword, location=location, searches=1, results_count=results_count
+            ))
+    except IntegrityError:
+        db.query(rollup).filter(*filters).update(values, synchronize_session=False)
+
+
+def record_search(db, user_id: int, keyword: str, location: str, results_count: int, when: datetime = None, timings: dict = None):
+    """
+    تسجيل بحث في search_history وتحديث الـ Rollups في نفس الـ Transaction (بدون commit).
+    timings: تفصيل المهمة الزمني (JobTimings.as_dict) إن وجد.
+    """
+    when = when or datetime.utcnow()
+    history = models.SearchHistory(
+        user_id=user_id,
+        keyword=keyword,
+        location=location,
+        results_count=results_count,
+        search_date=when,
+        timings=json.dumps(timings) if timings else None
+    )
+    db.add(history)
+    for granularity in GRANULARITIES:
+        _bump(db, granularity, bucket_start(when, granularity), user_id, keyword or "", location or "", results_count or 0)
+    return history
+
+
+def query_rollups(db, start: datetime, end: datetime, granularity: str = "day", group_by: str = "keyword", limit: int = 20):
+    """
+    تحليل فترة زمنية من الـ Rollups:
+    group_by = keyword / location / user_id (الأعلى أولاً) أو time (سلسلة زمنية للرسم البياني)
+    """
+    rollup = models.SearchRollup
+    column = GROUP_BY_COLUMNS[group_by]
+    searches = func.sum(rollup.searches).label("searches")
+    results = func.sum(rollup.results_count).label("results_count")
+
+    query = db.query(column.label("name"), searches, results).filter(
+        rollup.granularity == granularity,
+        rollup.bucket_start >= bucket_start(start, granularity),
+        rollup.bucket_start < end
+    ).group_by(column)
+
+    if group_by == "time":
+        query = query.order_by(column.asc())
+    else:
+        query = query.order_by(searches.desc()).limit(limit)
+
+    return [{"name": r.name, "searches": r.searches or 0, "results_count": r.results_count or 0} for r in query.all()]
+
+
+def backfill(conn, chunk_rows: int = 10000):
+    """إعادة بناء الـ Rollups بالكامل من search_history (يعمل مع Session أو Connection)"""
+    history = models.SearchHistory
+    totals = defaultdict(lambda: [0, 0])
+    rows = conn.execute(select(history.user_id, history.keyword, history.location, history.results_count, history.search_date)
+                        .execution_options(yield_per=chunk_rows))
+    for user_id, keyword, location, results_count, search_date in rows:
+        when = search_date or datetime.utcnow()
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(when, granularity), user_id, keyword or "", location or "")
+            totals[key][0] += 1
+            totals[key][1] += results_count or 0
+
+    conn.execute(delete(models.SearchRollup))
+    batch = []
+    for (granularity, start, user_id, keyword, location), (searches, results_count) in totals.items():
+        batch.append(dict(granularity=granularity, bucket_start=start, user_id=user_id, keyword=keyword,
+                          location=location, searches=searches, results_count=results_count))
+        if len(batch) >= chunk_rows:
+            conn.execute(insert(models.SearchRollup), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(models.SearchRollup), batch)
+    return len(totals)
+
+
+if __name__ == "__main__":
+    import sys
+    from app.database import SessionLocal, engine
+    from app.migrations import run_migrations
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        db = SessionLocal()
+        try:
+            count = backfill(db)
+            db.commit()
+            print(f"✅ تم بناء {count} صف تجميعي")
+        finally:
+            db.close()
@@ -1,10 +1,12 @@
 from fastapi import FastAPI, Depends, Request
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from app import models
 from app.database import engine, get_db
+from app.migrations import run_migrations
+from app.utils.metrics import metrics, metrics_access_allowed, PROMETHEUS_CONTENT_TYPE
 import os
 from pathlib import Path
 
@@ -15,8 +17,9 @@ BASE_DIR = Path(__file__).resolve().parent
 # تأكد من وجود مجلد app/api وبداخله هذه الملفات
 from app.api import search, export, auth, suggestions, admin, payments, chat
 
-# إنشاء جداول قاعدة البيانات
+# إنشاء جداول قاعدة البيانات + تطبيق الترحيلات (أعمدة وفهارس جديدة على الجداول الموجودة)
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI(
     title="24Seven Sales Intelligence Platform",
@@ -56,6 +59,29 @@ os.makedirs(images_path, exist_ok=True)
 app.mount("/images", StaticFiles(directory=str(images_path)), name="images")
 
 
+# --- تشغيل عامل المهام داخل السيرفر (اختياري: RUN_EMBEDDED_WORKER=1) ---
+# الوضع المفضل هو عملية منفصلة: python -m tasks.worker --concurrency 2
+@app.on_event("startup")
+def start_embedded_worker():
+    if os.environ.get("RUN_EMBEDDED_WORKER") == "1":
+        from tasks.worker import start_embedded_worker as _start
+        _start()
+
+# --- إغلاق متصفحات المسبح عند إيقاف السيرفر ---
+@app.on_event("shutdown")
+def shutdown_browsers():
+    from app.engines.driver_pool import driver_pool
+    driver_pool.shutdown()
+
+# --- قياسات مراحل السحب بصيغة Prometheus (مدة كل مرحلة + النتيجة) ---
+# داخلي فقط (METRICS_TOKEN أو شبكة خاصة). مراحل العامل المنفصل على منفذه: WORKER_METRICS_PORT
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    if not metrics_access_allowed(request.client.host if request.client else None,
+                                  request.headers.get("authorization"), request.headers.get("x-forwarded-for")):
+        return Response(status_code=403)
+    return Response(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # --- 5. المسارات الخلفية (Backend Routes) ---
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(search.router, prefix="/search", tags=["Search Engine"])
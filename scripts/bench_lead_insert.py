@@ -0,0 +1,100 @@
+"""
+مقارنة سرعة حفظ العملاء: commit لكل عميل (الطريقة القديمة) مقابل LeadWriter (الحفظ المجمع).
+
+    python -m scripts.bench_lead_insert
+    BENCH_DATABASE_URL=postgresql://... python -m scripts.bench_lead_insert
+
+الافتراضي قاعدة SQLite مؤقتة على الهارد (حتى يكون fsync حقيقياً).
+"""
+import os
+import time
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.utils.lead_writer import LeadWriter
+
+SIZES = (100, 1000, 10000)
+
+
+def _make_row(user_id, i):
+    # مفاتيح فريدة لكل صف (هاتف / دومين / اسم) حتى يقيس الحفظ المجمع إضافات فعلية وليس دمج مكررات
+    return dict(
+        user_id=user_id,
+        company_name=f"Company {i}",
+        industry="real estate",
+        location="Cairo",
+        phone=f"010{i:08d}",
+        website=f"https://company{i}.com",
+        email=f"info@company{i}.com",
+        email_status="Valid",
+        confidence_score=100.0,
+        decision_maker_name="",
+        decision_maker_role="",
+        linkedin_url=""
+    )
+
+
+def bench_commit_per_lead(Session, user_id, n, offset=0):
+    db = Session()
+    started = time.perf_counter()
+    for i in range(offset, offset + n):
+        db.add(models.Lead(**_make_row(user_id, i)))
+        db.commit()
+    elapsed = time.perf_counter() - started
+    db.close()
+    return elapsed
+
+
+def bench_lead_writer(Session, user_id, n, offset=0):
+    db = Session()
+    started = time.perf_counter()
+    with LeadWriter(db, flush_interval=3600) as writer:
+        for i in range(offset, offset + n):
+            writer.add(_make_row(user_id, i))
+    elapsed = time.perf_counter() - started
+    db.close()
+    return elapsed
+
+
+def main():
+    url = os.environ.get("BENCH_DATABASE_URL")
+    tmpdir = None
+    if not url:
+        tmpdir = tempfile.mkdtemp()
+        url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+
+    engine = create_engine(url, connect_args={"check_same_thread": False} if "sqlite" in url else {})
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = Session()
+    user = models.User(email=f"bench-{time.time()}@24seven.com", full_name="Bench")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    print(f"DB: {url}")
+    print(f"{'leads':>8} | {'commit/lead rows/s':>20} | {'LeadWriter rows/s':>18} | speedup")
+    offset = 0
+    for n in SIZES:
+        old = bench_commit_per_lead(Session, user_id, n, offset)
+        new = bench_lead_writer(Session, user_id, n, offset + n)
+        offset += 2 * n
+        print(f"{n:>8} | {n / old:>20,.0f} | {n / new:>18,.0f} | x{old / new:.1f}")
+
+    # تنظيف بيانات التجربة
+    # (الجداول التابعة أولاً: Postgres يرفض حذف العملاء / المستخدم مع وجود مفاتيح أجنبية عليهم)
+    db = Session()
+    db.query(models.LeadKey).filter(models.LeadKey.user_id == user_id).delete()
+    db.query(models.UserLeadStats).filter(models.UserLeadStats.user_id == user_id).delete()
+    db.query(models.Lead).filter(models.Lead.user_id == user_id).delete()
+    db.query(models.User).filter(models.User.id == user_id).delete()
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+فحص عدد استعلامات SQL لكل Endpoint (ميزانية ثابتة لا تكبر مع حجم البيانات):
+يفشل (exit code 1) إذا تجاوز أي Endpoint ميزانيته، وهو ما يحدث عند رجوع نمط N+1.
+
+    python -m scripts.check_query_budgets
+    CHECK_DATABASE_URL=postgresql://... python -m scripts.check_query_budgets
+
+الافتراضي قاعدة SQLite مؤقتة يتم إنشاؤها بنفس الجداول والترحيلات.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.migrations import run_migrations
+from app.utils.query_counter import count_queries
+from app.utils.admin_kpis import compute_admin_kpis
+from app.api.chat import get_admin_chats
+from app.api.admin import get_pending_payments
+
+SEED_USERS = int(os.environ.get("CHECK_SEED_USERS", 50))
+
+
+def endpoints():
+    """(الاسم، الدالة، أقصى عدد استعلامات مسموح)"""
+    return [
+        ("GET /chat/admin/all-chats", lambda db: asyncio.run(get_admin_chats(db=db)), 1),
+        ("GET /admin/pending-payments", lambda db: get_pending_payments(db=db), 1),
+        ("GET /admin/stats (KPIs)", compute_admin_kpis, 2),
+    ]
+
+
+def seed(db):
+    now = datetime.utcnow()
+    for i in range(SEED_USERS):
+        user = models.User(email=f"budget-{i}@24seven.com", full_name=f"User {i}")
+        db.add(user)
+        db.flush()
+        for j in range(3):
+            db.add(models.ChatMessage(user_id=user.id, message=f"msg {j}", sender="user", created_at=now + timedelta(seconds=j)))
+        db.add(models.PaymentRequest(user_id=user.id, amount=100, tokens_requested=100, status="Pending"))
+    db.commit()
+
+
+def main():
+    url = os.environ.get("CHECK_DATABASE_URL")
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'budgets.db')}"
+
+    engine = create_engine(url, connect_args={"check_same_thread": False} if "sqlite" in url else {})
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    db = sessionmaker(bind=engine)()
+    seed(db)
+
+    failed = False
+    for name, call, budget in endpoints():
+        db.expire_all()
+        with count_queries(engine) as counter:
+            result = call(db)
+        ok = counter.count <= budget
+        print(f"{'✅ OK' if ok else '❌ OVER BUDGET'}  {name}: {counter.count} استعلام (الحد {budget}) - {len(result)} عنصر")
+        if not ok:
+            for statement in counter.statements:
+                print(f"      {statement.splitlines()[0]}")
+        failed = failed or not ok
+
+    db.close()
+    engine.dispose()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+فحص خطط التنفيذ (EXPLAIN) لأهم استعلامات جدول العملاء:
+يفشل (exit code 1) إذا رجع أي استعلام لمسح الجدول بالكامل (Full Scan) بدلاً من استخدام الفهارس،
+أو إذا لم يستخدم استعلام صفحات العميل فهرس (user_id, id) نفسه (مسح نطاق id لكل المستخدمين ليس تكلفة صفحة ثابتة).
+
+    python -m scripts.check_query_plans
+    CHECK_DATABASE_URL=postgresql://... python -m scripts.check_query_plans
+
+الافتراضي قاعدة SQLite مؤقتة يتم إنشاؤها بنفس الجداول والترحيلات.
+"""
+import os
+import sys
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.migrations import run_migrations
+from app.utils.lead_search import industry_stats_query
+from app.api.export import _leads_query
+from app.api.search import my_leads_query, LEAD_FIELDS
+
+
+USER_PAGE_INDEX = "ix_leads_user_id_id"
+INDUSTRIES = ["Real Estate", "Dental Clinic", "Restaurant", "Gym", "Law Firm", "Hotel", "Pharmacy", "Bakery"]
+LOCATIONS = ["Cairo", "Giza", "Alexandria", "Riyadh"]
+
+
+def hot_queries(db, user_id, after_id):
+    """نفس الاستعلامات التي تستخدمها الـ Endpoints: الاسم -> (الاستعلام، الفهرس المطلوب أو None)"""
+    return {
+        "export: keyword + location": (_leads_query(db, user_id, "real estate", "cairo"), None),
+        "export: keyword only": (_leads_query(db, user_id, "real estate", "All"), None),
+        "my-leads: first page": (my_leads_query(db, user_id, list(LEAD_FIELDS)), USER_PAGE_INDEX),
+        "my-leads: next page (keyset)": (my_leads_query(db, user_id, list(LEAD_FIELDS), after_id=after_id), USER_PAGE_INDEX),
+        "my-leads: industry filter": (my_leads_query(db, user_id, ["id", "company_name", "phone"], after_id=after_id, industry="estate"), USER_PAGE_INDEX),
+        "ai-hint: industry stats": (industry_stats_query(db, "estate"), None),
+    }
+
+
+def _compile(db, query):
+    return str(query.statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+
+
+def explain(db, sql, required_index=None):
+    """خطة التنفيذ + قائمة المشاكل (مسح كامل، أو الفهرس المطلوب غير مستخدم)"""
+    conn = db.connection()
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        plan = [row[-1] for row in rows]
+        problems = [line for line in plan if line.startswith("SCAN leads") and not line.startswith("SCAN leads_fts") and "INDEX" not in line]
+    else:
+        # على الجداول الصغيرة Postgres يفضل Seq Scan دائماً، لذلك نمنعه لنرى هل يوجد فهرس صالح أصلاً
+        conn.exec_driver_sql("SET enable_seqscan = off")
+        plan = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {sql}").fetchall()]
+        problems = [line for line in plan if "Seq Scan on leads" in line]
+    if required_index and not any(required_index in line for line in plan):
+        problems.append(f"{required_index} غير مستخدم")
+    return plan, problems
+
+
+def main():
+    url = os.environ.get("CHECK_DATABASE_URL")
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+
+    engine = create_engine(url, connect_args={"check_same_thread": False} if "sqlite" in url else {})
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    db = sessionmaker(bind=engine)()
+
+    # عدة مستخدمين ومجالات: إحصائيات ANALYZE على مستخدم واحد ومجال واحد تجعل كل فهرس يبدو بلا فائدة
+    users = []
+    for u in range(20):
+        user = models.User(email=f"plans-check-{u}@24seven.com", full_name="Plans")
+        db.add(user)
+        db.flush()
+        users.append(user)
+        for i in range(50):
+            db.add(models.Lead(user_id=user.id, company_name=f"Company {u}-{i}",
+                               industry=INDUSTRIES[(u + i) % len(INDUSTRIES)], location=LOCATIONS[i % len(LOCATIONS)]))
+    db.flush()
+    user = users[len(users) // 2]
+    after_id = db.query(models.Lead.id).filter(models.Lead.user_id == user.id).order_by(models.Lead.id).offset(25).limit(1).scalar()
+    if engine.dialect.name == "sqlite":
+        db.connection().exec_driver_sql("ANALYZE")
+
+    failed = False
+    for name, (query, required_index) in hot_queries(db, user.id, after_id).items():
+        plan, problems = explain(db, _compile(db, query), required_index)
+        status = "❌ " + "; ".join(problems) if problems else "✅ OK"
+        print(f"{status}  {name}")
+        for line in plan:
+            print(f"      {line}")
+        failed = failed or bool(problems)
+
+    db.rollback()
+    db.close()
+    engine.dispose()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
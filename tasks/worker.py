@@ -0,0 +1,375 @@
+"""
+عامل تشغيل مهام البحث (Worker) - يعمل كعملية منفصلة عن سيرفر الويب:
+
+    python -m tasks.worker --concurrency 2
+
+الطابور نفسه هو جدول search_jobs في قاعدة البيانات (SQLite محلياً / Postgres على السيرفر)،
+لذلك المهام لا تضيع عند إعادة تشغيل السيرفر.
+"""
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from app.database import SessionLocal, engine
+from app import models
+from app.utils.job_progress import JobProgress, prune_job_events, add_event, notify
+from app.utils.job_checkpoint import JobCheckpoint
+
+# --- الإعدادات ---
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 2))
+POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 2))
+RETRY_BASE_DELAY = int(os.environ.get("WORKER_RETRY_BASE_DELAY", 30))   # ثواني (تتضاعف مع كل محاولة)
+STALE_AFTER = int(os.environ.get("WORKER_STALE_AFTER", 1800))           # مهمة "running" بدون عامل حي
+HEARTBEAT_INTERVAL = float(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 60))   # تحديث locked_at أثناء التشغيل
+STALE_SWEEP_INTERVAL = float(os.environ.get("WORKER_STALE_SWEEP_INTERVAL", 300))
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", 9102))  # منفذ /metrics للعامل المنفصل (0 = معطل)
+WORKER_METRICS_HOST = os.environ.get("WORKER_METRICS_HOST", "0.0.0.0")
+
+
+# --- 1. إضافة مهمة للطابور (يستخدمها سيرفر الويب) ---
+def enqueue_search(db, user_id: int, keyword: str, location: str, limit: int, commit: bool = True):
+    job = models.SearchJob(
+        user_id=user_id,
+        keyword=keyword,
+        location=location,
+        target_limit=limit,
+        credits_charged=limit,
+        status="queued",
+        run_after=datetime.utcnow()
+    )
+    db.add(job)
+    if commit:
+        db.commit()
+        db.refresh(job)
+    return job
+
+
+def enqueue_batch(db, user_id: int, queries: list, commit: bool = True):
+    """queries: [{"keyword", "location", "target_limit"}, ...] - الرصيد يُخصم بالحد الأقصى ويُرد الفرق بعد الانتهاء"""
+    total = sum(q["target_limit"] for q in queries)
+    job = models.SearchJob(
+        user_id=user_id,
+        kind="batch",
+        keyword=", ".join(dict.fromkeys(q["keyword"] for q in queries))[:200],
+        location=", ".join(dict.fromkeys(q["location"] for q in queries))[:200],
+        target_limit=total,
+        payload=json.dumps(queries, ensure_ascii=False),
+        credits_charged=total,
+        status="queued",
+        run_after=datetime.utcnow()
+    )
+    db.add(job)
+    if commit:
+        db.commit()
+        db.refresh(job)
+    return job
+
+
+def refund_credits(db, job, delivered: int):
+    """
+    رد رصيد العملاء الذين لم يتم تسليمهم (بدون commit: مع نفس Transaction حالة المهمة).
+    الرصيد يُحجز بالحد الأقصى عند الطلب، والدفع النهائي = عدد العملاء المُسلّمين.
+    """
+    refund = max(0, (job.credits_charged or 0) - (delivered or 0))
+    if refund:
+        db.query(models.User).filter(models.User.id == job.user_id).update(
+            {models.User.credits: models.User.credits + refund}, synchronize_session=False
+        )
+        job.credits_charged -= refund
+        print(f"💰 [Worker] رد {refund} نقطة للمستخدم #{job.user_id} (Job #{job.id})")
+    return refund
+
+
+# --- 2. حجز مهمة بشكل آمن بين أكثر من عامل ---
+def claim_next_job(db, worker_id: str):
+    now = datetime.utcnow()
+    candidate = db.query(models.SearchJob.id).filter(
+        models.SearchJob.status == "queued",
+        models.SearchJob.run_after <= now,
+        models.SearchJob.attempts < models.SearchJob.max_attempts
+    ).order_by(models.SearchJob.id.asc()).first()
+
+    if not candidate:
+        return None
+
+    # تحديث مشروط: ينجح عامل واحد فقط في حجز نفس المهمة
+    claimed = db.query(models.SearchJob).filter(
+        models.SearchJob.id == candidate.id,
+        models.SearchJob.status == "queued",
+        models.SearchJob.attempts < models.SearchJob.max_attempts
+    ).update({
+        models.SearchJob.status: "running",
+        models.SearchJob.locked_by: worker_id,
+        models.SearchJob.locked_at: now,
+        models.SearchJob.started_at: now,
+        models.SearchJob.attempts: models.SearchJob.attempts + 1
+    }, synchronize_session=False)
+    db.commit()
+
+    return candidate.id if claimed == 1 else None
+
+
+REQUEUE_VALUES = {
+    models.SearchJob.status: "queued",
+    models.SearchJob.locked_by: None,
+}
+
+
+def fail_job(db, job, error: str):
+    """
+    فشل نهائي (بدون commit): العملاء المحفوظين قبل الفشل تم تسليمهم، والباقي يُرد.
+    حدث failed يُضاف في نفس الـ Transaction.
+    """
+    job.status = "failed"
+    job.locked_by = None
+    job.last_error = error[:2000]
+    job.finished_at = datetime.utcnow()
+    job.results_count = job.delivered_count or 0
+    job.checkpoint = None
+    refunded = refund_credits(db, job, job.delivered_count)
+    add_event(db, job.id, "failed", error=job.last_error, credits_refunded=refunded)
+    return refunded
+
+
+def _requeue_or_fail(db, conditions, reason: str):
+    """
+    مهام عامل مات أثناء تشغيلها: ترجع للطابور ما دامت attempts < max_attempts،
+    وإلا تفشل نهائياً ويُرد رصيدها (مهمة تُسقط العامل نفسه، مثل نفاد ذاكرة Chrome، لا تتكرر للأبد).
+    """
+    requeued = db.query(models.SearchJob).filter(
+        *conditions, models.SearchJob.attempts < models.SearchJob.max_attempts
+    ).update({**REQUEUE_VALUES, models.SearchJob.run_after: datetime.utcnow()}, synchronize_session=False)
+
+    failed = []
+    for job in db.query(models.SearchJob).filter(*conditions, models.SearchJob.attempts >= models.SearchJob.max_attempts).all():
+        # تحديث مشروط: عاملان يفحصان في نفس اللحظة لا يردان الرصيد مرتين
+        if db.query(models.SearchJob).filter(models.SearchJob.id == job.id, *conditions).update(
+                {models.SearchJob.status: "failed"}, synchronize_session=False) != 1:
+            continue
+        fail_job(db, job, f"{reason} ({job.attempts}/{job.max_attempts} محاولات)")
+        failed.append(job.id)
+    db.commit()
+    for job_id in failed:
+        notify(job_id)
+    if failed:
+        print(f"❌ [Worker] {len(failed)} مهمة استنفدت محاولاتها بعد توقف العامل: تم إنهاؤها ورد الرصيد")
+    return requeued
+
+
+def requeue_stale_jobs(db):
+    """
+    إرجاع المهام العالقة (عامل مات أثناء التشغيل) للطابور.
+    المهمة الحية تحدّث locked_at كل HEARTBEAT_INTERVAL، والمهمة المُعادة تكمل من آخر Checkpoint.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=STALE_AFTER)
+    count = _requeue_or_fail(db, (
+        models.SearchJob.status == "running",
+        models.SearchJob.locked_at < cutoff
+    ), "توقف العامل أثناء التشغيل")
+    # مهام أُعيدت للطابور قبل هذا الحد وتجاوزت محاولاتها (لن يحجزها claim_next_job)
+    _requeue_or_fail(db, (
+        models.SearchJob.status == "queued",
+        models.SearchJob.attempts >= models.SearchJob.max_attempts
+    ), "تجاوزت الحد الأقصى للمحاولات")
+    if count:
+        print(f"♻️ [Worker] تم إرجاع {count} مهمة عالقة للطابور")
+    return count
+
+
+def _pid_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def requeue_dead_local_jobs(db, worker_id: str):
+    """
+    عند بدء العامل: مهام "running" محجوزة باسم نفس الجهاز بـ PID لم يعد موجوداً
+    (عامل سابق انهار / أعيد تشغيله) تُرجع فوراً بدون انتظار STALE_AFTER.
+    """
+    host = worker_id.rsplit(":", 1)[0]
+    dead = []
+    for job_id, locked_by in db.query(models.SearchJob.id, models.SearchJob.locked_by).filter(
+            models.SearchJob.status == "running", models.SearchJob.locked_by.like(f"{host}:%")):
+        pid = locked_by.rsplit(":", 1)[1]
+        if locked_by != worker_id and pid.isdigit() and not _pid_alive(int(pid)):
+            dead.append(job_id)
+    if not dead:
+        return 0
+    count = _requeue_or_fail(db, (
+        models.SearchJob.id.in_(dead),
+        models.SearchJob.status == "running"
+    ), "توقف العامل أثناء التشغيل")
+    if count:
+        print(f"♻️ [Worker] تم إرجاع {count} مهمة من عامل سابق متوقف على نفس الجهاز")
+    return count
+
+
+def _heartbeat(job_id: int, worker_id: str, stop_event: threading.Event):
+    """
+    نبض المهمة أثناء المراحل الطويلة (سحب الخرائط / الإثراء) بجلسة مستقلة،
+    حتى لا تُعتبر عالقة بين نقطتي حفظ.
+    """
+    while not stop_event.wait(HEARTBEAT_INTERVAL):
+        db = SessionLocal()
+        try:
+            db.query(models.SearchJob).filter(
+                models.SearchJob.id == job_id,
+                models.SearchJob.status == "running",
+                models.SearchJob.locked_by == worker_id
+            ).update({models.SearchJob.locked_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ [Worker] تعذر تحديث نبض Job #{job_id}: {e}")
+        finally:
+            db.close()
+
+
+# --- 3. تنفيذ مهمة واحدة (بجلسة قاعدة بيانات خاصة بها) ---
+def run_job(job_id: int, worker_id: str = None):
+    from app.api.search import run_full_scraping_task, run_batch_scraping_task
+
+    db = SessionLocal()
+    progress = JobProgress(job_id)
+    checkpoint = JobCheckpoint(job_id)
+    beating = threading.Event()
+    if worker_id:
+        threading.Thread(target=_heartbeat, args=(job_id, worker_id, beating), name=f"heartbeat-{job_id}", daemon=True).start()
+    try:
+        job = db.get(models.SearchJob, job_id)
+        try:
+            if job.kind == "batch":
+                leads_saved = run_batch_scraping_task(json.loads(job.payload), job.user_id, db, progress=progress, checkpoint=checkpoint)
+            else:
+                leads_saved = run_full_scraping_task(job.keyword, job.location, job.user_id, db, job.target_limit,
+                                                     progress=progress, checkpoint=checkpoint)
+            # أحداث التقدم المتبقية قبل الحدث الأخير (بجلستها المستقلة، قبل أي كتابة هنا)
+            progress.flush()
+            job.status = "done"
+            job.results_count = leads_saved or 0
+            job.delivered_count = job.results_count
+            job.last_error = None
+            job.finished_at = datetime.utcnow()
+            job.checkpoint = None  # لم تعد هناك حاجة للاستكمال
+            refunded = refund_credits(db, job, job.results_count)
+            add_event(db, job_id, "finished", results_count=job.results_count, credits_refunded=refunded)
+        except Exception as e:
+            db.rollback()
+            progress.flush()
+            job = db.get(models.SearchJob, job_id)
+            if job.attempts < job.max_attempts:
+                delay = RETRY_BASE_DELAY * (2 ** (job.attempts - 1))
+                job.last_error = str(e)[:2000]
+                job.status = "queued"
+                job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+                print(f"🔁 [Worker] Job #{job_id} فشلت (محاولة {job.attempts}). إعادة المحاولة بعد {delay} ثانية")
+                add_event(db, job_id, "retrying", attempt=job.attempts, retry_in=delay, error=job.last_error)
+            else:
+                print(f"❌ [Worker] Job #{job_id} فشلت نهائياً: {e}")
+                fail_job(db, job, str(e))
+        job.locked_by = None
+        # الحدث الأخير في نفس Transaction حالة المهمة: البث لا يرى done / failed بدون حدثها
+        db.commit()
+        notify(job_id)
+    finally:
+        beating.set()
+        progress.flush()
+        db.close()
+
+
+# --- 4. الحلقة الرئيسية للعامل ---
+def run_worker(concurrency: int = WORKER_CONCURRENCY, stop_event: threading.Event = None):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    slots = threading.Semaphore(concurrency)
+    print(f"👷 [Worker] {worker_id} يعمل بعدد {concurrency} مهمة متزامنة")
+
+    def _sweep(startup=False):
+        db = SessionLocal()
+        try:
+            if startup:
+                requeue_dead_local_jobs(db, worker_id)
+            requeue_stale_jobs(db)
+            prune_job_events(db)
+        except Exception as e:
+            print(f"⚠️ [Worker] خطأ أثناء فحص المهام العالقة: {e}")
+        finally:
+            db.close()
+
+    _sweep(startup=True)
+    last_sweep = time.monotonic()
+
+    def _run_and_free(job_id):
+        try:
+            run_job(job_id, worker_id)
+        except Exception as e:
+            print(f"❌ [Worker] خطأ غير متوقع في Job #{job_id}: {e}")
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job") as executor:
+        while not stop_event.is_set():
+            # فحص دوري (وليس عند البدء فقط): عامل آخر مات أثناء تشغيل مهمة
+            if time.monotonic() - last_sweep >= STALE_SWEEP_INTERVAL:
+                _sweep()
+                last_sweep = time.monotonic()
+
+            if not slots.acquire(timeout=POLL_INTERVAL):
+                continue
+
+            db = SessionLocal()
+            try:
+                job_id = claim_next_job(db, worker_id)
+            except Exception as e:
+                print(f"⚠️ [Worker] خطأ أثناء قراءة الطابور: {e}")
+                job_id = None
+            finally:
+                db.close()
+
+            if job_id is None:
+                slots.release()
+                stop_event.wait(POLL_INTERVAL)
+                continue
+
+            print(f"📥 [Worker] بدء Job #{job_id}")
+            executor.submit(_run_and_free, job_id)
+
+
+def start_embedded_worker(concurrency: int = WORKER_CONCURRENCY):
+    """تشغيل العامل داخل عملية السيرفر نفسها (للبيئات التي لا تدعم عملية منفصلة)"""
+    thread = threading.Thread(target=run_worker, args=(concurrency,), name="embedded-worker", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="24Seven search job worker")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    from app.migrations import run_migrations
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    if WORKER_METRICS_PORT:
+        from app.utils.metrics import start_metrics_server
+        from app.api.search import engine_stats
+        try:
+            # مسبح المتصفحات / الكاشات / حدود المواقع الحقيقية في هذه العملية وليس في سيرفر الويب
+            start_metrics_server(WORKER_METRICS_PORT, WORKER_METRICS_HOST,
+                                 json_routes={"/engine-stats": lambda: engine_stats("worker")})
+        except OSError as e:
+            # المنفذ مستخدم (أكثر من عامل على نفس الجهاز): العامل يعمل بدون Exporter
+            print(f"⚠️ [Metrics] تعذر تشغيل /metrics على المنفذ {WORKER_METRICS_PORT}: {e}")
+    try:
+        run_worker(args.concurrency)
+    except KeyboardInterrupt:
+        print("🛑 [Worker] تم الإيقاف")